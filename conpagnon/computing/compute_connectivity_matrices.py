@@ -9,10 +9,12 @@ ComPagnon 2.0
 
 """
 from conpagnon.data_handling.data_architecture import read_text_data_file, create_group_dictionnary
-from conpagnon.data_handling import atlas
+from conpagnon.data_handling import atlas, connectivity_store
 import numpy as np
-from nilearn import input_data
-from nilearn.connectome import ConnectivityMeasure, vec_to_sym_matrix
+import nibabel as nb
+from nilearn import input_data, image
+from nilearn.connectome import vec_to_sym_matrix, sym_matrix_to_vec
+from sklearn.covariance import LedoitWolf
 from conpagnon.utils.array_operation import masked_arrays_mean, check_2d, vectorizer
 from copy import deepcopy
 from conpagnon.utils import array_operation
@@ -24,7 +26,12 @@ from scipy.stats import zmap, ttest_1samp
 from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
 from conpagnon.utils.folders_and_files_management import save_object
+from conpagnon.utils import time_series_cache, pre_preprocessing
+from conpagnon.computing import signal_extraction, covariance_engine, tangent_space, sparse_precision
 import os
+import time
+import hashlib
+from joblib import Parallel, delayed, effective_n_jobs
 from statsmodels.stats.multitest import multipletests
 
 
@@ -57,6 +64,9 @@ def create_connectivity_mask(time_series_dictionary, groupes):
     -----
     If 'discarded_rois' is empty the mask is False at every position
     in the array.
+    The masks are compact, see conpagnon.utils.array_operation.DiscardedRoisMask:
+    only the discarded rois index are stored, and the dense boolean array is
+    built when needed.
     Almost all the operation in ConPagnon accounts for discarded rois with
     masked array via the dedicated module in NumPy.
 
@@ -64,26 +74,16 @@ def create_connectivity_mask(time_series_dictionary, groupes):
     for group in groupes:
         subject_in_group = list(time_series_dictionary[group].keys())
         for subject in subject_in_group:
-            # If a field discarded_rois exist:
             number_of_regions = time_series_dictionary[group][subject]['time_series'].shape[1]
-            # mask computation
-            subject_mask = np.zeros((number_of_regions, number_of_regions), dtype='bool')
+            # If a field discarded_rois exist, the mask is True for the entire rows
+            # and columns of the discarded rois, and False everywhere if not
             if 'discarded_rois' in time_series_dictionary[group][subject].keys():
-                # We compute a mask according the position of discarded roi
-                # number of regions
                 empty_roi_position = time_series_dictionary[group][subject]['discarded_rois']
-                # Replace by True the boolean value position corresponding to discarded rois
-                # If empty_roi_position is not empty
-                if empty_roi_position.size > 0:
-                    for discarded_roi in empty_roi_position:
-                        # True for the entire rows corresponding to the current empty roi
-                        subject_mask[:, discarded_roi] = True
-                        # True for the entire columns corresponding to the current empty roi
-                        subject_mask[discarded_roi, :] = True
             else:
-                # We compute a mask, with False everywhere, because all the test
-                # is performed with masked array in general.
-                subject_mask = subject_mask
+                empty_roi_position = []
+            # Only the index of the discarded rois are stored
+            subject_mask = array_operation.DiscardedRoisMask(discarded_rois=empty_roi_position,
+                                                             number_of_regions=number_of_regions)
 
             # Create a new field
             time_series_dictionary[group][subject]['masked_array'] = subject_mask
@@ -91,12 +91,646 @@ def create_connectivity_mask(time_series_dictionary, groupes):
     return time_series_dictionary
 
 
+def atlas_fingerprint(atlas_file, atlas_fingerprints=None):
+    """Compute the fingerprint of an atlas, from its geometry and data.
+
+    Parameters
+    ----------
+    atlas_file: str
+        The full path to the atlas.
+    atlas_fingerprints: dict, optional
+        The already computed fingerprints, with the absolute atlas
+        paths as keys. It is updated in place. Default is None.
+
+    Returns
+    -------
+    output: str
+        The hexadecimal SHA-256 hash of the atlas shape, affine, data
+        type and data.
+
+    Notes
+    -----
+    Two atlas files with the same fingerprint define the same regions, even
+    if they are stored under different names, or with a different
+    compression, like the individual atlas copied in each session
+    directory of a longitudinal study.
+    """
+    atlas_path = os.path.abspath(atlas_file)
+    if atlas_fingerprints is not None and atlas_path in atlas_fingerprints:
+        return atlas_fingerprints[atlas_path]
+
+    atlas_img = nb.load(atlas_path)
+    atlas_data = np.ascontiguousarray(atlas_img.dataobj)
+    sha = hashlib.sha256()
+    sha.update(str(atlas_img.shape).encode('utf-8'))
+    sha.update(np.asarray(atlas_img.affine, dtype=np.float64).tobytes())
+    sha.update(str(atlas_data.dtype).encode('utf-8'))
+    sha.update(atlas_data.tobytes())
+    fingerprint = sha.hexdigest()
+
+    if atlas_fingerprints is not None:
+        atlas_fingerprints[atlas_path] = fingerprint
+
+    return fingerprint
+
+
+def fetch_resampled_atlas(atlas_img, subject_fmri, resampled_atlas_cache, atlas_key=None,
+                          interpolation='continuous'):
+    """Resample an atlas to the grid of a functional image, re-using a
+    previous resampling on the same grid if it exist.
+
+    Parameters
+    ----------
+    atlas_img: str or Nifti1Image
+        The atlas to resample.
+    subject_fmri: str
+        The full path to the subject functional image. Only
+        the header is read, to fetch the target shape and affine.
+    resampled_atlas_cache: dict
+        The cache of resampled atlases, with (atlas_key, shape, affine,
+        interpolation) tuples as keys, and the resampled atlases as values.
+        It is updated in place.
+    atlas_key: str, optional
+        The key identifying the atlas in the cache. If None,
+        `atlas_img` is used if it's a path.
+    interpolation: str, optional
+        The resampling interpolation, 'continuous' for maps atlases,
+        and 'nearest' for labels atlases. Default is 'continuous'.
+
+    Returns
+    -------
+    output: Nifti1Image
+        The atlas resampled to the subject functional image grid.
+
+    Notes
+    -----
+    The resampling is the one performed by nilearn.input_data.NiftiMapsMasker,
+    or nilearn.input_data.NiftiLabelsMasker with the nearest interpolation,
+    when the resampling target is the data, so the masker find the atlas
+    already on the data grid and skip the resampling.
+    """
+    if atlas_key is None:
+        atlas_key = atlas_img if isinstance(atlas_img, str) else id(atlas_img)
+
+    # Read the header only, the data are not loaded
+    subject_header = nb.load(subject_fmri)
+    target_shape = tuple(subject_header.shape[:3])
+    target_affine = subject_header.affine
+    cache_key = (atlas_key, target_shape, target_affine.tobytes(), interpolation)
+
+    if cache_key not in resampled_atlas_cache:
+        resampled_atlas_cache[cache_key] = image.resample_img(atlas_img, interpolation=interpolation,
+                                                              target_shape=target_shape,
+                                                              target_affine=target_affine)
+
+    return resampled_atlas_cache[cache_key]
+
+
+def fetch_projection_operator(atlas_img, projection_operator_cache, labels=None):
+    """Build the projection operator of an atlas, re-using it
+    if it was already built.
+
+    Parameters
+    ----------
+    atlas_img: Nifti1Image
+        The atlas, on the functional images grid, typically
+        fetched with fetch_resampled_atlas.
+    projection_operator_cache: dict
+        The cache of projection operators, updated in place.
+    labels: numpy.array, optional
+        If given, the atlas is a 3D deterministic atlas, and those are
+        the labels of the regions, in the order of the extracted signals.
+        Default is None, the atlas is a 4D maps atlas.
+
+    Returns
+    -------
+    output: dict
+        The projection operator, see
+        conpagnon.computing.signal_extraction.maps_projection_operator, or
+        conpagnon.computing.signal_extraction.labels_indicator_operator for
+        a labels atlas.
+    """
+    operator_key = atlas_img if isinstance(atlas_img, str) else id(atlas_img)
+    if operator_key not in projection_operator_cache:
+        if labels is None:
+            projection_operator_cache[operator_key] = signal_extraction.maps_projection_operator(
+                maps_img=atlas_img)
+        else:
+            projection_operator_cache[operator_key] = signal_extraction.labels_indicator_operator(
+                labels_img=atlas_img, labels=labels)
+
+    return projection_operator_cache[operator_key]
+
+
+def subject_time_series_extraction(subject_fmri, subject_confounds, maps_img, masker_parameters,
+                                   projection_operator=None, time_block_size=100, fitted_masker=None,
+                                   extraction_variants=None, fitted_raw_maskers=None):
+    """Extract the time series of one subject, and time the extraction.
+
+    Parameters
+    ----------
+    subject_fmri: str
+        The full path to the subject functional image.
+    subject_confounds: str or None
+        The full path to the subject confounds file, None
+        if no regressors should be removed.
+    maps_img: str or Nifti1Image
+        The 4D atlas defining the regions.
+    masker_parameters: dict
+        The keyword arguments passed to nilearn.input_data.NiftiMapsMasker.
+    projection_operator: dict, optional
+        The sparse projection operator of the atlas on the subject
+        grid. If given, the time series are extracted with the sparse
+        projection engine instead of the masker. Default is None.
+    time_block_size: int, optional
+        The number of volumes read at once by the sparse projection
+        engine. Default is 100.
+    fitted_masker: nilearn.input_data.NiftiMapsMasker, optional
+        A masker already fitted on `maps_img`, shared by the subjects
+        with the same atlas. Default is None, a masker is fitted.
+    extraction_variants: dict, optional
+        The extraction variants, with the variants names as keys, and
+        tuples (masker parameters, confounds strategy) as values, see
+        extraction_variants_parameters. The functional image and the
+        confounds file are read once, the raw regions signals are extracted
+        once for each distinct smoothing, and cleaned for each variant.
+        Default is None, one extraction with `masker_parameters`.
+    fitted_raw_maskers: dict, optional
+        With extraction variants, the maskers fitted on `maps_img` without
+        cleaning, for each smoothing, shared by the subjects with the same
+        atlas. Missing maskers are fitted, and added to the dictionary.
+        Default is None.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (number of time points, number of regions)
+        The subject time series, or a dictionary with the time series of
+        each extraction variant, if they are given.
+    output 2: float
+        The elapsed time, in seconds, for the extraction.
+
+    Notes
+    -----
+    This function is the unit of work dispatched to the joblib
+    workers by the time series extraction functions. It must stay
+    a module level function to be pickled.
+    """
+    tic = time.time()
+    if extraction_variants is not None:
+        # The functional image is read once, for each distinct smoothing the
+        # raw regions signals are extracted once, and cleaned for each variant
+        smoothings_fwhm = list(dict.fromkeys(variant_parameters['smoothing_fwhm']
+                                             for variant_parameters, _ in extraction_variants.values()))
+        if projection_operator is None:
+            if fitted_raw_maskers is None:
+                fitted_raw_maskers = dict()
+            subject_img = image.load_img(subject_fmri)
+            subject_img = nb.Nifti1Image(np.asanyarray(subject_img.dataobj), subject_img.affine,
+                                         subject_img.header)
+            subject_raw_signals = dict()
+            for smoothing_fwhm in smoothings_fwhm:
+                if smoothing_fwhm not in fitted_raw_maskers:
+                    fitted_raw_maskers[smoothing_fwhm] = input_data.NiftiMapsMasker(
+                        maps_img=maps_img, **signal_extraction.raw_masker_parameters(
+                            dict(masker_parameters, smoothing_fwhm=smoothing_fwhm))).fit()
+                subject_raw_signals[smoothing_fwhm] = fitted_raw_maskers[smoothing_fwhm].transform(subject_img)
+        else:
+            subject_raw_signals = signal_extraction.smoothed_raw_signals(
+                img=subject_fmri, extraction_operator=projection_operator,
+                smoothings_fwhm=smoothings_fwhm, time_block_size=time_block_size)
+        if subject_confounds is not None:
+            subject_confounds_table = signal_extraction.load_confounds_table(confounds_file=subject_confounds)
+        else:
+            subject_confounds_table = None
+        subject_time_series = signal_extraction.clean_variants_signals(
+            raw_signals=subject_raw_signals, confounds_table=subject_confounds_table,
+            extraction_variants=extraction_variants)
+    elif projection_operator is None:
+        if fitted_masker is None:
+            fitted_masker = input_data.NiftiMapsMasker(maps_img=maps_img, **masker_parameters).fit()
+        subject_time_series = fitted_masker.transform(subject_fmri, confounds=subject_confounds)
+    else:
+        subject_time_series = signal_extraction.sparse_maps_time_series(
+            subject_fmri=subject_fmri, subject_confounds=subject_confounds,
+            projection_operator=projection_operator, masker_parameters=masker_parameters,
+            time_block_size=time_block_size)
+    tac = time.time() - tic
+
+    return subject_time_series, tac
+
+
+def atlas_batch_time_series_extraction(subjects_kwargs, atlas_kwargs, subjects_ids=None, cache_keys=None,
+                                       time_series_cache_directory=None, verbose=0):
+    """Extract the time series of a batch of subjects sharing the same atlas.
+
+    Parameters
+    ----------
+    subjects_kwargs: list
+        The list of the subjects keyword arguments, 'subject_fmri'
+        and 'subject_confounds', see subject_time_series_extraction.
+    atlas_kwargs: dict
+        The keyword arguments shared by the batch: 'maps_img',
+        'masker_parameters', 'projection_operator', 'time_block_size'
+        and 'extraction_variants', see subject_time_series_extraction.
+    subjects_ids: list, optional
+        The tuples (groupe, subject) of the subjects, in the order of
+        `subjects_kwargs`, reported when an extraction fails, and saved
+        in the cache. Default is None.
+    cache_keys: list, optional
+        The cache keys of the subjects time series, in the order of
+        `subjects_kwargs`. Default is None.
+    time_series_cache_directory: str, optional
+        The full path to a time series cache directory, where each time
+        series is saved as soon as it is extracted. Default is None, no cache.
+    verbose: int, optional
+        If strictly positive, print the extraction time of each subject as
+        soon as it is extracted. Default is 0.
+
+    Returns
+    -------
+    output: list
+        The list of tuples (time series, elapsed time), in the order
+        of `subjects_kwargs`.
+
+    Raises
+    ------
+    RuntimeError
+        If the extraction of a subject fails, with the subject group,
+        identifier and functional file. The subjects of the batch extracted
+        before it are already saved in the cache.
+
+    Notes
+    -----
+    The atlas, and its projection operator, are sent once to the worker
+    running the batch, and the masker is fitted once for all the subjects
+    of the batch.
+    """
+    if subjects_ids is None:
+        subjects_ids = [(None, None)] * len(subjects_kwargs)
+    fitted_masker = None
+    # With extraction variants, the raw maskers are fitted by the first
+    # subject of the batch, one for each smoothing
+    fitted_raw_maskers = dict()
+    if atlas_kwargs.get('projection_operator') is None and atlas_kwargs.get('extraction_variants') is None:
+        fitted_masker = input_data.NiftiMapsMasker(maps_img=atlas_kwargs['maps_img'],
+                                                   **atlas_kwargs['masker_parameters']).fit()
+
+    batch_results = []
+    for subject_position, subject_kwargs in enumerate(subjects_kwargs):
+        groupe, subject = subjects_ids[subject_position]
+        try:
+            subject_time_series, elapsed_time = subject_time_series_extraction(
+                fitted_masker=fitted_masker, fitted_raw_maskers=fitted_raw_maskers, **subject_kwargs,
+                **atlas_kwargs)
+        except Exception as error:
+            raise RuntimeError('The time series extraction failed for subject {} in group {}, with functional '
+                               'file {}: {}: {}'.format(subject, groupe, subject_kwargs['subject_fmri'],
+                                                        type(error).__name__, error)) from error
+        # The time series is cached at once, so that a later failure does not lose it
+        if time_series_cache_directory is not None:
+            time_series_cache.save_cached_time_series(
+                cache_directory=time_series_cache_directory, key=cache_keys[subject_position],
+                time_series=subject_time_series,
+                metadata={'groupe': groupe, 'subject': subject,
+                          'functional_file': os.path.abspath(subject_kwargs['subject_fmri']),
+                          'confounds_file': subject_kwargs['subject_confounds'],
+                          'extraction_time': elapsed_time})
+        if verbose > 0:
+            print('Time series extraction for subject {} in group {}: {:.2f} s'.format(subject, groupe,
+                                                                                      elapsed_time), flush=True)
+        batch_results.append((subject_time_series, elapsed_time))
+
+    return batch_results
+
+
+def run_subjects_extraction(subjects_tasks, n_jobs=1, backend='multiprocessing', verbose=0,
+                            time_series_cache_directory=None):
+    """Run the time series extraction for a list of subjects, possibly
+    in parallel.
+
+    Parameters
+    ----------
+    subjects_tasks: list
+        A list of dictionaries, one for each subject, in the order the
+        results should be returned, with the following keys: 'groupe',
+        'subject', 'subject_kwargs', the subject functional and confounds
+        files, 'atlas_kwargs', the atlas and extraction parameters, see
+        atlas_batch_time_series_extraction, 'atlas_group', a key shared by
+        the subjects with the same atlas, on the same grid, and 'cache_key',
+        the key of the subject time series in the cache, or None.
+    n_jobs: int, optional
+        The number of CPUs used concurrently. Default is one, like
+        a classical for loop over subjects.
+    backend: str, optional
+        The method used to execute concurrent task. This argument
+        is passed to the Parallel function in the joblib package.
+        Default is multiprocessing.
+    verbose: int, optional
+        If strictly positive, print the extraction time of each subject.
+        This argument is also passed to the Parallel function.
+    time_series_cache_directory: str, optional
+        The full path to a time series cache directory. Subjects
+        found in the cache are loaded instead of extracted, and newly
+        extracted subjects are saved in it. Default is None, no cache.
+
+    Returns
+    -------
+    output: list
+        The list of tuples (groupe, subject, time series, elapsed time),
+        in the order of `subjects_tasks`.
+
+    Raises
+    ------
+    RuntimeError
+        If the extraction of a subject fails, see atlas_batch_time_series_extraction.
+
+    Notes
+    -----
+    The subjects of a same atlas group are extracted in batches, and the
+    batches run concurrently. Large groups are split so that all the CPUs
+    are used. The extraction time of each subject is printed by the worker
+    as soon as the subject is extracted, and each subject is saved in the
+    cache at the same time, so that the subjects extracted before a failure
+    are not extracted again by the next run.
+
+    See Also
+    --------
+    conpagnon.utils.time_series_cache : The module managing the
+        time series cache.
+    """
+    # Fetch the subjects already in the cache
+    cached_time_series = dict()
+    if time_series_cache_directory is not None:
+        for task_index, subject_task in enumerate(subjects_tasks):
+            subject_time_series = time_series_cache.load_cached_time_series(
+                cache_directory=time_series_cache_directory, key=subject_task['cache_key'])
+            if subject_time_series is not None:
+                cached_time_series[task_index] = subject_time_series
+                if verbose > 0:
+                    print('Time series of subject {} in group {} loaded from cache'.format(
+                        subject_task['subject'], subject_task['groupe']))
+
+    tasks_to_run = [task_index for task_index in range(len(subjects_tasks))
+                    if task_index not in cached_time_series]
+    # Subjects sharing the same atlas are gathered in batches
+    atlas_groups = dict()
+    for task_index in tasks_to_run:
+        atlas_groups.setdefault(subjects_tasks[task_index]['atlas_group'], []).append(task_index)
+    batch_size = max(1, int(np.ceil(len(tasks_to_run) / effective_n_jobs(n_jobs))))
+    batches = [group_tasks[batch_start:batch_start + batch_size]
+               for group_tasks in atlas_groups.values()
+               for batch_start in range(0, len(group_tasks), batch_size)]
+
+    batches_tasks = [
+        delayed(atlas_batch_time_series_extraction)(
+            subjects_kwargs=[subjects_tasks[task_index]['subject_kwargs'] for task_index in batch],
+            atlas_kwargs=subjects_tasks[batch[0]]['atlas_kwargs'],
+            subjects_ids=[(subjects_tasks[task_index]['groupe'], subjects_tasks[task_index]['subject'])
+                          for task_index in batch],
+            cache_keys=[subjects_tasks[task_index]['cache_key'] for task_index in batch],
+            time_series_cache_directory=time_series_cache_directory, verbose=verbose)
+        for batch in batches]
+    if effective_n_jobs(n_jobs) == 1:
+        # One process: the batches run in turn, and a failure is raised as is
+        results = [batch_function(*batch_args, **batch_kwargs)
+                   for batch_function, batch_args, batch_kwargs in batches_tasks]
+    else:
+        results = Parallel(n_jobs=n_jobs, backend=backend, verbose=verbose)(batches_tasks)
+    extracted_time_series = dict()
+    for batch, batch_results in zip(batches, results):
+        extracted_time_series.update(zip(batch, batch_results))
+
+    subjects_results = []
+    for task_index, subject_task in enumerate(subjects_tasks):
+        if task_index in cached_time_series:
+            subject_time_series, elapsed_time = cached_time_series[task_index], 0.
+        else:
+            subject_time_series, elapsed_time = extracted_time_series[task_index]
+        subjects_results.append((subject_task['groupe'], subject_task['subject'], subject_time_series,
+                                 elapsed_time))
+
+    return subjects_results
+
+
+def subject_cache_key(subject_fmri, subject_confounds, atlas_hash, masker_parameters, known_hashes,
+                      **extraction_options):
+    """Compute the cache key of a subject time series.
+
+    Parameters
+    ----------
+    subject_fmri: str
+        The full path to the subject functional image.
+    subject_confounds: str or None
+        The full path to the subject confounds file, None
+        if no regressors should be removed.
+    atlas_hash: str
+        The hash of the atlas file content.
+    masker_parameters: dict
+        The parameters of the extraction. The nilearn caching
+        parameters are ignored.
+    known_hashes: dict
+        The files hashes memorized in the time series cache, see
+        conpagnon.utils.time_series_cache.load_file_hashes. The
+        hashes of new or modified files are added in place.
+    extraction_options: keyword arguments
+        Any other option of the extraction entering the key, like
+        the extraction method.
+
+    Returns
+    -------
+    output: str
+        The key of the subject time series in the cache.
+    """
+    extraction_parameters = {parameter: value for parameter, value in masker_parameters.items()
+                             if parameter not in ['memory', 'memory_level']}
+    extraction_parameters['atlas'] = atlas_hash
+    extraction_parameters.update(extraction_options)
+    functional_file_hash = time_series_cache.file_hash(file_path=subject_fmri,
+                                                       known_hashes=known_hashes)
+    if subject_confounds is not None:
+        confounds_file_hash = time_series_cache.file_hash(file_path=subject_confounds,
+                                                          known_hashes=known_hashes)
+    else:
+        confounds_file_hash = None
+
+    return time_series_cache.time_series_cache_key(functional_file_hash=functional_file_hash,
+                                                   confounds_file_hash=confounds_file_hash,
+                                                   extraction_parameters=extraction_parameters)
+
+
+def time_series_dictionary_from_results(subjects_results, root_fmri_data_directory, groupes,
+                                        subjects_id_data_path, subjects_discarded_rois=None, variant=None):
+    """Build the time series dictionary from the extraction results.
+
+    Parameters
+    ----------
+    subjects_results: list
+        The extraction results, see run_subjects_extraction.
+    root_fmri_data_directory: str
+        The full path of the root directory containing the groups
+        sub-directories.
+    groupes: list
+        The list of groups.
+    subjects_id_data_path: str
+        The full path to the data file containing the subjects IDs.
+    subjects_discarded_rois: dict, optional
+        The index of the discarded rois, with (groupe, subject)
+        tuples as keys. Default is None, no discarded rois field.
+    variant: str, optional
+        The name of the extraction variant, like a denoising strategy, when
+        the results hold a dictionary of time series for each subject.
+        Default is None.
+
+    Returns
+    -------
+    output: dict
+        The time series dictionary, with the connectivity masks,
+        see create_connectivity_mask.
+    """
+    times_series_dictionnary = create_group_dictionnary(subjects_id_data_path=subjects_id_data_path,
+                                                        groupes=groupes,
+                                                        root_fmri_data_directory=root_fmri_data_directory)
+    for groupe, subject, subject_time_series, _ in subjects_results:
+        if variant is not None:
+            subject_time_series = subject_time_series[variant]
+        # We fill the time series array of shape (times points, number of regions) for each subject in each group in
+        # time series dictionnary, and the list of index of discarded rois if any.
+        times_series_dictionnary[groupe][subject] = {'time_series': subject_time_series}
+        if subjects_discarded_rois is not None:
+            times_series_dictionnary[groupe][subject]['discarded_rois'] = subjects_discarded_rois[(groupe, subject)]
+
+    return create_connectivity_mask(time_series_dictionary=times_series_dictionnary, groupes=groupes)
+
+
+def extraction_variants_parameters(masker_parameters, extraction_variants=None, denoising_strategies=None):
+    """Build the masker parameters, and confounds strategy, of each extraction variant.
+
+    Parameters
+    ----------
+    masker_parameters: dict
+        The masker parameters of the extraction, shared by the variants.
+    extraction_variants: dict or list, optional
+        The variants, as dictionaries of the extraction parameters that
+        differ from the shared ones, among 'smooth_signal',
+        'low_pass_filtering', 'high_pass_filtering', 'detrend_signal',
+        'standardize_signal', and 'confounds', the confounds regressed,
+        see conpagnon.computing.signal_extraction.strategy_confounds. A
+        dictionary with the variants names as keys, or a list, the variants
+        being named after their position.
+    denoising_strategies: dict, optional
+        The confounds regressed by each variant, the other parameters
+        being the shared ones.
+
+    Returns
+    -------
+    output: dict or None
+        The variants names as keys, and the tuples (masker parameters,
+        confounds strategy) as values. None if no variants are given.
+    """
+    if extraction_variants is not None and denoising_strategies is not None:
+        raise ValueError('Denoising strategies are extraction variants, give either the '
+                         'extraction variants or the denoising strategies.')
+    if denoising_strategies is not None:
+        return {strategy_name: (masker_parameters, strategy)
+                for strategy_name, strategy in denoising_strategies.items()}
+    if extraction_variants is None:
+        return None
+
+    if isinstance(extraction_variants, dict):
+        variants_items = extraction_variants.items()
+    else:
+        variants_items = ((str(position), variant) for position, variant in enumerate(extraction_variants))
+    # Extraction parameters names, and the corresponding masker parameters
+    masker_parameters_names = {'smooth_signal': 'smoothing_fwhm', 'low_pass_filtering': 'low_pass',
+                               'high_pass_filtering': 'high_pass', 'detrend_signal': 'detrend',
+                               'standardize_signal': 'standardize'}
+    variants_parameters = dict()
+    for variant_name, variant in variants_items:
+        unknown_parameters = set(variant).difference(masker_parameters_names).difference(['confounds'])
+        if unknown_parameters:
+            raise ValueError('Unrecognized parameters {} in the extraction variant {}, choices are: {}, '
+                             'confounds'.format(sorted(unknown_parameters), variant_name,
+                                                ', '.join(masker_parameters_names)))
+        variant_masker_parameters = dict(masker_parameters)
+        variant_masker_parameters.update({masker_parameters_names[parameter]: value
+                                          for parameter, value in variant.items() if parameter != 'confounds'})
+        variants_parameters[variant_name] = (variant_masker_parameters, variant.get('confounds', 'all'))
+
+    return variants_parameters
+
+
+def extraction_variants_description(extraction_variants):
+    """Describe extraction variants for the time series cache key.
+
+    Parameters
+    ----------
+    extraction_variants: dict or None
+        The extraction variants, see extraction_variants_parameters.
+
+    Returns
+    -------
+    output: dict or None
+        The variants masker parameters, without the nilearn cache
+        parameters, and confounds strategy, where functions are replaced
+        by their name.
+    """
+    if extraction_variants is None:
+        return None
+
+    return {str(variant_name): ({parameter: value for parameter, value in variant_parameters.items()
+                                 if parameter not in ['memory', 'memory_level']},
+                                getattr(confounds_strategy, '__name__', confounds_strategy))
+            for variant_name, (variant_parameters, confounds_strategy) in extraction_variants.items()}
+
+
+def variants_time_series_dictionaries(subjects_results, root_fmri_data_directory, groupes, subjects_id_data_path,
+                                      subjects_discarded_rois, extraction_variants, variants_names):
+    """Build the time series dictionary of each extraction variant.
+
+    Parameters
+    ----------
+    subjects_results: list
+        The subjects extraction results, see run_subjects_extraction.
+    root_fmri_data_directory: str
+        The full path of the functional images root directory.
+    groupes: list
+        The list of groups.
+    subjects_id_data_path: str
+        The full path to the data file containing the subjects IDs.
+    subjects_discarded_rois: dict or None
+        The discarded rois of each subject, see time_series_dictionary_from_results.
+    extraction_variants: dict or list
+        The extraction variants given by the user.
+    variants_names: list
+        The variants names.
+
+    Returns
+    -------
+    output: dict or list
+        The time series dictionary of each variant, with the variants
+        names as keys, or a list in the order of the variants if the
+        variants were given as a list.
+    """
+    variants_dictionaries = {variant_name: time_series_dictionary_from_results(
+        subjects_results=subjects_results, root_fmri_data_directory=root_fmri_data_directory,
+        groupes=groupes, subjects_id_data_path=subjects_id_data_path,
+        subjects_discarded_rois=subjects_discarded_rois, variant=variant_name)
+        for variant_name in variants_names}
+    if extraction_variants is not None and not isinstance(extraction_variants, dict):
+        return [variants_dictionaries[variant_name] for variant_name in variants_names]
+
+    return variants_dictionaries
+
+
 def time_series_extraction_with_individual_atlases(root_fmri_data_directory, groupes, subjects_id_data_path, group_data,
                                                    repetition_time, low_pass_filtering=None, high_pass_filtering=None,
                                                    detrend_signal=True, standardize_signal=True, smooth_signal=None,
                                                    resampling_target='data', memory_level=1,
-                                                   nilearn_cache_directory=None,
-                                                   ):
+                                                   nilearn_cache_directory=None, n_jobs=1,
+                                                   backend='multiprocessing', verbose=0,
+                                                   time_series_cache_directory=None,
+                                                   extraction_method='masker', time_block_size=100,
+                                                   denoising_strategies=None, extraction_variants=None):
     """Times series extractions for each subjects with an individual atlas.
     
     This function extract time series for each subjects according predefined regions in individual atlases.
@@ -168,7 +802,70 @@ def time_series_extraction_with_individual_atlases(root_fmri_data_directory, gro
         The full path which will contain the folder used to cache
         the regions extractions. If None, no cache is performing.
         Default is None.
-    
+
+    n_jobs : int, optional
+        The number of CPUs used to extract the subjects time series
+        concurrently. Default is one, like a classical for loop over
+        subjects.
+
+    backend : str, optional
+        The method used to execute concurrent task. This argument
+        is passed to the Parallel function in the joblib package.
+        Default is multiprocessing.
+
+    verbose : int, optional
+        If strictly positive, the extraction time of each subject is
+        printed, useful to spot slow or corrupted inputs. Default is 0.
+
+    time_series_cache_directory : str or None, optional
+        The full path to a ConPagnon time series cache directory. Subjects
+        time series are stored under a hash of the functional file, the
+        confounds file, the atlas file and the extraction parameters, so
+        that a re-run only extract new or modified subjects. See the
+        conpagnon.utils.time_series_cache module to list and evict entries.
+        Default is None, no cache.
+
+    extraction_method : str, optional
+        The regions signals extraction engine. Choices are: 'masker', the
+        nilearn.input_data.NiftiMapsMasker, and 'sparse', a least-squares
+        projection onto the atlas maps, stored as a sparse matrix of their
+        support, with the pseudo-inverse of their Gram matrix built once for
+        each atlas and grid, see
+        conpagnon.computing.signal_extraction. The 'sparse' method
+        requires the resampling target to be the data. It streams the
+        functional images from the disk, uncompressed NIfTI files being
+        memory mapped, so that the memory needed depends on the time
+        block size, and not on the run length. The 'labels' method is the
+        streamed extraction of the regions mean signals of a 3D
+        deterministic atlas, the atlas being flattened once for each grid.
+        Regions without any voxel after the atlas resampling are added to
+        the subject discarded rois. Default is 'masker'.
+    time_block_size : int, optional
+        The number of volumes read at once by the 'sparse' and 'labels'
+        extraction methods. The filtering and standardization are still computed
+        on the whole time series. Default is 100.
+    denoising_strategies : dict or None, optional
+        Several denoising strategies to compare, with the strategies names
+        as keys, and the confounds to regress as values: None for no
+        confounds regression, 'all' for the whole confounds file, a list
+        of columns names, or positions, of the confounds file, or a function
+        building the nuisance design from the confounds table, like
+        the 24 motion parameters from 6. The functional image and the
+        confounds file of each subject are read once, and each strategy is
+        applied to the raw regions signals. Default is None, the whole
+        confounds file is regressed.
+    extraction_variants : dict, list or None, optional
+        Several sets of extraction parameters, for instance filtering bands
+        or smoothing, as dictionaries of the parameters that differ from
+        the ones given to this function, among 'smooth_signal',
+        'low_pass_filtering', 'high_pass_filtering', 'detrend_signal',
+        'standardize_signal', and 'confounds', the confounds regressed like
+        in `denoising_strategies`, 'all' by default. The functional image
+        and the confounds file of each subject are read once, the raw
+        regions signals are extracted once for each distinct smoothing,
+        and cleaned with each variant parameters. A dictionary with the
+        variants names as keys, or a list. Denoising strategies and
+        extraction variants can't be given together. Default is None.
     
     Returns
     -------
@@ -182,6 +879,10 @@ def time_series_extraction_with_individual_atlases(root_fmri_data_directory, gro
             A key 'discarded_rois' containing an array of the index of ROIs 
             where the corresponding labels is 'void'. If no void labels is detected,
             then the array is empty.
+        If denoising strategies, or extraction variants, are given, a
+        dictionary with the strategies, or variants, names as keys, and the
+        time series dictionary of each one as values, a list in the order of
+        the variants if they are given as a list.
             
     See Also
     --------
@@ -204,6 +905,13 @@ def time_series_extraction_with_individual_atlases(root_fmri_data_directory, gro
     
     Remembers that the discarded rois are defined according to their labels
     which must be declared as 'void' in the subject atlas labels files. 
+
+    The atlases are identified by a fingerprint of their geometry and data,
+    see atlas_fingerprint. Subjects sharing the same atlas, like the sessions
+    of a longitudinal study, share the loaded atlas, and when the resampling
+    target is the data, one resampled atlas for each functional image grid.
+    The subjects sharing an atlas are extracted in batches, with one fitted
+    masker or projection operator, and the batches run in parallel.
     
     References
     ----------
@@ -215,18 +923,48 @@ def time_series_extraction_with_individual_atlases(root_fmri_data_directory, gro
     
     """
     
-    # Dictionnary initialisation for each group, and subject as keys.
-    times_series_dictionnary = create_group_dictionnary(subjects_id_data_path=subjects_id_data_path, groupes=groupes,
-                                                        root_fmri_data_directory=root_fmri_data_directory)
-
+    # The masker parameters are shared by all subjects
+    masker_parameters = dict(resampling_target=resampling_target,
+                             smoothing_fwhm=smooth_signal, high_pass=high_pass_filtering,
+                             low_pass=low_pass_filtering, detrend=detrend_signal, standardize=standardize_signal,
+                             t_r=repetition_time, memory=nilearn_cache_directory, memory_level=memory_level)
+    variants_parameters = extraction_variants_parameters(masker_parameters=masker_parameters,
+                                                         extraction_variants=extraction_variants,
+                                                         denoising_strategies=denoising_strategies)
+
+    if extraction_method not in ['masker', 'sparse', 'labels']:
+        raise ValueError('Unrecognized extraction method {}, choices are: '
+                         'masker, sparse, labels'.format(extraction_method))
+    if extraction_method in ['sparse', 'labels'] and resampling_target != 'data':
+        raise ValueError('The {} extraction method needs the atlas on the functional '
+                         'images grid, the resampling target should be data.'.format(extraction_method))
+    atlas_interpolation = 'nearest' if extraction_method == 'labels' else 'continuous'
+
+    subjects_tasks = []
+    subjects_void_rois = dict()
+    resampled_atlas_cache = dict()
+    projection_operator_cache = dict()
+    # Atlases are identified by their content: the subjects sharing the same
+    # atlas, possibly under different file names, share the loaded and
+    # resampled atlas, and the masker or projection operator built on it.
+    atlas_fingerprints = dict()
+    atlas_images = dict()
+    atlas_regions_labels = dict()
+    if time_series_cache_directory is not None:
+        known_hashes = time_series_cache.load_file_hashes(cache_directory=time_series_cache_directory)
     for groupe in group_data.keys():
         # For each each subject found in the group_data dictionnary, which fetch all the path for important file.
         for subject in group_data[groupe].keys():
             # We fetch the individual atlas of the subject
-            subject_atlas = group_data[groupe][subject]['atlas_file'][0]
+            subject_atlas_file = group_data[groupe][subject]['atlas_file'][0]
+            subject_atlas_fingerprint = atlas_fingerprint(atlas_file=subject_atlas_file,
+                                                          atlas_fingerprints=atlas_fingerprints)
+            if subject_atlas_fingerprint not in atlas_images:
+                atlas_images[subject_atlas_fingerprint] = image.load_img(subject_atlas_file)
+            subject_atlas = atlas_images[subject_atlas_fingerprint]
             # Fetch of discarded rois index, reading the subject atlas labels file, and looking for a 'void' label.
             subject_atlas_labels = read_text_data_file(file_path=group_data[groupe][subject]['label_file'][0])
-            subject_void_rois = np.where(subject_atlas_labels[0] == 'void')[0]
+            subjects_void_rois[(groupe, subject)] = np.where(subject_atlas_labels[0] == 'void')[0]
             # Fetch of the subject functional file.
             subject_fmri = group_data[groupe][subject]['functional_file'][0]
             # Fetch the file containing the signal regressors, if it exist
@@ -234,28 +972,81 @@ def time_series_extraction_with_individual_atlases(root_fmri_data_directory, gro
                 subject_confounds = group_data[groupe][subject]['counfounds_file'][0]
             else:
                 subject_confounds = None
-
-            # Set the computation parameters for time series, via the NifTiMapsMasker class
-            subject_masker = input_data.NiftiMapsMasker(
-                maps_img=subject_atlas, resampling_target=resampling_target,
-                smoothing_fwhm=smooth_signal, high_pass=high_pass_filtering,
-                low_pass=low_pass_filtering, detrend=detrend_signal, standardize=standardize_signal,
-                t_r=repetition_time, memory=nilearn_cache_directory, memory_level=memory_level)
-            
-            # We extract the subject time series, for each regions defined in the atlas, if confounds was found,
-            # we regress them
-            subject_time_series = subject_masker.fit_transform(imgs=subject_fmri, confounds=subject_confounds)
-            
-            # We fill the dictionnary for each and subjects, with the
-            # time series array of shape (time point, number of regions),
-            # and the list of index of discarded rois.
-            times_series_dictionnary[groupe][subject] = {'time_series': subject_time_series,
-                                                         'discarded_rois': subject_void_rois}
-
-    times_series_dictionnary = create_connectivity_mask(time_series_dictionary=times_series_dictionnary,
-                                                        groupes=groupes)
-
-    return times_series_dictionnary
+            # Key of the subject time series in the ConPagnon cache
+            if time_series_cache_directory is not None:
+                subject_time_series_key = subject_cache_key(
+                    subject_fmri=subject_fmri, subject_confounds=subject_confounds,
+                    atlas_hash=subject_atlas_fingerprint,
+                    masker_parameters=masker_parameters,
+                    known_hashes=known_hashes, extraction_method=extraction_method,
+                    extraction_variants=extraction_variants_description(variants_parameters))
+            else:
+                subject_time_series_key = None
+            # The labels of a labels atlas are read before resampling, so that
+            # regions vanishing on the subject grid are still accounted for
+            if extraction_method == 'labels':
+                if subject_atlas_fingerprint not in atlas_regions_labels:
+                    atlas_regions_labels[subject_atlas_fingerprint] = signal_extraction.atlas_labels(
+                        labels_img=subject_atlas)
+                subject_labels = atlas_regions_labels[subject_atlas_fingerprint]
+            else:
+                subject_labels = None
+            # Subjects sharing the same atlas and the same grid share
+            # the same resampled atlas
+            if resampling_target == 'data':
+                subject_atlas = fetch_resampled_atlas(atlas_img=subject_atlas, subject_fmri=subject_fmri,
+                                                      resampled_atlas_cache=resampled_atlas_cache,
+                                                      atlas_key=subject_atlas_fingerprint,
+                                                      interpolation=atlas_interpolation)
+            # The atlas object is shared by all the subjects of the same atlas group
+            subject_atlas_group = id(subject_atlas)
+            if extraction_method in ['sparse', 'labels']:
+                subject_projection_operator = fetch_projection_operator(
+                    atlas_img=subject_atlas, projection_operator_cache=projection_operator_cache,
+                    labels=subject_labels)
+            else:
+                subject_projection_operator = None
+            # Regions without any voxel on the subject grid are discarded
+            if extraction_method == 'labels':
+                subjects_void_rois[(groupe, subject)] = np.union1d(
+                    subjects_void_rois[(groupe, subject)],
+                    np.flatnonzero(subject_projection_operator['empty_labels']))
+
+            subjects_tasks.append({'groupe': groupe, 'subject': subject,
+                                   'subject_kwargs': dict(subject_fmri=subject_fmri,
+                                                          subject_confounds=subject_confounds),
+                                   'atlas_kwargs': dict(maps_img=subject_atlas,
+                                                        masker_parameters=masker_parameters,
+                                                        projection_operator=subject_projection_operator,
+                                                        time_block_size=time_block_size,
+                                                        extraction_variants=variants_parameters),
+                                   'atlas_group': subject_atlas_group,
+                                   'cache_key': subject_time_series_key})
+
+    # The files hashes are memorized once, for the next extraction
+    if time_series_cache_directory is not None:
+        time_series_cache.save_file_hashes(cache_directory=time_series_cache_directory, known_hashes=known_hashes)
+
+    # We extract the subjects time series, for each regions defined in the atlas, if confounds was found,
+    # we regress them
+    subjects_results = run_subjects_extraction(subjects_tasks=subjects_tasks, n_jobs=n_jobs,
+                                               backend=backend, verbose=verbose,
+                                               time_series_cache_directory=time_series_cache_directory)
+
+    # We fill the dictionnary for each and subjects, with the
+    # time series array of shape (time point, number of regions),
+    # and the list of index of discarded rois, for each extraction variant if any.
+    if variants_parameters is not None:
+        return variants_time_series_dictionaries(
+            subjects_results=subjects_results, root_fmri_data_directory=root_fmri_data_directory,
+            groupes=groupes, subjects_id_data_path=subjects_id_data_path,
+            subjects_discarded_rois=subjects_void_rois, extraction_variants=extraction_variants,
+            variants_names=list(variants_parameters))
+
+    return time_series_dictionary_from_results(
+        subjects_results=subjects_results, root_fmri_data_directory=root_fmri_data_directory,
+        groupes=groupes, subjects_id_data_path=subjects_id_data_path,
+        subjects_discarded_rois=subjects_void_rois)
 
 
 def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_path,
@@ -263,7 +1054,10 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
                            low_pass_filtering=None, high_pass_filtering=None,
                            detrend_signal=True, standardize_signal=True,
                            smooth_signal=None, resampling_target='data', memory_level=1,
-                           nilearn_cache_directory=None):
+                           nilearn_cache_directory=None, n_jobs=1, backend='multiprocessing',
+                           verbose=0, time_series_cache_directory=None,
+                           extraction_method='masker', time_block_size=100,
+                           denoising_strategies=None, extraction_variants=None):
     
     """Times series extractions for each subjects on a common atlas.
     
@@ -326,6 +1120,66 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
         The full path which will contain the folder used to cache
         the regions extractions. If None, no cache is performing.
         Default is None.
+    n_jobs : int, optional
+        The number of CPUs used to extract the subjects time series
+        concurrently. Default is one, like a classical for loop over
+        subjects.
+    backend : str, optional
+        The method used to execute concurrent task. This argument
+        is passed to the Parallel function in the joblib package.
+        Default is multiprocessing.
+    verbose : int, optional
+        If strictly positive, the extraction time of each subject is
+        printed, useful to spot slow or corrupted inputs. Default is 0.
+    time_series_cache_directory : str or None, optional
+        The full path to a ConPagnon time series cache directory. Subjects
+        time series are stored under a hash of the functional file, the
+        confounds file, the reference atlas and the extraction parameters, so
+        that a re-run only extract new or modified subjects. See the
+        conpagnon.utils.time_series_cache module to list and evict entries.
+        Default is None, no cache.
+    extraction_method : str, optional
+        The regions signals extraction engine. Choices are: 'masker', the
+        nilearn.input_data.NiftiMapsMasker, and 'sparse', a least-squares
+        projection onto the atlas maps, stored as a sparse matrix of their
+        support, with the pseudo-inverse of their Gram matrix built once for
+        each distinct grid, see
+        conpagnon.computing.signal_extraction. It is faster and lighter in
+        memory for large probabilistic atlases. The 'sparse' method
+        requires the resampling target to be the data. It streams the
+        functional images from the disk, uncompressed NIfTI files being
+        memory mapped, so that the memory needed depends on the time
+        block size, and not on the run length. The 'labels' method is the
+        streamed extraction of the regions mean signals of a 3D
+        deterministic atlas, the atlas being flattened once for each grid.
+        Regions without any voxel after the atlas resampling are added to
+        the subject discarded rois. Default is 'masker'.
+    time_block_size : int, optional
+        The number of volumes read at once by the 'sparse' and 'labels'
+        extraction methods. The filtering and standardization are still computed
+        on the whole time series. Default is 100.
+    denoising_strategies : dict or None, optional
+        Several denoising strategies to compare, with the strategies names
+        as keys, and the confounds to regress as values: None for no
+        confounds regression, 'all' for the whole confounds file, a list
+        of columns names, or positions, of the confounds file, or a function
+        building the nuisance design from the confounds table, like
+        the 24 motion parameters from 6. The functional image and the
+        confounds file of each subject are read once, and each strategy is
+        applied to the raw regions signals. Default is None, the whole
+        confounds file is regressed.
+    extraction_variants : dict, list or None, optional
+        Several sets of extraction parameters, for instance filtering bands
+        or smoothing, as dictionaries of the parameters that differ from
+        the ones given to this function, among 'smooth_signal',
+        'low_pass_filtering', 'high_pass_filtering', 'detrend_signal',
+        'standardize_signal', and 'confounds', the confounds regressed like
+        in `denoising_strategies`, 'all' by default. The functional image
+        and the confounds file of each subject are read once, the raw
+        regions signals are extracted once for each distinct smoothing,
+        and cleaned with each variant parameters. A dictionary with the
+        variants names as keys, or a list. Denoising strategies and
+        extraction variants can't be given together. Default is None.
 
     Returns
     -------
@@ -335,6 +1189,10 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
             - The second keys levels is the subjects IDs
             - The third levels is two keys : 'time_series' containing the
             subject time series in an array of shape (number of regions, number of time points) 
+        If denoising strategies, or extraction variants, are given, a
+        dictionary with the strategies, or variants, names as keys, and the
+        time series dictionary of each one as values, a list in the order of
+        the variants if they are given as a list.
 
     See Also
     --------
@@ -352,6 +1210,10 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
     
     The subjects IDs file, whatever the format, should not contain any header.
     It's should have a row column of ID for each subjects.
+
+    When the resampling target is the data, the reference atlas is resampled
+    only once for each distinct functional image grid (shape and affine), and
+    shared by all the subjects acquired on that grid.
         
     References
     ----------
@@ -359,11 +1221,41 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
     [1] http://nilearn.github.io/index.html
     """
 
-    # Dictionnary initialisation for time series, for each group, and for each subjects.
-    times_series_dictionnary = create_group_dictionnary(subjects_id_data_path=subjects_id_data_path,
-                                                        groupes=groupes,
-                                                        root_fmri_data_directory=root_fmri_data_directory)
+    # The masker parameters are shared by all subjects
+    masker_parameters = dict(resampling_target=resampling_target,
+                             smoothing_fwhm=smooth_signal, high_pass=high_pass_filtering,
+                             low_pass=low_pass_filtering, detrend=detrend_signal,
+                             standardize=standardize_signal, t_r=repetition_time,
+                             memory=nilearn_cache_directory, memory_level=memory_level)
+    variants_parameters = extraction_variants_parameters(masker_parameters=masker_parameters,
+                                                         extraction_variants=extraction_variants,
+                                                         denoising_strategies=denoising_strategies)
+
+    # The reference atlas is loaded once, and resampled once for each
+    # distinct functional image grid
+    if extraction_method not in ['masker', 'sparse', 'labels']:
+        raise ValueError('Unrecognized extraction method {}, choices are: '
+                         'masker, sparse, labels'.format(extraction_method))
+    if extraction_method in ['sparse', 'labels'] and resampling_target != 'data':
+        raise ValueError('The {} extraction method needs the atlas on the functional '
+                         'images grid, the resampling target should be data.'.format(extraction_method))
+    atlas_interpolation = 'nearest' if extraction_method == 'labels' else 'continuous'
+
+    reference_atlas_img = image.load_img(reference_atlas)
+    resampled_atlas_cache = dict()
+    projection_operator_cache = dict()
+    # The labels of a labels atlas are read before resampling, so that
+    # regions vanishing on a subject grid are still accounted for
+    if extraction_method == 'labels':
+        reference_atlas_labels = signal_extraction.atlas_labels(labels_img=reference_atlas_img)
+    else:
+        reference_atlas_labels = None
+    if time_series_cache_directory is not None:
+        known_hashes = time_series_cache.load_file_hashes(cache_directory=time_series_cache_directory)
+        reference_atlas_hash = time_series_cache.file_hash(file_path=reference_atlas, known_hashes=known_hashes)
 
+    subjects_tasks = []
+    subjects_discarded_rois = dict()
     for groupe in group_data.keys():
         # For each subject in the group_data dictionnary
         for subject in group_data[groupe].keys():
@@ -374,30 +1266,106 @@ def time_series_extraction(root_fmri_data_directory, groupes, subjects_id_data_p
                 subject_confounds = group_data[groupe][subject]['counfounds_file'][0]
             else:
                 subject_confounds = None
-            
-            # Set the computation parameters for time series, via the NifTiMapsMasker class
-            subject_masker = input_data.NiftiMapsMasker(maps_img=reference_atlas, resampling_target=resampling_target,
-                                                        smoothing_fwhm=smooth_signal, high_pass=high_pass_filtering,
-                                                        low_pass=low_pass_filtering, detrend=detrend_signal,
-                                                        standardize=standardize_signal, t_r=repetition_time,
-                                                        memory=nilearn_cache_directory, memory_level=memory_level)
-            
-            # We extract the subject time series, for each regions defined in the atlas, if confounds was found,
-            # we regress them
-            subject_time_series = subject_masker.fit_transform(imgs=subject_fmri, confounds=subject_confounds)
-            
-            # We fill the time series array of shape (times points, number of regions) for each subject in each group in
-            # time series dictionnary
-            times_series_dictionnary[groupe][subject] = {'time_series': subject_time_series}
+            # Fetch the reference atlas on the subject grid
+            if resampling_target == 'data':
+                subject_atlas = fetch_resampled_atlas(atlas_img=reference_atlas_img, subject_fmri=subject_fmri,
+                                                      resampled_atlas_cache=resampled_atlas_cache,
+                                                      atlas_key='reference_atlas',
+                                                      interpolation=atlas_interpolation)
+            else:
+                subject_atlas = reference_atlas_img
+            # The subjects on the same grid form one atlas group
+            subject_atlas_group = id(subject_atlas)
+            # Key of the subject time series in the ConPagnon cache
+            if time_series_cache_directory is not None:
+                subject_time_series_key = subject_cache_key(
+                    subject_fmri=subject_fmri, subject_confounds=subject_confounds,
+                    atlas_hash=reference_atlas_hash, masker_parameters=masker_parameters,
+                    known_hashes=known_hashes, extraction_method=extraction_method,
+                    extraction_variants=extraction_variants_description(variants_parameters))
+            else:
+                subject_time_series_key = None
+            # The projection operator is built once for each grid
+            if extraction_method in ['sparse', 'labels']:
+                subject_projection_operator = fetch_projection_operator(
+                    atlas_img=subject_atlas, projection_operator_cache=projection_operator_cache,
+                    labels=reference_atlas_labels)
+            else:
+                subject_projection_operator = None
+            # Regions without any voxel on the subject grid are discarded
+            if extraction_method == 'labels':
+                subjects_discarded_rois[(groupe, subject)] = np.flatnonzero(
+                    subject_projection_operator['empty_labels'])
+
+            subjects_tasks.append({'groupe': groupe, 'subject': subject,
+                                   'subject_kwargs': dict(subject_fmri=subject_fmri,
+                                                          subject_confounds=subject_confounds),
+                                   'atlas_kwargs': dict(maps_img=subject_atlas,
+                                                        masker_parameters=masker_parameters,
+                                                        projection_operator=subject_projection_operator,
+                                                        time_block_size=time_block_size,
+                                                        extraction_variants=variants_parameters),
+                                   'atlas_group': subject_atlas_group,
+                                   'cache_key': subject_time_series_key})
+
+    # The files hashes are memorized once, for the next extraction
+    if time_series_cache_directory is not None:
+        time_series_cache.save_file_hashes(cache_directory=time_series_cache_directory, known_hashes=known_hashes)
+
+    # We extract the subjects time series, for each regions defined in the atlas, if confounds was found,
+    # we regress them
+    subjects_results = run_subjects_extraction(subjects_tasks=subjects_tasks, n_jobs=n_jobs,
+                                               backend=backend, verbose=verbose,
+                                               time_series_cache_directory=time_series_cache_directory)
+
+    # We fill the time series array of shape (times points, number of regions) for each subject in each group in
+    # time series dictionnary, for each extraction variant if any. Only the labels
+    # extraction method can discard rois.
+    if extraction_method != 'labels':
+        subjects_discarded_rois = None
+    if variants_parameters is not None:
+        return variants_time_series_dictionaries(
+            subjects_results=subjects_results, root_fmri_data_directory=root_fmri_data_directory,
+            groupes=groupes, subjects_id_data_path=subjects_id_data_path,
+            subjects_discarded_rois=subjects_discarded_rois, extraction_variants=extraction_variants,
+            variants_names=list(variants_parameters))
+
+    return time_series_dictionary_from_results(
+        subjects_results=subjects_results, root_fmri_data_directory=root_fmri_data_directory,
+        groupes=groupes, subjects_id_data_path=subjects_id_data_path,
+        subjects_discarded_rois=subjects_discarded_rois)
+
+
+def stored_connectivity_matrix(connectivity_matrix, storage='dense', storage_dtype=None):
+    """Convert a connectivity matrix to its storage form.
 
-    times_series_dictionnary = create_connectivity_mask(time_series_dictionary=times_series_dictionnary,
-                                                        groupes=groupes)
+    Parameters
+    ----------
+    connectivity_matrix: numpy.array, shape (number of regions, number of regions)
+        A connectivity matrix.
+    storage: str, optional
+        The storage of the connectivity matrix, 'dense' or 'packed'. Default is 'dense'.
+    storage_dtype: numpy.dtype, optional
+        The storage data type of the connectivity matrix. Default is None, the
+        data type is unchanged.
+
+    Returns
+    -------
+    output: numpy.array or PackedSymmetricMatrix
+        The stored connectivity matrix.
+    """
+    if storage == 'packed':
+        return array_operation.PackedSymmetricMatrix.from_dense(connectivity_matrix, dtype=storage_dtype)
+    if storage_dtype is not None:
+        return connectivity_matrix.astype(storage_dtype)
 
-    return times_series_dictionnary
+    return connectivity_matrix
 
 
 def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_estimator, vectorize=False,
-                                     discarding_diagonal=False, z_fisher_transform=False):
+                                     discarding_diagonal=False, z_fisher_transform=False, storage='dense',
+                                     storage_dtype=None, precision_estimation=None, precision_estimation_kwargs=None,
+                                     repetition_time=None, coherence_bands=None, coherence_kwargs=None):
     """Compute the connectivity matrices for groups of subjects
     
     This function computes connectivity matrices for different metrics.
@@ -416,7 +1384,7 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
     kinds : list
         List of the different metrics you want to compute the 
         connectivity matrices. Choices are 'tangent', 'correlation',
-        'partial correlation', 'covariance', 'precision'.
+        'partial correlation', 'covariance', 'precision', 'coherence'.
     covariance_estimator : estimator object
         All the kinds  are based on derivation of covariances matrices. You need
         to precise the estimator, see Notes.
@@ -431,6 +1399,35 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
     discarding_diagonal: bool, optional
         If True, the diagonal is discarded in
         the vectorization process. Default is False.
+    storage: str, optional
+        The storage of the connectivity matrices, 'dense' or 'packed'. If
+        'packed', only the lower triangle of each matrix is stored, in a
+        PackedSymmetricMatrix, see Notes. Default is 'dense'.
+    storage_dtype: numpy.dtype, optional
+        The data type of the stored connectivity matrices, like numpy.float32 to
+        halve the memory footprint. The matrices are computed in double precision
+        and converted once computed. Default is None, double precision.
+    precision_estimation: str, optional
+        If 'graphical lasso', the precision and partial correlation kinds are derived
+        from the sparse precision of each subject, along a regularization path shared
+        by the subjects. If 'group sparse', they are derived from group sparse precisions,
+        with a common support for all the subjects. See Notes. Default is None, the
+        precision is the inverse of the covariance estimated with `covariance_estimator`.
+    precision_estimation_kwargs: dict, optional
+        The keyword arguments of conpagnon.computing.sparse_precision.subjects_graphical_lasso
+        or group_sparse_precisions, like the regularization parameters 'alphas', or the
+        number of processes 'n_jobs'. Default is None.
+    repetition_time: float, optional
+        The repetition time of the time series, in seconds, needed by the
+        coherence kind. Default is None.
+    coherence_bands: dict, optional
+        The frequency bands of the coherence kind, with the bands names as keys,
+        and the (lowest, highest) frequencies in Hz as values. Default is None,
+        the slow-5 (0.01 - 0.027 Hz) and slow-4 (0.027 - 0.073 Hz) bands.
+    coherence_kwargs: dict, optional
+        The Welch segments parameters of the coherence, 'nperseg', 'noverlap' and
+        'window', see conpagnon.computing.covariance_engine.batch_coherence.
+        Default is None.
 
     Returns
     -------
@@ -470,6 +1467,24 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
     The derivation of connectivity matrices are based on Nilearn functions. I
     encourage the user to read the following docstring of important functions :
     nilearn.connectome.ConnectivityMeasure
+    The subjects time series of the same shape are stacked, and the matrices of
+    each kind are computed for all of them at once, with batched linear algebra,
+    the covariance of each subject being estimated once for all the kinds, see
+    conpagnon.computing.covariance_engine.
+    A packed storage, with a single precision storage_dtype, divides by four the memory
+    footprint of the connectivity matrices of large atlases. The packed matrices are read by
+    group_mean_connectivity, stacked_connectivity_matrices, fisher_transform and the
+    statistical tests, and behave like dense arrays for plotting or export, see
+    conpagnon.utils.array_operation.PackedSymmetricMatrix. A packed storage is
+    incompatible with the vectorize option.
+    The sparse precisions are estimated along a path of decreasing regularization
+    parameters, each estimate starting from the previous one, and the parameter of
+    each subject is selected by cross-validation, the subjects being dispatched in
+    a pool of processes, see conpagnon.computing.sparse_precision.
+    The coherence kind is replaced by one kind for each frequency band, named
+    'coherence' followed by the band name, like 'coherence slow-4', holding the
+    magnitude squared coherence of the cross-spectral densities averaged in
+    the band, see conpagnon.computing.covariance_engine.batch_coherence.
     
     References
     ----------
@@ -478,13 +1493,54 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
         difference in post-stroke patients using group-level covariance modeling", MICCAI 2010
     """
 
+    if storage not in ['dense', 'packed']:
+        raise ValueError('Unknown storage {}, choices are dense or packed.'.format(storage))
+    if storage == 'packed' and vectorize:
+        raise ValueError('The packed storage of the connectivity matrices is incompatible with '
+                         'the vectorize option.')
+    if 'coherence' in kinds and repetition_time is None:
+        raise ValueError('The coherence kind needs the repetition time of the time series.')
+    if precision_estimation not in [None, 'graphical lasso', 'group sparse']:
+        raise ValueError('Unknown precision estimation {}, choices are graphical lasso or '
+                         'group sparse.'.format(precision_estimation))
+
     saving_subjects_connectivity_matrices_dictionary = dict.fromkeys(list(time_series_dictionary.keys()))
 
+    # The connectivity matrices of all the subjects are computed at once, from one
+    # covariance estimate for each subject, except for the tangent kind
+    subjects_keys = [(groupe, subject) for groupe in time_series_dictionary.keys()
+                     for subject in time_series_dictionary[groupe].keys()]
+    subjects_time_series = [time_series_dictionary[groupe][subject]['time_series']
+                            for groupe, subject in subjects_keys]
+    engine_kinds = [kind for kind in kinds if kind not in ['tangent', 'coherence']]
+    sparse_kinds = []
+    if precision_estimation is not None:
+        sparse_kinds = [kind for kind in engine_kinds if kind in ['precision', 'partial correlation']]
+        engine_kinds = [kind for kind in engine_kinds if kind not in sparse_kinds]
+    if 'tangent' in kinds and 'covariance' not in engine_kinds:
+        # The tangent matrices are derived from the covariances
+        engine_kinds.append('covariance')
+    subjects_kinds_matrices = covariance_engine.subjects_connectivity_kinds(
+        time_series=subjects_time_series, kinds=engine_kinds, covariance_estimator=covariance_estimator)
+    if sparse_kinds:
+        subjects_kinds_matrices.update(sparse_precision.sparse_precision_kinds(
+            time_series=subjects_time_series, kinds=sparse_kinds,
+            group_sparse=precision_estimation == 'group sparse', **(precision_estimation_kwargs or {})))
+    if 'coherence' in kinds:
+        subjects_kinds_matrices.update(covariance_engine.subjects_coherence(
+            time_series=subjects_time_series, repetition_time=repetition_time, coherence_bands=coherence_bands,
+            **(coherence_kwargs or {})))
+        # Each frequency band is a kind
+        coherence_position = list(kinds).index('coherence')
+        kinds = list(kinds[:coherence_position]) + covariance_engine.coherence_kinds(coherence_bands) + \
+            list(kinds[coherence_position + 1:])
+    kinds_matrices = {kind: dict(zip(subjects_keys, kind_matrices))
+                      for kind, kind_matrices in subjects_kinds_matrices.items()}
+
     for groupe in time_series_dictionary.keys():
         subjects_list = time_series_dictionary[groupe].keys()
         saving_subjects_connectivity_matrices_dictionary[groupe] = dict.fromkeys(subjects_list)
         for subject in subjects_list:
-            subject_time_series = [time_series_dictionary[groupe][subject]['time_series']]
             saving_subjects_connectivity_matrices_dictionary[groupe][subject] = dict.fromkeys(kinds)
 
             # operation on the boolean mask for each subject
@@ -512,7 +1568,7 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
             else:
                 saving_subjects_connectivity_matrices_dictionary[groupe][subject]['masked_array'] = subject_mask
                 saving_subjects_connectivity_matrices_dictionary[groupe][subject]['diagonal_mask'] = \
-                    np.diag(subject_mask)
+                    subject_mask.diagonal()
 
             # Fetch the index of discarded rois
             if 'discarded_rois' in time_series_dictionary[groupe][subject].keys():
@@ -522,9 +1578,8 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
             for kind in kinds:
                 # We compute connectivity matrices except for the tangent kind, which need the pooled groups
                 if kind != 'tangent':
-                    kind_measure = ConnectivityMeasure(kind=kind, cov_estimator=covariance_estimator)
                     # the current subject connectivity matrices
-                    subject_kind_matrice = kind_measure.fit_transform(subject_time_series)
+                    subject_kind_matrice = kinds_matrices[kind][(groupe, subject)][np.newaxis, ...]
                     # We fill the subject dictionnary, accounting for vectorization option
                     if vectorize:
                         # if discard_diagonal is True
@@ -546,6 +1601,8 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
                         else:
                             subject_kind_matrice_ = subject_kind_matrice_
 
+                        if storage_dtype is not None:
+                            subject_kind_matrice_ = subject_kind_matrice_.astype(storage_dtype)
                         saving_subjects_connectivity_matrices_dictionary[groupe][subject][kind] = \
                             subject_kind_matrice_[:]
                         # Save the diagonal in this case:
@@ -564,22 +1621,21 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
                             subject_kind_matrice = subject_kind_matrice
 
                         saving_subjects_connectivity_matrices_dictionary[groupe][subject][kind] = \
-                            subject_kind_matrice[0, ...]
+                            stored_connectivity_matrix(subject_kind_matrice[0, ...], storage=storage,
+                                                       storage_dtype=storage_dtype)
 
     if 'tangent' in kinds:
-        # We call pooled_groups_connectivity on the tangent space, returning along the tangent matrices
-        # the labels subjects in the same order of tangent connectivity matrices:
-        tangent_matrix, subjects_order = pooled_groups_connectivity(
-            time_series_dictionary=time_series_dictionary,
-            kinds=['tangent'],
-            covariance_estimator=covariance_estimator,
-            vectorize=False)
+        # The tangent matrices are the projection of the subjects covariances at the
+        # geometric mean of the pooled groups
+        subjects_covariances = np.array([kinds_matrices['covariance'][subject_key] for subject_key in subjects_keys])
+        tangent_reference = tangent_space.TangentReference.from_covariances(
+            covariances=subjects_covariances, covariance_estimator=covariance_estimator)
+        tangent_matrix = {'tangent': tangent_reference.transform(covariances=subjects_covariances)}
 
         for groupe in time_series_dictionary.keys():
             group_subject_list = time_series_dictionary[groupe].keys()
             for subject in group_subject_list:
-                subjects_order_list = list(subjects_order)
-                sub_index = subjects_order_list.index(subject)
+                sub_index = subjects_keys.index((groupe, subject))
                 if vectorize:
                     if discarding_diagonal:
                         diagonal_matrice_tangent, corresponding_tangent_matrice = \
@@ -591,6 +1647,8 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
                             vectorizer(numpy_array=tangent_matrix['tangent'][sub_index, ...],
                                        discard_diagonal=False,
                                        array_type='numeric')
+                    if storage_dtype is not None:
+                        corresponding_tangent_matrice = corresponding_tangent_matrice.astype(storage_dtype)
                     saving_subjects_connectivity_matrices_dictionary[groupe][subject]['tangent'] = \
                         corresponding_tangent_matrice
                     saving_subjects_connectivity_matrices_dictionary[groupe][subject]['tangent' + '_diagonal'] = \
@@ -598,12 +1656,123 @@ def individual_connectivity_matrices(time_series_dictionary, kinds, covariance_e
                 else:
                     corresponding_tangent_matrice = tangent_matrix['tangent'][sub_index, ...]
                     saving_subjects_connectivity_matrices_dictionary[groupe][subject]['tangent'] = \
-                        corresponding_tangent_matrice
+                        stored_connectivity_matrix(corresponding_tangent_matrice, storage=storage,
+                                                   storage_dtype=storage_dtype)
 
     return saving_subjects_connectivity_matrices_dictionary
 
 
-def pooled_groups_tangent_mean(time_series_dictionary, covariance_estimator):
+def dynamic_connectivity_matrices(time_series_dictionary, kinds, covariance_estimator, window_length, step=1,
+                                  taper=None, output_directory=None, storage_dtype=np.float32, block_size=64):
+    """Compute the sliding window connectivity matrices for groups of subjects
+
+    Parameters
+    ----------
+    time_series_dictionary : dict
+        A multi-levels dictionnary organised as follow :
+            - The first keys levels is the different groupes in the study.
+            - The second keys levels is the subjects IDs
+            - The third levels is a key 'time_series' containing the
+            subject time series in an array of shape (number of time points, number of regions).
+        All the subjects should have the same number of time points.
+    kinds : list
+        List of the different metrics you want to compute the
+        connectivity matrices. Choices are 'correlation',
+        'partial correlation', 'covariance', 'precision'.
+    covariance_estimator : estimator object
+        A scikit-learn covariance estimator, estimated in each window.
+    window_length: int
+        The number of time points in a window.
+    step: int, optional
+        The number of time points between two consecutive windows.
+        Default is 1.
+    taper: str, tuple or numpy.array, optional
+        The weights of the time points in a window, a window name accepted by
+        scipy.signal.get_window, like 'hamming' or ('gaussian', 10), or an
+        array of shape (window_length, ). Default is None, the time points of a
+        window are equally weighted.
+    output_directory: str, optional
+        If given, the connectivity of each kind is written in a memory mapped
+        .npy file of this directory, named after the kind, with the spaces
+        replaced by underscores. Default is None, the connectivity is
+        kept in memory.
+    storage_dtype: numpy.dtype, optional
+        The data type of the stored connectivity. Default is numpy.float32.
+    block_size: int, optional
+        The number of windows computed at once. Default is 64.
+
+    Returns
+    -------
+    output : dict
+        A dictionary with a 'subjects' key, containing the list of the (group,
+        subject) tuples, in the order of the rows of the connectivity arrays,
+        a 'window_onsets' key, containing the first time point of each window,
+        and the kinds as keys, containing the packed lower triangle, diagonal
+        included, of the connectivity matrices of each window, in an array of
+        shape (number of subjects, number of windows, number of regions *
+        (number of regions + 1) / 2), a numpy.memmap if an output directory is
+        given.
+
+    See Also
+    --------
+    individual_connectivity_matrices :
+        The static connectivity matrices of the subjects.
+    conpagnon.computing.covariance_engine.rolling_window_covariances :
+        The computation of the windows covariances.
+
+    Notes
+    -----
+    Without a taper, the windows empirical covariances are updated from one
+    window to the next with the time points entering and leaving the window,
+    for the EmpiricalCovariance, ShrunkCovariance and OAS estimators. The other
+    estimators are fitted on each window, and do not support a taper.
+    The connectivity matrices of a subject can be read as a
+    conpagnon.utils.array_operation.PackedSymmetricMatrix of shape (number of
+    windows, number of regions, number of regions), and the upper bound of the
+    memory footprint is the packed connectivity of one block of windows.
+    """
+    subjects_keys = [(groupe, subject) for groupe in time_series_dictionary.keys()
+                     for subject in time_series_dictionary[groupe].keys()]
+    time_series_shapes = set(np.shape(time_series_dictionary[groupe][subject]['time_series'])
+                             for groupe, subject in subjects_keys)
+    if len(time_series_shapes) != 1:
+        raise ValueError('All the subjects should have the same number of time points and regions, '
+                         'got time series shapes {}.'.format(sorted(time_series_shapes)))
+    n_time_points, n_regions = time_series_shapes.pop()
+    onsets = covariance_engine.window_onsets(n_time_points=n_time_points, window_length=window_length,
+                                             step=step)
+    rows, columns = array_operation.lower_triangle_indices(n_regions)
+    dynamic_shape = (len(subjects_keys), len(onsets), len(rows))
+
+    dynamic_connectivity = {'subjects': subjects_keys, 'window_onsets': onsets}
+    for kind in kinds:
+        if output_directory is None:
+            dynamic_connectivity[kind] = np.empty(dynamic_shape, dtype=storage_dtype)
+        else:
+            dynamic_connectivity[kind] = np.lib.format.open_memmap(
+                os.path.join(output_directory, kind.replace(' ', '_') + '.npy'), mode='w+',
+                dtype=storage_dtype, shape=dynamic_shape)
+
+    for subject_row, (groupe, subject) in enumerate(subjects_keys):
+        windows_blocks = covariance_engine.sliding_window_connectivity_kinds(
+            time_series=time_series_dictionary[groupe][subject]['time_series'], kinds=kinds,
+            covariance_estimator=covariance_estimator, window_length=window_length, step=step, taper=taper,
+            block_size=block_size)
+        first_window = 0
+        for block_onsets, block_kinds in windows_blocks:
+            windows_slice = slice(first_window, first_window + len(block_onsets))
+            for kind in kinds:
+                dynamic_connectivity[kind][subject_row, windows_slice] = block_kinds[kind][:, rows, columns]
+            first_window += len(block_onsets)
+
+    if output_directory is not None:
+        for kind in kinds:
+            dynamic_connectivity[kind].flush()
+
+    return dynamic_connectivity
+
+
+def pooled_groups_tangent_mean(time_series_dictionary, covariance_estimator, init=None):
     """Compute the geometric mean of covariances connectivity matrices for the tangent kind.
     
     The geometric mean is the point in the symmetric manifold matrices spaces 
@@ -624,6 +1793,9 @@ def pooled_groups_tangent_mean(time_series_dictionary, covariance_estimator):
     covariance_estimator : estimator object
     All the kinds  are based on derivation of covariances matrices. You need
     to precise the estimator, see Notes.
+    init : numpy.array of shape (n_features, n_features), optional
+        A previous geometric mean, like the mean of the cohort before the
+        last subjects were scanned, to warm start the descent. Default is None.
     
     Returns 
     -------
@@ -643,23 +1815,42 @@ def pooled_groups_tangent_mean(time_series_dictionary, covariance_estimator):
     Multiple estimator can be found in the module sklearn.covariance, popular
     choices are the Ledoit-Wolf estimator, or the OAS estimator.
     For now, we doesnt account for discarded rois for the derivation of the
-    geometric mean.
+    geometric mean. See pooled_groups_tangent_reference to keep the whole
+    tangent space reference, and conpagnon.computing.tangent_space.IncrementalGeometricMean
+    to update the mean of a growing cohort with each new batch of subjects.
     """
 
-    tangent_measure = ConnectivityMeasure(kind='tangent', cov_estimator=covariance_estimator)
-    group_stacked_time_series = []
+    return pooled_groups_tangent_reference(time_series_dictionary=time_series_dictionary,
+                                           covariance_estimator=covariance_estimator, init=init).mean_
+
+
+def pooled_groups_tangent_reference(time_series_dictionary, covariance_estimator, init=None):
+    """Compute the tangent space reference of the pooled groups.
+
+    Parameters
+    ----------
+    time_series_dictionary : dict
+        The time series dictionary, see pooled_groups_tangent_mean.
+    covariance_estimator : estimator object
+        The covariance estimator.
+    init : numpy.array of shape (number of regions, number of regions), optional
+        A previous geometric mean, to warm start the descent. Default is None.
 
+    Returns
+    -------
+    output : conpagnon.computing.tangent_space.TangentReference
+        The reference at the geometric mean of the pooled groups covariances,
+        with its whitening matrix. New subjects can be projected with its
+        transform_time_series method, and it can be saved on disk.
+    """
+    group_stacked_time_series = []
     for groupe in time_series_dictionary.keys():
         for subject in time_series_dictionary[groupe].keys():
             # appending subject time series
             group_stacked_time_series.append(time_series_dictionary[groupe][subject]['time_series'])
 
-    # Projecting in tangent space the whole cohort of subjects at the geometric mean
-    _ = tangent_measure.fit_transform(group_stacked_time_series)
-    # Retrieve the geometric mean
-    tangent_mean_ = tangent_measure.mean_
-
-    return tangent_mean_
+    return tangent_space.TangentReference.from_time_series(time_series=group_stacked_time_series,
+                                                           covariance_estimator=covariance_estimator, init=init)
 
 
 def group_mean_connectivity(subjects_connectivity_matrices, kinds, axis=0):
@@ -677,6 +1868,7 @@ def group_mean_connectivity(subjects_connectivity_matrices, kinds, axis=0):
             discarded rois array index, a 'masked_array' key containing
             the array of Boolean of True for the discarded_rois index, and False
             elsewhere.
+        A ConnectivityStore is also accepted.
     kinds : list
         List of kinds you want the mean connectivity. Choices
         are 'correlation', 'tangent', 'covariances', 'precision', 'partial 
@@ -692,7 +1884,9 @@ def group_mean_connectivity(subjects_connectivity_matrices, kinds, axis=0):
             - The first keys levels is the different groups in the study.
             - The second keys levels is the mean connectivity matrices for
             the different kinds. They are array of shape (number of regions , number of regions)
-            if vectorize is False, and shape (n_columns * (n_columns + 1) /2) else.
+            if vectorize is False, and shape (n_columns * (n_columns + 1) /2) else. The mean
+            of packed matrices, see PackedSymmetricMatrix, is computed on the lower triangle
+            and returned as a dense array.
             
     See Also
     --------
@@ -712,6 +1906,13 @@ def group_mean_connectivity(subjects_connectivity_matrices, kinds, axis=0):
     This point is the geometric mean for the POOLED groups if multiple group are studied !
     """
 
+    if isinstance(subjects_connectivity_matrices, connectivity_store.ConnectivityStore):
+        # The group means are computed on the views of the store arrays
+        store = subjects_connectivity_matrices
+        return {groupe: {kind: array_operation.PackedSymmetricMatrix(
+            lower_triangle=masked_arrays_mean(arrays=store.kind_array(kind, groupe), masked_array=store.masks(groupe),
+                                              axis=axis)).dense() for kind in kinds} for groupe in store.groups}
+
     group_mean_connectivity_matrices = dict.fromkeys(list(subjects_connectivity_matrices.keys()))
     for groupe in subjects_connectivity_matrices.keys():
         # Dictionnary initialisation : for each group, we generate the list of kinds as keys
@@ -719,12 +1920,24 @@ def group_mean_connectivity(subjects_connectivity_matrices, kinds, axis=0):
         # Subject list of the current group
         subjects_list = subjects_connectivity_matrices[groupe].keys()
         for kind in kinds:
+            subjects_kind_matrices = [subjects_connectivity_matrices[groupe][subject][kind]
+                                      for subject in subjects_list]
+            if subjects_kind_matrices and isinstance(subjects_kind_matrices[0], array_operation.PackedSymmetricMatrix):
+                # Packed matrices are averaged on their lower triangle, only the mean is expanded
+                packed_stack_matrices = array_operation.stack_packed_matrices(subjects_kind_matrices)
+                packed_mask_stack = array_operation.stack_packed_masks(
+                    [subjects_connectivity_matrices[groupe][subject]['masked_array'] for subject in subjects_list])
+                packed_mean = masked_arrays_mean(arrays=packed_stack_matrices.lower_triangle,
+                                                 masked_array=packed_mask_stack.lower_triangle,
+                                                 axis=axis)
+                group_mean_connectivity_matrices[groupe][kind] = \
+                    array_operation.PackedSymmetricMatrix(lower_triangle=packed_mean).dense()
+                continue
             # We stack the subjects connectivity matrices for the group and current kind
-            kind_stack_matrices = np.array([subjects_connectivity_matrices[groupe][subject][kind]
-                                            for subject in subjects_list])
+            kind_stack_matrices = np.array(subjects_kind_matrices)
             # We also stack the subjects boolean array
-            mask_array_stack = np.array([subjects_connectivity_matrices[groupe][subject]['masked_array']
-                                         for subject in subjects_list])
+            mask_array_stack = array_operation.stack_masks([subjects_connectivity_matrices[groupe][subject]['masked_array']
+                                                            for subject in subjects_list])
             # We compute the mean for each kind, accounting for the discarded rois,
             # via the function call masked_array_mean
             group_mean_connectivity_matrices[groupe][kind] = masked_arrays_mean(arrays=kind_stack_matrices,
@@ -783,31 +1996,45 @@ def pooled_groups_connectivity(time_series_dictionary, kinds, covariance_estimat
     choices are the Ledoit-Wolf estimator, or the OAS estimator.
     """
     group_stacked_time_series = []
+    subject_labels = []
     for groupe in time_series_dictionary.keys():
         subject_list = time_series_dictionary[groupe].keys()
         for subject in subject_list:
-            # Appending a tuple: time series and the corresponding labels of the subjects
-            group_stacked_time_series.append((time_series_dictionary[groupe][subject]['time_series'], subject))
-    
-    # We compute the connectivity matrices for each subject in the pooled group
+            # Appending the time series and the corresponding labels of the subjects
+            group_stacked_time_series.append(time_series_dictionary[groupe][subject]['time_series'])
+            subject_labels.append(subject)
+    subject_labels = np.array(subject_labels)
+
+    # We compute the connectivity matrices for each subject in the pooled group, from
+    # one covariance estimate for each subject
+    engine_kinds = [kind for kind in kinds if kind != 'tangent']
+    if 'tangent' in kinds and 'covariance' not in engine_kinds:
+        engine_kinds.append('covariance')
+    pooled_kinds_matrices = {kind: np.array(kind_matrices) for kind, kind_matrices in
+                             covariance_engine.subjects_connectivity_kinds(
+                                 time_series=group_stacked_time_series, kinds=engine_kinds,
+                                 covariance_estimator=covariance_estimator).items()}
+    if 'tangent' in kinds:
+        tangent_reference = tangent_space.TangentReference.from_covariances(
+            covariances=pooled_kinds_matrices['covariance'], covariance_estimator=covariance_estimator)
+        pooled_kinds_matrices['tangent'] = tangent_reference.transform(
+            covariances=pooled_kinds_matrices['covariance'])
+
     pooled_connectivity_matrices_dictionary = dict.fromkeys(kinds)
-    stacked_couple_subject_time_series = np.array(group_stacked_time_series)
-    group_stacked_time_series = stacked_couple_subject_time_series[:, 0]
-    subject_labels = stacked_couple_subject_time_series[:, 1]
     for kind in kinds:
-        connectivity_measure = ConnectivityMeasure(kind=kind,
-                                                   cov_estimator=covariance_estimator,
-                                                   vectorize=vectorize)
-        pooled_connectivity_matrices_dictionary[kind] = \
-            connectivity_measure.fit_transform(group_stacked_time_series)
-        
+        if vectorize:
+            pooled_connectivity_matrices_dictionary[kind] = sym_matrix_to_vec(pooled_kinds_matrices[kind])
+        else:
+            pooled_connectivity_matrices_dictionary[kind] = pooled_kinds_matrices[kind]
+
     return pooled_connectivity_matrices_dictionary, subject_labels
 
 
 def extract_sub_connectivity_matrices(subjects_connectivity_matrices, kinds,
                                       regions_index,
                                       vectorize=False,
-                                      discard_diagonal=False):
+                                      discard_diagonal=False,
+                                      stacked=False):
     """Extract sub matrices given region index.
 
     Parameters
@@ -816,52 +2043,72 @@ def extract_sub_connectivity_matrices(subjects_connectivity_matrices, kinds,
         The dictionnary containing for each subjects, for each group and kind, the
         connectivity matrices, of shape (n_features, n_features), and also
         the boolean mask array indicating the discarded roi.
+        A ConnectivityStore is also accepted.
     kinds: list
         The list of kinds.
-    regions_index: list, or 1D numpy.array of shape (number of indices, )
+    regions_index: list, 1D numpy.array of shape (number of indices, ), or SubMatrixIndex
         The list of index of regions you want to extract the connectivity. The
         region index also correspond to the index of ROIs in the 4D reference
-        atlas of the study.
+        atlas of the study. A conpagnon.utils.array_operation.SubMatrixIndex, computed
+        once for a subset of regions, is also accepted, when the same regions are
+        extracted several times.
     vectorize: bool, optional
         If True, the extracted sub-matrices are vectorized, keeping
         the diagonal of the matrix, and the corresponding boolean
         mask.
     discard_diagonal: bool, optional
         If True, the diagonal is discard when the extracted connectivity matrices are vectorized.
+    stacked: bool, optional
+        If True, the sub-matrices of the subjects of each group are returned stacked,
+        like stacked_connectivity_matrices does. Default is False.
 
     Returns
     -------
     output: dict
         A dictionnary containing for each group and kinds, for each subject
-        the extract sub-matrice, and the corresponding boolean mask.
+        the extract sub-matrice, and the corresponding boolean mask. The other
+        entries of the subjects dictionnaries are shared with the entered dictionnary,
+        not copied. The sub-matrices of packed matrices are packed too. If stacked is True,
+        the sub-matrices of each group are stacked, see stacked_connectivity_matrices.
+        For a ConnectivityStore, and vectorize set to False, a ConnectivityStore
+        of the sub-matrices is returned, or its stacked matrices if stacked is True.
+
+    Notes
+    -----
+    The index of the sub-matrices is computed once, and each kind of a ConnectivityStore
+    is extracted with one fancy index on the store array.
     """
+    if not isinstance(regions_index, array_operation.SubMatrixIndex):
+        regions_index = array_operation.SubMatrixIndex(regions_index)
 
-    # Copy of the subjects connectivity matrices dictionnary
-    subjects_connectivity_matrices_copy = deepcopy(subjects_connectivity_matrices)
+    if isinstance(subjects_connectivity_matrices, connectivity_store.ConnectivityStore) and not vectorize:
+        sub_store = subjects_connectivity_matrices.take_regions(regions_index)
+        if not stacked:
+            return sub_store
+        return pre_preprocessing.stacked_connectivity_matrices(subjects_connectivity_matrices=sub_store, kinds=kinds)
 
-    for groupe in subjects_connectivity_matrices_copy.keys():
-        for subject in subjects_connectivity_matrices_copy[groupe].keys():
+    subjects_sub_connectivity_matrices = dict.fromkeys(subjects_connectivity_matrices.keys())
+    for groupe in subjects_connectivity_matrices.keys():
+        group_dictionary = subjects_connectivity_matrices[groupe]
+        subjects_list = list(group_dictionary.keys())
+        subjects_sub_connectivity_matrices[groupe] = dict.fromkeys(subjects_list)
+        for subject in subjects_list:
+            # The other entries are shared with the entered dictionnary
+            subject_sub_connectivity_matrices = dict(group_dictionary[subject])
             for kind in kinds:
-                # Sub extraction of connectivity matrices according the provided region_index array
-                row_sliced = subjects_connectivity_matrices_copy[groupe][subject][kind][regions_index, :]
-                subjects_connectivity_matrices_copy[groupe][subject][kind] = row_sliced[:, regions_index]
-                if vectorize:
-                    _, subjects_connectivity_matrices_copy[groupe][subject][kind] = \
-                        vectorizer(numpy_array=row_sliced[:, regions_index],
-                                   discard_diagonal=discard_diagonal,
-                                   array_type='numeric')
-
+                # Sub extraction of connectivity matrices according the provided region index
+                subject_sub_connectivity_matrices[kind] = regions_index.take(
+                    group_dictionary[subject][kind], vectorize=vectorize, discard_diagonal=discard_diagonal)
             # Sub extraction of corresponding masked array
-            row_mask_sliced = subjects_connectivity_matrices_copy[groupe][subject]['masked_array'][regions_index, :]
-            subjects_connectivity_matrices_copy[groupe][subject]['masked_array'] = row_mask_sliced[:, regions_index]
-            if vectorize:
-                _, subjects_connectivity_matrices_copy[groupe][subject]['masked_array'] = vectorizer(
-                    numpy_array=row_mask_sliced[:, regions_index],
-                    discard_diagonal=discard_diagonal,
-                    array_type='boolean')
+            subject_sub_connectivity_matrices['masked_array'] = regions_index.take(
+                group_dictionary[subject]['masked_array'], vectorize=vectorize, discard_diagonal=discard_diagonal)
+            subjects_sub_connectivity_matrices[groupe][subject] = subject_sub_connectivity_matrices
 
-    # Return the subjects sub connectivity matrices
-    subjects_sub_connectivity_matrices = subjects_connectivity_matrices_copy
+        if stacked:
+            # Only the sub-matrices are stacked
+            subjects_sub_connectivity_matrices[groupe] = pre_preprocessing.stacked_connectivity_matrices(
+                subjects_connectivity_matrices={groupe: subjects_sub_connectivity_matrices[groupe]},
+                kinds=kinds)[groupe]
 
     return subjects_sub_connectivity_matrices
 
@@ -897,7 +2144,7 @@ def subjects_mean_connectivity_(subjects_individual_matrices_dictionnary,
     Notes
     -----
     The subjects connectivity matrices shouldn't be vectorized, the shape should
-    be (n_features, n_features).
+    be (n_features, n_features). A ConnectivityStore is also accepted.
     """
     
     # Indices of the connectivity coefficient in terms of row and column index.
@@ -942,11 +2189,86 @@ def subjects_mean_connectivity_(subjects_individual_matrices_dictionnary,
     return connectivity_of_interest
 
 
+def intra_network_strength(subjects_individual_matrices_dictionnary, groupes, kinds, network_partition,
+                           networks=None, return_network_arrays=False):
+    """Compute the intra network strength of all the subjects, for all the networks at once.
+
+    Parameters
+    ----------
+    subjects_individual_matrices_dictionnary: dict
+        The subjects connectivity dictionnary containing connectivity matrices
+        and corresponding mask array for discarded rois, for each group.
+        A ConnectivityStore is also accepted.
+    groupes: list
+        The list of groups in the study
+    kinds: list
+        The list of kinds in the study
+    network_partition: conpagnon.data_handling.atlas.NetworkPartition
+        The network partition of the atlas.
+    networks: list, optional
+        The networks names. Default is None, the networks with at least two regions.
+    return_network_arrays: bool, optional
+        If True, the coefficients of the networks, and their masks, are returned too.
+        Default is False.
+
+    Returns
+    -------
+    output: dict
+        For each group, a 'subjects' key containing the list of subjects, in the order of the
+        rows, and the kinds as keys, containing the intra network strength in a masked array of
+        shape (number of subjects, number of networks), the networks without unmasked coefficient
+        being masked. If return_network_arrays is True, a 'network arrays' key containing, for each
+        kind, the coefficients below the diagonal of all the networks, network after network, in
+        an array of shape (number of subjects, number of coefficients), a 'network masks' key
+        containing the corresponding boolean masks, and a 'network starts' key containing the
+        position of the first coefficient of each network.
+
+    Notes
+    -----
+    The coefficients of all the networks are read once for each subject, at the positions
+    precomputed by the partition, and the strength of all the networks of all the subjects is
+    one grouped masked reduction, see conpagnon.utils.array_operation.masked_segments_means.
+    """
+    rows, columns, starts = network_partition.within_networks_coefficients(networks)
+    positions = array_operation.packed_index(rows, columns)
+
+    intra_network_strength_dict = dict.fromkeys(groupes)
+    for groupe in groupes:
+        if isinstance(subjects_individual_matrices_dictionnary, connectivity_store.ConnectivityStore):
+            store = subjects_individual_matrices_dictionnary
+            subjects_list = list(store.group_subjects(groupe))
+            networks_masks = store.masks(group=groupe, positions=positions)
+            networks_arrays = {kind: store.kind_array(kind, groupe)[:, positions] for kind in kinds}
+        else:
+            group_dictionary = subjects_individual_matrices_dictionnary[groupe]
+            subjects_list = list(group_dictionary.keys())
+            networks_masks = np.array([array_operation.matrix_coefficients(group_dictionary[subject]['masked_array'],
+                                                                            rows, columns)
+                                       for subject in subjects_list], dtype=bool)
+            networks_arrays = {kind: np.array([array_operation.matrix_coefficients(group_dictionary[subject][kind],
+                                                                                    rows, columns)
+                                               for subject in subjects_list])
+                               for kind in kinds}
+
+        intra_network_strength_dict[groupe] = {'subjects': subjects_list}
+        for kind in kinds:
+            networks_means, networks_counts = array_operation.masked_segments_means(
+                arrays=networks_arrays[kind], masked_array=networks_masks, segments_starts=starts)
+            intra_network_strength_dict[groupe][kind] = np.ma.array(networks_means, mask=networks_counts == 0)
+        if return_network_arrays:
+            intra_network_strength_dict[groupe]['network arrays'] = networks_arrays
+            intra_network_strength_dict[groupe]['network masks'] = networks_masks
+            intra_network_strength_dict[groupe]['network starts'] = starts
+
+    return intra_network_strength_dict
+
+
 def intra_network_functional_connectivity(subjects_individual_matrices_dictionnary,
                                           groupes, kinds, atlas_file,
                                           network_column_name,
                                           sheetname,
-                                          roi_indices_column_name, color_of_network_column):
+                                          roi_indices_column_name, color_of_network_column,
+                                          return_network_arrays=False):
     """Compute for each subjects, the intra network connectivity for each network in the study.
 
     Parameters
@@ -954,12 +2276,15 @@ def intra_network_functional_connectivity(subjects_individual_matrices_dictionna
     subjects_individual_matrices_dictionnary: dict
         The subjects connectivity dictionnary containing connectivity matrices
         and corresponding mask array for discarded rois, for each group.
+        A ConnectivityStore is also accepted.
     groupes: list
         The list of groups in the study
     kinds: list
         The list of kinds in the study
     atlas_file: string
-        The full path to an excel file containing information on the atlas
+        The full path to an excel file containing information on the atlas. A
+        conpagnon.data_handling.atlas.NetworkPartition is also accepted, the
+        excel file being read once, and the other atlas arguments being ignored.
     network_column_name: string
         The name of the column in the excel file containing the network label for each roi
     roi_indices_column_name: string
@@ -968,14 +2293,17 @@ def intra_network_functional_connectivity(subjects_individual_matrices_dictionna
         The name of the active sheet in the excel file
     color_of_network_column: string
         The name of the columns containing for each roi, the corresponding network color.
+    return_network_arrays: bool, optional
+        If True, the vectorized coefficients of each network, and their masks, are stored
+        for each subject too. Default is False.
 
     Returns
     -------
     output 1: dict
         A dictionnary structure containing for each subject and for each network: the network connectivity,
-        the vectorized array of coefficients of the network without the diagonal, the corresponding vectorized
-        mask array accounting for discarded rois, the diagonal of the mask array, the masked array structure
-        of the network, and finally the number of rois in the network.
+        and the number of rois in the network. If return_network_arrays is True, the vectorized array of
+        coefficients of the network without the diagonal, the corresponding vectorized mask array accounting
+        for discarded rois, the diagonal of the network, and the diagonal of the mask array too.
     output 2: dict
         A dictionnary network, containing information fetch from the atlas excel file of the atlas.
     output 3: list
@@ -988,8 +2316,8 @@ def intra_network_functional_connectivity(subjects_individual_matrices_dictionna
     The intra connectivity is simply defined as the mean, for each network,
     of the coefficient belonging to the network. Because connectivity metrics are symmetric,
     we only taking the vectorize part of the network connectivity matrices. We account for discarded roi,
-    as we compute the mean on a numpy masked array structure, that is the vectorized array
-    along with the vectorized boolean mask for the current network.
+    as we compute the mean on the unmasked coefficients of the network only. The strength of all the
+    networks, for all the subjects of a group, is computed at once, see intra_network_strength.
 
     References
     ----------
@@ -1002,121 +2330,132 @@ def intra_network_functional_connectivity(subjects_individual_matrices_dictionna
 
     """
 
-    network_dict = atlas.fetch_atlas_functional_network(atlas_excel_file=atlas_file,
-                                                        sheetname=sheetname,
-                                                        network_column_name=network_column_name)
-    network_labels_list = list(network_dict.keys())
+    network_partition = atlas.network_partition(atlas_file=atlas_file, sheetname=sheetname,
+                                                network_column_name=network_column_name,
+                                                roi_indices_column_name=roi_indices_column_name,
+                                                color_of_network_column=color_of_network_column)
+    network_dict = network_partition.networks_dictionary
+    network_labels_list = network_partition.network_labels
     # The list of network are NOT in the same order of the atlas in the analysis, 
     # we have to fetch the color according to network labels list.
-    
-    network_label_color_name = [list(set(network_dict[n]['dataframe'][color_of_network_column]))[0]
-                                for n in network_labels_list]
-    network_label_colors = (1/255)*np.array([webcolors.name_to_rgb(network_label_color_name[i])
-                                             for i in range(len(network_label_color_name))])
-    
+    network_label_colors = network_partition.network_colors(network_labels_list)
+
+    # Computation make sense only they are at least two regions in the network,
+    # we keep their label and color for plotting purpose in the t-test
+    valid_network_list = [network for network in network_labels_list
+                          if network_partition.number_of_rois(network) >= 2]
+    valid_network_color_list = [network_label_colors[network_labels_list.index(network)]
+                                for network in valid_network_list]
+
     # For each subject in each group : the network intra-connectivity
     # is defined as the mean of the connectivity coefficient inside
     # the network.
+    networks_strength = intra_network_strength(
+        subjects_individual_matrices_dictionnary=subjects_individual_matrices_dictionnary, groupes=groupes,
+        kinds=kinds, network_partition=network_partition, networks=valid_network_list,
+        return_network_arrays=return_network_arrays)
 
     # Intra network dictionnary initialisation
     intra_network_connectivity_dict = dict.fromkeys(groupes)
     for groupe in groupes:
-        subjects_list = subjects_individual_matrices_dictionnary[groupe].keys()
-        intra_network_connectivity_dict[groupe] = dict.fromkeys(subjects_list)
-        for subject in subjects_list:
-            intra_network_connectivity_dict[groupe][subject] = dict.fromkeys(kinds)
-            for kind in kinds:
-                intra_network_connectivity_dict[groupe][subject][kind] = dict.fromkeys(network_labels_list)
-
-    # Initialisation of the list containing the label of network which have at least two regions
-    valid_network_list = []
-    # Initialisation of the list containing the color of the label network which have at least two regions
-    valid_network_color_list = []
-    for network in network_labels_list:
-
-        # Fetch the indices of the network roi in the 4D atlas file, it will the same indices to slice in the subject
-        # connectivity matrices
-        network_roi_4d_indices = network_dict[network]['dataframe'][roi_indices_column_name]
-        # Fetch the number of rois in the network
-        n_roi_in_network = network_dict[network]['number of rois']
-        # Computation make sense only they are at least two regions in the current network
-        if n_roi_in_network >= 2:
-            # It is a valid network, we append it's label and color for plotting purpose in the t-test
-            valid_network_list.append(network)
-            valid_network_color_list.append(network_label_colors[network_labels_list.index(network)])
-            # Extract the sub matrix corresponding to the current network for all kinds
-            network_connectivity_matrix = extract_sub_connectivity_matrices(
-                subjects_connectivity_matrices=subjects_individual_matrices_dictionnary,
-                kinds=kinds, regions_index=network_roi_4d_indices, vectorize=False)
-            # For Each group, each kind and subject:
-            # sum the lower diagonal of each network, accounting for the discarded ROIs,
-            # if they are some in the network
-            for groupe in groupes:
-                subjects_list = network_connectivity_matrix[groupe].keys()
-                for subject in subjects_list:
-                    for kind in kinds:
-                        # Vectorize the network connectivity matrix
-                        diag_network, vectorize_network = array_operation.vectorizer(
-                            numpy_array=network_connectivity_matrix[groupe][subject][kind],
-                            discard_diagonal=True,
-                            array_type='numeric')
-                        # Vectorize the boolean mask
-                        diag_network_mask, vectorize_network_mask = array_operation.vectorizer(
-                            numpy_array=network_connectivity_matrix[groupe][subject]['masked_array'],
-                            discard_diagonal=True,
-                            array_type='boolean')
-                        # Construct the masked array structure for the current network
-                        network_masked_array = np.ma.array(data=vectorize_network, mask=vectorize_network_mask)
-                        # Compute the mean for the network, accounting for discarded
-                        # rois via the numpy masked array structure
-                        network_mean = network_masked_array.mean()
-                        # Fill the intra network dictionnary
-                        intra_network_connectivity_dict[groupe][subject][kind][network] = {
-                            'network connectivity strength': network_mean,
-                            'network array': vectorize_network,
-                            'network diagonal array': diag_network,
-                            'network mask': vectorize_network_mask,
-                            'network diagonal masked array': diag_network_mask,
-                            'number of rois in network': n_roi_in_network}
+        subjects_list = networks_strength[groupe]['subjects']
+        intra_network_connectivity_dict[groupe] = {subject: {kind: dict.fromkeys(network_labels_list)
+                                                             for kind in kinds}
+                                                   for subject in subjects_list}
+        if return_network_arrays:
+            starts = networks_strength[groupe]['network starts']
+            ends = np.append(starts[1:], networks_strength[groupe]['network masks'].shape[1])
+            # The diagonal of the networks
+            diagonal_rois = np.concatenate([network_partition.networks_rois[network]
+                                            for network in valid_network_list])
+            diagonal_ends = np.cumsum([network_partition.number_of_rois(network) for network in valid_network_list])
+            diagonal_starts = diagonal_ends - [network_partition.number_of_rois(network)
+                                               for network in valid_network_list]
+            if isinstance(subjects_individual_matrices_dictionnary, connectivity_store.ConnectivityStore):
+                store = subjects_individual_matrices_dictionnary
+                diagonal_positions = array_operation.packed_index(diagonal_rois, diagonal_rois)
+                diagonal_masks = store.masks(group=groupe, positions=diagonal_positions)
+                diagonal_arrays = {kind: store.kind_array(kind, groupe)[:, diagonal_positions] for kind in kinds}
+            else:
+                group_dictionary = subjects_individual_matrices_dictionnary[groupe]
+                diagonal_masks = np.array([array_operation.matrix_coefficients(
+                    group_dictionary[subject]['masked_array'], diagonal_rois, diagonal_rois)
+                    for subject in subjects_list], dtype=bool)
+                diagonal_arrays = {kind: np.array([array_operation.matrix_coefficients(
+                    group_dictionary[subject][kind], diagonal_rois, diagonal_rois) for subject in subjects_list])
+                    for kind in kinds}
+
+        for kind in kinds:
+            for network_position, network in enumerate(valid_network_list):
+                for row, subject in enumerate(subjects_list):
+                    network_connectivity = {
+                        'network connectivity strength': networks_strength[groupe][kind][row, network_position],
+                        'number of rois in network': network_partition.number_of_rois(network)}
+                    if return_network_arrays:
+                        network_edges = slice(starts[network_position], ends[network_position])
+                        network_diagonal = slice(diagonal_starts[network_position], diagonal_ends[network_position])
+                        network_connectivity.update({
+                            'network array': networks_strength[groupe]['network arrays'][kind][row, network_edges],
+                            'network diagonal array': diagonal_arrays[kind][row, network_diagonal],
+                            'network mask': networks_strength[groupe]['network masks'][row, network_edges],
+                            'network diagonal masked array': diagonal_masks[row, network_diagonal]})
+                    intra_network_connectivity_dict[groupe][subject][kind][network] = network_connectivity
 
     return intra_network_connectivity_dict, network_dict, valid_network_list,  valid_network_color_list
 
 
 def inter_network_subjects_connectivity_matrices(subjects_individual_matrices_dictionnary, groupes,
                                                  kinds, atlas_file, sheetname,
-                                                 network_column_name, roi_indices_column_name):
+                                                 network_column_name, roi_indices_column_name,
+                                                 return_network_pairs=False):
     """Compute for each subjects, the inter network connectivity matrices
 
     Parameters
     ----------
     subjects_individual_matrices_dictionnary: dict
         The subjects connectivity matrices dictionnary for each groupes, and kind in the study.
+        A ConnectivityStore is also accepted, the inter network strength of all
+        the subjects of a group being computed at once.
     groupes: list
         The list of groups in the study
     kinds: list
         The list of kinds in the study
     atlas_file: string
-        The full path to an excel file containing information on the atlas
+        The full path to an excel file containing information on the atlas. A
+        conpagnon.data_handling.atlas.NetworkPartition is also accepted, the
+        excel file being read once, and the other atlas arguments being ignored.
     network_column_name: string
         The name of the column in the excel file containing the network label for each roi
     roi_indices_column_name
         The name of the column in the excel file containing the index of each ROI in the 4D atlas file.
     sheetname: string
         The name of the active sheet in the excel file
+    return_network_pairs: bool, optional
+        If True, the coefficients of each pair of network are returned too.
+        Default is False.
 
     Returns
     -------
-    output: dict
+    output 1: dict
         The subjects inter network connectivity matrices dictionnary, for each group and kinds. Each matrices
         should have shape (number of network, number of network).
+    output 2: list
+        The network labels order.
+    output 3: dict
+        Only if return_network_pairs is True, for each group, subject, kind and pair of network,
+        a dictionary containing the inter network 'strength', the 'connectivity coefficient'
+        array of the pair, and the corresponding boolean 'masked array'.
 
     Notes
     -----
     The inter-network connectivity is simply defined as the mean of all possible
     connection between a network pair. We also account for the possible discarded rois
-    in one or both the network by computing the mean on a masked array structure, that is,
-    the inter-network coefficient of interest, along with the corresponding value of the masked
-    array.
+    in one or both the network by computing the mean on the unmasked coefficients only.
+    With A the indicator matrix of the rois in each network, C the connectivity matrix and
+    M the unmasked coefficients, the inter network strengths of all the pairs of network
+    are the block means A^T (M * C) A / A^T M A, computed for all the subjects of a group
+    at once, see conpagnon.utils.array_operation.masked_block_means. The pairs of network
+    without unmasked coefficient have a NaN strength.
 
     References
     ----------
@@ -1129,15 +2468,15 @@ def inter_network_subjects_connectivity_matrices(subjects_individual_matrices_di
 
     """
 
-    # Fetch all the network information from a excel file
-    network_dict = atlas.fetch_atlas_functional_network(atlas_excel_file=atlas_file,
-                                                        sheetname=sheetname,
-                                                        network_column_name=network_column_name)
+    # Fetch all the network information from a excel file, unless a partition is given
+    network_partition = atlas.network_partition(atlas_file=atlas_file, sheetname=sheetname,
+                                                network_column_name=network_column_name,
+                                                roi_indices_column_name=roi_indices_column_name)
     # The list of network name
-    network_labels_list = list(network_dict.keys())
+    network_labels_list = network_partition.network_labels
 
     # Find all possible pair of network
-    network_possible_pairs = list(itertools.combinations(network_labels_list, 2))
+    network_possible_pairs = network_partition.network_pairs
     subjects_inter_network_connectivity_matrices = dict.fromkeys(groupes)
     n_network = len(network_labels_list)
 
@@ -1147,53 +2486,91 @@ def inter_network_subjects_connectivity_matrices(subjects_individual_matrices_di
     network_labels_order = remove_duplicate(seq=list(network_possible_pairs_array[:, 1]))
     network_labels_order.insert(0, network_possible_pairs[0][0])
 
-    # Initialize a dictionnary for each network
-    # Extract the inter network connectivity matrix
+    if return_network_pairs:
+        network_pairs = {groupe: {subject: {kind: dict.fromkeys(network_possible_pairs) for kind in kinds}
+                                  for subject in subjects_individual_matrices_dictionnary[groupe].keys()}
+                         for groupe in groupes}
+
+    if isinstance(subjects_individual_matrices_dictionnary, connectivity_store.ConnectivityStore):
+        # The coefficients of each pair of network are read at their positions in the store arrays,
+        # in the order of the loops below
+        store = subjects_individual_matrices_dictionnary
+        pairs_positions = [network_partition.between_network_edges(*pair_of_network)
+                           for pair_of_network in network_possible_pairs]
+        for groupe in groupes:
+            subjects_list = store.group_subjects(groupe)
+            subjects_inter_network_connectivity_matrices[groupe] = {subject: {} for subject in subjects_list}
+            pairs_masks = [store.masks(group=groupe, positions=pair_positions) for pair_positions in pairs_positions]
+            for kind in kinds:
+                kind_array = store.kind_array(kind, groupe)
+                # The fully masked pairs of network have a NaN strength
+                all_inter_network_strength = np.array(
+                    [np.ma.filled(np.ma.array(data=kind_array[:, pair_positions], mask=pair_masks).mean(axis=1),
+                                  np.nan) for pair_positions, pair_masks in zip(pairs_positions, pairs_masks)]).T
+                inter_network_matrices = vec_to_sym_matrix(all_inter_network_strength,
+                                                           diagonal=np.ones((len(subjects_list), n_network))/sqrt(2))
+                for row, subject in enumerate(subjects_list):
+                    subjects_inter_network_connectivity_matrices[groupe][subject][kind] = inter_network_matrices[row]
+
+                if return_network_pairs:
+                    for pair_position, (pair_of_network, pair_positions, pair_masks) in enumerate(
+                            zip(network_possible_pairs, pairs_positions, pairs_masks)):
+                        for row, subject in enumerate(subjects_list):
+                            network_pairs[groupe][subject][kind][pair_of_network] = {
+                                'strength': all_inter_network_strength[row, pair_position],
+                                'connectivity coefficient': kind_array[row, pair_positions],
+                                'masked array': pair_masks[row]}
+
+        if return_network_pairs:
+            return subjects_inter_network_connectivity_matrices, network_labels_order, network_pairs
+        return subjects_inter_network_connectivity_matrices, network_labels_order
+
+    # The first and second network of each pair, in the columns of the network assignment matrix
+    first_networks = np.array([network_labels_list.index(pair_of_network[0])
+                               for pair_of_network in network_possible_pairs], dtype=int)
+    second_networks = np.array([network_labels_list.index(pair_of_network[1])
+                                for pair_of_network in network_possible_pairs], dtype=int)
+    network_assignment = None
     for groupe in groupes:
         subjects_list = list(subjects_individual_matrices_dictionnary[groupe].keys())
-        subjects_inter_network_connectivity_matrices[groupe] = dict.fromkeys(subjects_list)
-        for subject in subjects_list:
-            subjects_inter_network_connectivity_matrices[groupe][subject] = dict.fromkeys(kinds)
-            for kind in kinds:
-                subjects_inter_network_connectivity_matrices[groupe][subject][kind] = \
-                    dict.fromkeys(network_possible_pairs)
-                all_inter_network_strength = []
-                for pair_of_network in network_possible_pairs:
-                    inter_network_coefficient_to_sum = []
-                    inter_network_coefficient_to_sum_mask = []
-                    # Fetch the roi index in 4D atlas of the first network
-                    # in the pair via the network dictionary, and number of rois
-                    first_network_roi_index = network_dict[pair_of_network[0]]['dataframe'][roi_indices_column_name]
-                    # Fetch the roi index in 4D atlas of the second network in the pair
-                    second_network_roi_index = network_dict[pair_of_network[1]]['dataframe'][roi_indices_column_name]
-                    # Loop over the pair of coefficient between the pair of network
-                    for j in first_network_roi_index:
-                        for i in second_network_roi_index:
-                            # Append the coefficient to sum of all possible inter network coefficient pair
-                            inter_network_coefficient_to_sum.append(
-                                subjects_individual_matrices_dictionnary[groupe][subject][kind][i, j])
-                            # Append the corresponding values in the masked array accounting for discarded rois.
-                            inter_network_coefficient_to_sum_mask.append(
-                                subjects_individual_matrices_dictionnary[groupe][subject]['masked_array'][i, j])
-    
-                    # Construct the masked array structure
-                    # TODO: ABS or not Abs?
-                    inter_network_pair_masked_array = np.ma.array(data=inter_network_coefficient_to_sum,
-                                                                  mask=inter_network_coefficient_to_sum_mask)
-                    # Average of the masked array structure, this is the inter network strength
-                    inter_network_strength = inter_network_pair_masked_array.mean()
-    
-                    all_inter_network_strength.append(inter_network_strength)
-    
-                    subjects_inter_network_connectivity_matrices[groupe][subject][kind][pair_of_network] = {
-                        'strength': inter_network_strength,
-                        'connectivity coefficient': inter_network_pair_masked_array.data,
-                        'masked array': inter_network_pair_masked_array.mask
-                                                                                                            }
-    
-                subjects_inter_network_connectivity_matrices[groupe][subject][kind] = \
-                    vec_to_sym_matrix(np.array(all_inter_network_strength), diagonal=np.ones(n_network)/sqrt(2))
-
+        subjects_inter_network_connectivity_matrices[groupe] = {subject: dict.fromkeys(kinds)
+                                                                for subject in subjects_list}
+        subjects_masks = array_operation.stack_masks(
+            [subjects_individual_matrices_dictionnary[groupe][subject]['masked_array'] for subject in subjects_list])
+        if network_assignment is None:
+            network_assignment = network_partition.assignment_matrix(number_of_regions=subjects_masks.shape[-1])
+        for kind in kinds:
+            subjects_matrices = np.array([np.asarray(subjects_individual_matrices_dictionnary[groupe][subject][kind])
+                                          for subject in subjects_list])
+            # The inter network strength is the mean of the unmasked coefficients between
+            # the rois of the second network (rows) and the first network (columns), the
+            # fully masked pairs of network having a NaN strength
+            network_block_means, _ = array_operation.masked_block_means(
+                arrays=subjects_matrices, masked_array=subjects_masks, assignment=network_assignment)
+            all_inter_network_strength = network_block_means[:, second_networks, first_networks]
+            inter_network_matrices = vec_to_sym_matrix(all_inter_network_strength,
+                                                       diagonal=np.ones((len(subjects_list), n_network))/sqrt(2))
+            for row, subject in enumerate(subjects_list):
+                subjects_inter_network_connectivity_matrices[groupe][subject][kind] = inter_network_matrices[row]
+
+            if return_network_pairs:
+                for pair_position, pair_of_network in enumerate(network_possible_pairs):
+                    first_network_roi_index = network_partition.networks_rois[pair_of_network[0]]
+                    second_network_roi_index = network_partition.networks_rois[pair_of_network[1]]
+                    # The coefficients [i, j], for j in the first network and i in the second network
+                    pair_index = np.ix_(np.arange(len(subjects_list)), second_network_roi_index,
+                                        first_network_roi_index)
+                    pair_coefficients = subjects_matrices[pair_index].transpose(0, 2, 1).reshape(
+                        len(subjects_list), -1)
+                    pair_masks = subjects_masks[pair_index].transpose(0, 2, 1).reshape(len(subjects_list), -1)
+                    for row, subject in enumerate(subjects_list):
+                        network_pairs[groupe][subject][kind][pair_of_network] = {
+                            'strength': all_inter_network_strength[row, pair_position],
+                            'connectivity coefficient': pair_coefficients[row],
+                            'masked array': pair_masks[row]}
+
+    if return_network_pairs:
+        return subjects_inter_network_connectivity_matrices, network_labels_order, network_pairs
     return subjects_inter_network_connectivity_matrices, network_labels_order
 
 
@@ -1222,33 +2599,44 @@ def mean_of_flatten_connectivity_matrices(subjects_individual_matrices_dictionar
     Notes
     -----
     The subjects connectivity matrices shouldn't be vectorized, the shape should
-    be (n_features, n_features).
+    be (n_features, n_features). A ConnectivityStore is also accepted.
+    The means are computed on plain arrays, see
+    conpagnon.utils.array_operation.masked_statistics.
     """
     connectivity_of_interest = dict.fromkeys(list(subjects_individual_matrices_dictionary.keys()))
     for groupe in groupes:
-        subjects_list = subjects_individual_matrices_dictionary[groupe].keys()
-        connectivity_of_interest[groupe] = dict.fromkeys(list(subjects_list))
-        for subject in subjects_list:
-            connectivity_of_interest[groupe][subject] = dict.fromkeys(kinds)
-            for kind in kinds:
-                # Vectorize the array for the current kind
-                diag_connectivity, vectorize_connectivity = array_operation.vectorizer(
-                    numpy_array=subjects_individual_matrices_dictionary[groupe][subject][kind],
-                    discard_diagonal=True,
-                    array_type='numeric')
-                # Vectorize the corresponding boolean mask
-                diag_mask, vectorize_mask = array_operation.vectorizer(
+        subjects_list = list(subjects_individual_matrices_dictionary[groupe].keys())
+        connectivity_of_interest[groupe] = {subject: dict.fromkeys(kinds) for subject in subjects_list}
+        if isinstance(subjects_individual_matrices_dictionary, connectivity_store.ConnectivityStore):
+            store = subjects_individual_matrices_dictionary
+            vectorize_mask = store.masks(group=groupe, positions=array_operation.packed_triangle_positions(
+                store.number_of_regions, True))
+        else:
+            # Vectorize the corresponding boolean masks
+            vectorize_mask = array_operation.stack_masks(
+                [array_operation.vectorizer(
                     numpy_array=subjects_individual_matrices_dictionary[groupe][subject]['masked_array'],
                     discard_diagonal=True,
-                    array_type='boolean')
-                # Compute the masked mean accounting for discarded ROIs
-                vectorize_connectivity_masked = np.ma.masked_array(data=vectorize_connectivity,
-                                                                   mask=vectorize_mask)
-                flat_mean_subject_connectivity = vectorize_connectivity_masked.mean()
+                    array_type='boolean')[1] for subject in subjects_list])
+        for kind in kinds:
+            # Vectorize the arrays for the current kind
+            if isinstance(subjects_individual_matrices_dictionary, connectivity_store.ConnectivityStore):
+                vectorize_connectivity = subjects_individual_matrices_dictionary.features(kind=kind, group=groupe)
+            else:
+                vectorize_connectivity = np.array(
+                    [array_operation.vectorizer(numpy_array=subjects_individual_matrices_dictionary[groupe][subject][kind],
+                                                discard_diagonal=True,
+                                                array_type='numeric')[1] for subject in subjects_list])
+            for row, subject in enumerate(subjects_list):
+                # Compute the masked mean accounting for discarded ROIs, each subject being
+                # reduced on its own to sum the coefficients in the order of numpy.ma
+                flat_mean_subject_connectivity, _, unmasked_count = array_operation.masked_statistics(
+                    arrays=vectorize_connectivity[row], masked_array=vectorize_mask[row], axis=0)
                 # Fill the dictionnary with the mean connectivity of interest for the current subjects
                 connectivity_of_interest[groupe][subject][kind] = {
-                    'connectivity masked array': vectorize_connectivity_masked,
-                    'mean connectivity': flat_mean_subject_connectivity}
+                    'connectivity masked array': np.ma.masked_array(data=vectorize_connectivity[row],
+                                                                    mask=vectorize_mask[row]),
+                    'mean connectivity': flat_mean_subject_connectivity[()] if unmasked_count > 0 else np.ma.masked}
 
     return connectivity_of_interest
 
@@ -1321,6 +2709,10 @@ def tangent_space_projection(reference_group, group_to_project, bootstrap_number
             - group_to_project_stats: The chosen
             statistic for each subject, each edges
             in the projected set of subjects.
+            - reference_group_tangent_reference: The
+            tangent space reference of the whole reference
+            group, see conpagnon.computing.tangent_space.TangentReference.
+            It can be saved, to project new subjects later on.
 
     References
     ----------
@@ -1339,6 +2731,14 @@ def tangent_space_projection(reference_group, group_to_project, bootstrap_number
         size=bootstrap_size,
         replace=False) for b in range(bootstrap_number)])
 
+    # The covariances of the reference group, and of the group to project, are
+    # estimated once, and projected at each reference with batched operations
+    covariance_estimator = LedoitWolf(store_precision=False)
+    reference_group_covariances = np.array(covariance_engine.subjects_connectivity_matrices(
+        time_series=list(reference_group), kind='covariance', covariance_estimator=covariance_estimator))
+    group_to_project_covariances = np.array(covariance_engine.subjects_connectivity_matrices(
+        time_series=list(group_to_project), kind='covariance', covariance_estimator=covariance_estimator))
+
     # Loop over the bootstrap indices
     for b in range(bootstrap_number):
         print('Bootstrap # {}'.format(b))
@@ -1350,17 +2750,17 @@ def tangent_space_projection(reference_group, group_to_project, bootstrap_number
         # Compute mean matrices, and connectivity matrices
         # in the tangent on the subset of subject from the
         # reference group without the leftout subject.
-        connectivity_measure = ConnectivityMeasure(kind='tangent',
-                                                   vectorize=True,
-                                                   discard_diagonal=True)
-        reference_group_subset_matrices = \
-            connectivity_measure.fit_transform(X=reference_group[subset_reference_group, ...])
-        reference_group_subset_mean = connectivity_measure.mean_
+        subset_tangent_reference = tangent_space.TangentReference.from_covariances(
+            covariances=reference_group_covariances[subset_reference_group, ...],
+            covariance_estimator=covariance_estimator)
+        reference_group_subset_matrices = subset_tangent_reference.transform(
+            covariances=reference_group_covariances[subset_reference_group, ...],
+            vectorize=True, discard_diagonal=True)
         # Project at the previously computed mean
         # the leftout control subject
-        leftout_subject = \
-            connectivity_measure.transform(
-                X=[reference_group[left_out_subject, ...]])[0]
+        leftout_subject = subset_tangent_reference.transform(
+            covariances=reference_group_covariances[[left_out_subject], ...],
+            vectorize=True, discard_diagonal=True)[0]
 
         # Compute a z-score between the left out controls tangent connectivity
         # and the resampled controls group
@@ -1398,18 +2798,17 @@ def tangent_space_projection(reference_group, group_to_project, bootstrap_number
 
     # Compute tangent connectivity matrices on the whole
     # reference group
-    reference_group_connectivity = ConnectivityMeasure(kind='tangent',
-                                                       vectorize=True,
-                                                       discard_diagonal=True)
-
-    reference_group_tangent_matrices = reference_group_connectivity.fit_transform(X=reference_group)
+    reference_group_tangent_reference = tangent_space.TangentReference.from_covariances(
+        covariances=reference_group_covariances, covariance_estimator=covariance_estimator)
+    reference_group_tangent_matrices = reference_group_tangent_reference.transform(
+        covariances=reference_group_covariances, vectorize=True, discard_diagonal=True)
     # Compute the tangent mean for the controls group
-    reference_group_tangent_mean = reference_group_connectivity.mean_
+    reference_group_tangent_mean = reference_group_tangent_reference.mean_
 
     # Project each subject's matrices belonging to
     # group to project in the tangent space
-    group_to_project_tangent_matrices = reference_group_connectivity.transform(
-        X=group_to_project)
+    group_to_project_tangent_matrices = reference_group_tangent_reference.transform(
+        covariances=group_to_project_covariances, vectorize=True, discard_diagonal=True)
     save_object(
         object_to_save=group_to_project_tangent_matrices,
         saving_directory=output_directory,
@@ -1454,4 +2853,5 @@ def tangent_space_projection(reference_group, group_to_project, bootstrap_number
             "reference_group_tangent_mean": reference_group_tangent_mean,
             "reference_group_tangent_matrices": reference_group_tangent_matrices,
             "group_to_project_tangent_matrices": group_to_project_tangent_matrices,
-            "group_to_project_stats": group_to_project_scores}
+            "group_to_project_stats": group_to_project_scores,
+            "reference_group_tangent_reference": reference_group_tangent_reference}
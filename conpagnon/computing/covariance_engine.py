@@ -0,0 +1,893 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched covariance and connectivity engine.
+
+The subjects time series of the same length, and the same number of
+regions, are stacked in a (subjects, time points, regions) array, and the
+covariances of all the subjects are computed at once, with one batched
+matrix product. The empirical, shrunk, Ledoit-Wolf and OAS estimators of
+scikit-learn are reproduced in closed form on the stacked array. The other
+estimators are fitted subject by subject. The correlation, partial
+correlation and precision matrices are then derived with batched numpy.linalg
+routines, like nilearn.connectome.ConnectivityMeasure does for one subject.
+When several kinds are requested, the covariance of each subject is
+estimated once, and all the kinds are derived from it. The covariances in
+sliding windows of a time series, for the dynamic connectivity, are updated
+from one window to the next with the entering and leaving time points. The
+band averaged coherences are computed from batched Welch FFTs of the stacked
+time series.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.covariance import EmpiricalCovariance, ShrunkCovariance, LedoitWolf, OAS
+from scipy.signal import get_window
+
+
+def stack_time_series(time_series):
+    """Stack the subjects time series with the same shape.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+
+    Returns
+    -------
+    output: list
+        A list of tuples, one for each distinct time series shape, of the
+        subjects positions in `time_series`, and the stacked time series of
+        shape (number of subjects, number of time points, number of regions),
+        in double precision.
+    """
+    subjects_positions = dict()
+    for position, subject_time_series in enumerate(time_series):
+        subjects_positions.setdefault(np.shape(subject_time_series), []).append(position)
+
+    return [(positions, np.array([time_series[position] for position in positions], dtype=np.float64))
+            for positions in subjects_positions.values()]
+
+
+def standardize_time_series(stacked_time_series):
+    """Standardize the stacked time series, like nilearn.signal.standardize_signal does.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The centered time series, with unit population variance.
+    """
+    if stacked_time_series.shape[1] == 1:
+        # nilearn skip the standardization of a single time point
+        return stacked_time_series.copy()
+    standardized_time_series = stacked_time_series - stacked_time_series.mean(axis=1, keepdims=True)
+    time_series_std = standardized_time_series.std(axis=1, keepdims=True)
+    # avoid numerical problems, like nilearn
+    time_series_std[time_series_std < np.finfo(np.float64).eps] = 1.0
+    standardized_time_series /= time_series_std
+
+    return standardized_time_series
+
+
+def batch_empirical_covariance(stacked_time_series, assume_centered=False):
+    """Compute the empirical covariance of each subject.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+    assume_centered: bool, optional
+        If True, the time series are not centered. Default is False.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical covariances.
+    output 2: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The centered time series.
+    """
+    if not assume_centered:
+        stacked_time_series = stacked_time_series - stacked_time_series.mean(axis=1, keepdims=True)
+    n_time_points = stacked_time_series.shape[1]
+    # One batched matrix product for all the subjects
+    empirical_covariances = np.matmul(stacked_time_series.transpose(0, 2, 1), stacked_time_series)
+    empirical_covariances /= n_time_points
+
+    return empirical_covariances, stacked_time_series
+
+
+def shrink_covariances(empirical_covariances, shrinkages):
+    """Shrink the covariances toward a scaled identity.
+
+    Parameters
+    ----------
+    empirical_covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical covariances.
+    shrinkages: numpy.array, shape (number of subjects, )
+        The shrinkage coefficient of each subject, between 0 and 1.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The shrunk covariances, (1 - shrinkage) * covariance + shrinkage * mu * identity,
+        with mu the mean of the covariance diagonal.
+    """
+    n_regions = empirical_covariances.shape[1]
+    mu = np.trace(empirical_covariances, axis1=1, axis2=2) / n_regions
+    shrunk_covariances = (1.0 - shrinkages)[:, np.newaxis, np.newaxis] * empirical_covariances
+    regions_index = np.arange(n_regions)
+    shrunk_covariances[:, regions_index, regions_index] += (shrinkages * mu)[:, np.newaxis]
+
+    return shrunk_covariances
+
+
+def ledoit_wolf_shrinkages(empirical_covariances, centered_time_series):
+    """Compute the Ledoit-Wolf shrinkage of each subject.
+
+    Parameters
+    ----------
+    empirical_covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical covariances of the centered time series.
+    centered_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The centered time series.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, )
+        The shrinkages, as computed by sklearn.covariance.ledoit_wolf_shrinkage.
+
+    Notes
+    -----
+    The sum of the coefficients of X2.T X2, with X2 the squared time series,
+    is the sum over time of the squared norms of the squared time points, so
+    that only the covariances cost a matrix product.
+    """
+    n_subjects, n_time_points, n_regions = centered_time_series.shape
+    if n_regions == 1:
+        # for only one region, the result is the same whatever the shrinkage
+        return np.zeros(n_subjects)
+    squared_time_series = centered_time_series ** 2
+    emp_cov_trace = squared_time_series.sum(axis=1) / n_time_points
+    mu = emp_cov_trace.sum(axis=1) / n_regions
+    beta_ = (squared_time_series.sum(axis=2) ** 2).sum(axis=1)
+    delta_ = (empirical_covariances ** 2).sum(axis=(1, 2))
+    beta = 1.0 / (n_regions * n_time_points) * (beta_ / n_time_points - delta_)
+    delta = delta_ - 2.0 * mu * emp_cov_trace.sum(axis=1) + n_regions * mu ** 2
+    delta /= n_regions
+    beta = np.minimum(beta, delta)
+
+    return np.divide(beta, delta, out=np.zeros(n_subjects), where=beta != 0)
+
+
+def oas_shrinkages(empirical_covariances, n_time_points):
+    """Compute the Oracle Approximating Shrinkage of each subject.
+
+    Parameters
+    ----------
+    empirical_covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical covariances.
+    n_time_points: int
+        The number of time points.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, )
+        The shrinkages, as computed by sklearn.covariance.oas.
+    """
+    n_subjects, n_regions, _ = empirical_covariances.shape
+    if n_regions == 1:
+        return np.zeros(n_subjects)
+    alpha = np.mean(empirical_covariances ** 2, axis=(1, 2))
+    mu = np.trace(empirical_covariances, axis1=1, axis2=2) / n_regions
+    mu_squared = mu ** 2
+    numerator = alpha + mu_squared
+    denominator = (n_time_points + 1) * (alpha - mu_squared / n_regions)
+
+    return np.where(denominator == 0, 1.0,
+                    np.minimum(np.divide(numerator, denominator, out=np.ones(n_subjects),
+                                         where=denominator != 0), 1.0))
+
+
+def closed_form_covariance(empirical_covariances, centered_time_series, covariance_estimator):
+    """Derive the covariance of a closed form estimator from the empirical covariance.
+
+    Parameters
+    ----------
+    empirical_covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical covariances.
+    centered_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The centered time series. Only used by the Ledoit-Wolf estimator.
+    covariance_estimator: EmpiricalCovariance, ShrunkCovariance, LedoitWolf or OAS
+        The covariance estimator.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The covariances.
+    """
+    estimator_type = type(covariance_estimator)
+    if estimator_type is EmpiricalCovariance:
+        return empirical_covariances
+    if estimator_type is ShrunkCovariance:
+        shrinkages = np.full(len(empirical_covariances), covariance_estimator.shrinkage)
+    elif estimator_type is LedoitWolf:
+        shrinkages = ledoit_wolf_shrinkages(empirical_covariances=empirical_covariances,
+                                            centered_time_series=centered_time_series)
+    else:
+        shrinkages = oas_shrinkages(empirical_covariances=empirical_covariances,
+                                    n_time_points=centered_time_series.shape[1])
+
+    return shrink_covariances(empirical_covariances=empirical_covariances, shrinkages=shrinkages)
+
+
+def batch_covariance(stacked_time_series, covariance_estimator):
+    """Estimate the covariance of each subject.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator. The EmpiricalCovariance,
+        ShrunkCovariance, LedoitWolf and OAS estimators are computed for
+        all the subjects at once, the other estimators are fitted on each
+        subject.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The covariances.
+    """
+    if type(covariance_estimator) not in [EmpiricalCovariance, ShrunkCovariance, LedoitWolf, OAS]:
+        return np.array([clone(covariance_estimator).fit(subject_time_series).covariance_
+                         for subject_time_series in stacked_time_series])
+
+    empirical_covariances, centered_time_series = batch_empirical_covariance(
+        stacked_time_series=stacked_time_series, assume_centered=covariance_estimator.assume_centered)
+
+    return closed_form_covariance(empirical_covariances=empirical_covariances,
+                                  centered_time_series=centered_time_series,
+                                  covariance_estimator=covariance_estimator)
+
+
+def covariance_to_correlation(covariances):
+    """Rescale covariances into correlations.
+
+    Parameters
+    ----------
+    covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The covariances.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The correlations, with an exact unit diagonal, like
+        nilearn.connectome.cov_to_corr.
+    """
+    inverse_std = 1.0 / np.sqrt(np.diagonal(covariances, axis1=1, axis2=2))
+    correlations = covariances * inverse_std[:, :, np.newaxis] * inverse_std[:, np.newaxis, :]
+    regions_index = np.arange(covariances.shape[1])
+    correlations[:, regions_index, regions_index] = 1.0
+
+    return correlations
+
+
+def precision_to_partial_correlation(precisions):
+    """Compute the partial correlations from the precisions.
+
+    Parameters
+    ----------
+    precisions: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The precisions, i.e the inverse covariances.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The partial correlations, with an exact unit diagonal, like
+        nilearn.connectome.prec_to_partial.
+    """
+    partial_correlations = -covariance_to_correlation(precisions)
+    regions_index = np.arange(precisions.shape[1])
+    partial_correlations[:, regions_index, regions_index] = 1.0
+
+    return partial_correlations
+
+
+def batch_connectivity_kinds(stacked_time_series, kinds, covariance_estimator):
+    """Compute several connectivity kinds for stacked subjects, from one covariance estimate.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+    kinds: list
+        The connectivity kinds. Choices are 'correlation', 'partial correlation',
+        'covariance', 'precision'.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator.
+
+    Returns
+    -------
+    output: dict
+        The connectivity kinds as keys, and the connectivity matrices of shape
+        (number of subjects, number of regions, number of regions) as values, as
+        computed by nilearn.connectome.ConnectivityMeasure.
+
+    Notes
+    -----
+    The covariance is estimated once, the precision is its inverse, computed
+    once, and the partial correlation the rescaled precision. Like nilearn, the
+    correlation is estimated on the standardized time series: for the
+    EmpiricalCovariance, ShrunkCovariance, LedoitWolf and OAS estimators, it is
+    derived from the same empirical covariance, rescaled by the time series
+    standard deviations, so that the time series are multiplied only once.
+    Other estimators are fitted once on the time series, and once on the
+    standardized time series if the correlation is requested.
+    """
+    allowed_kinds = ['correlation', 'partial correlation', 'covariance', 'precision']
+    for kind in kinds:
+        if kind not in allowed_kinds:
+            raise ValueError('Allowed connectivity kinds are correlation, partial correlation, '
+                             'covariance and precision, got kind {}.'.format(kind))
+
+    estimator_type = type(covariance_estimator)
+    closed_form_estimator = estimator_type in [EmpiricalCovariance, ShrunkCovariance, LedoitWolf, OAS] and \
+        not covariance_estimator.assume_centered
+
+    connectivity_kinds = dict()
+    covariances = None
+    if set(kinds).difference(['correlation']) or (closed_form_estimator and 'correlation' in kinds):
+        if closed_form_estimator:
+            empirical_covariances, centered_time_series = batch_empirical_covariance(
+                stacked_time_series=stacked_time_series)
+            covariances = closed_form_covariance(empirical_covariances=empirical_covariances,
+                                                 centered_time_series=centered_time_series,
+                                                 covariance_estimator=covariance_estimator)
+        else:
+            covariances = batch_covariance(stacked_time_series=stacked_time_series,
+                                           covariance_estimator=covariance_estimator)
+
+    if 'correlation' in kinds:
+        if closed_form_estimator:
+            # The empirical covariance of the standardized time series is the
+            # rescaled empirical covariance
+            if stacked_time_series.shape[1] == 1:
+                time_series_std = np.ones(empirical_covariances.shape[:2])
+            else:
+                time_series_std = np.sqrt(np.diagonal(empirical_covariances, axis1=1, axis2=2))
+                time_series_std[time_series_std < np.finfo(np.float64).eps] = 1.0
+            standardized_covariances = empirical_covariances / time_series_std[:, :, np.newaxis] \
+                / time_series_std[:, np.newaxis, :]
+            if estimator_type is LedoitWolf:
+                standardized_time_series = centered_time_series / time_series_std[:, np.newaxis, :]
+            else:
+                standardized_time_series = centered_time_series
+            correlation_covariances = closed_form_covariance(empirical_covariances=standardized_covariances,
+                                                             centered_time_series=standardized_time_series,
+                                                             covariance_estimator=covariance_estimator)
+        else:
+            correlation_covariances = batch_covariance(
+                stacked_time_series=standardize_time_series(stacked_time_series),
+                covariance_estimator=covariance_estimator)
+        connectivity_kinds['correlation'] = covariance_to_correlation(correlation_covariances)
+
+    if 'covariance' in kinds:
+        connectivity_kinds['covariance'] = covariances
+    if 'precision' in kinds or 'partial correlation' in kinds:
+        precisions = np.linalg.inv(covariances)
+        if 'precision' in kinds:
+            connectivity_kinds['precision'] = precisions
+        if 'partial correlation' in kinds:
+            connectivity_kinds['partial correlation'] = precision_to_partial_correlation(precisions)
+
+    return connectivity_kinds
+
+
+def batch_connectivity(stacked_time_series, kind, covariance_estimator):
+    """Compute one connectivity kind for stacked subjects.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+    kind: str
+        The connectivity kind. Choices are 'correlation', 'partial correlation',
+        'covariance', 'precision'.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The connectivity matrices, as computed by nilearn.connectome.ConnectivityMeasure.
+    """
+    return batch_connectivity_kinds(stacked_time_series=stacked_time_series, kinds=[kind],
+                                    covariance_estimator=covariance_estimator)[kind]
+
+
+def subjects_connectivity_kinds(time_series, kinds, covariance_estimator):
+    """Compute several connectivity kinds for a list of subjects.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    kinds: list
+        The connectivity kinds, see batch_connectivity_kinds.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator.
+
+    Returns
+    -------
+    output: dict
+        The connectivity kinds as keys, and the lists of connectivity
+        matrices of shape (number of regions, number of regions), in
+        the order of `time_series`, as values.
+
+    Notes
+    -----
+    The subjects with the same time series shape are computed together,
+    see stack_time_series, and the covariance of each subject is estimated
+    once for all the kinds.
+    """
+    connectivity_kinds = {kind: [None] * len(time_series) for kind in kinds}
+    for subjects_positions, stacked_time_series in stack_time_series(time_series):
+        batch_kinds = batch_connectivity_kinds(stacked_time_series=stacked_time_series, kinds=kinds,
+                                               covariance_estimator=covariance_estimator)
+        for kind in kinds:
+            for position, subject_matrix in zip(subjects_positions, batch_kinds[kind]):
+                connectivity_kinds[kind][position] = subject_matrix
+
+    return connectivity_kinds
+
+
+def subjects_connectivity_matrices(time_series, kind, covariance_estimator):
+    """Compute one connectivity kind for a list of subjects.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    kind: str
+        The connectivity kind, see batch_connectivity.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator.
+
+    Returns
+    -------
+    output: list
+        The connectivity matrices of shape (number of regions, number
+        of regions), in the order of `time_series`.
+    """
+    return subjects_connectivity_kinds(time_series=time_series, kinds=[kind],
+                                       covariance_estimator=covariance_estimator)[kind]
+
+
+# The slow-5 and slow-4 frequency bands of the resting state, in Hz
+COHERENCE_BANDS = {'slow-5': (0.01, 0.027), 'slow-4': (0.027, 0.073)}
+
+
+def coherence_kinds(coherence_bands=None):
+    """Name the coherence kinds of frequency bands.
+
+    Parameters
+    ----------
+    coherence_bands: dict, optional
+        The bands names as keys, and the (lowest, highest) frequencies in Hz
+        as values. Default is None, the COHERENCE_BANDS.
+
+    Returns
+    -------
+    output: list
+        The kinds, 'coherence' followed by the band name.
+    """
+    if coherence_bands is None:
+        coherence_bands = COHERENCE_BANDS
+
+    return ['coherence ' + band for band in coherence_bands.keys()]
+
+
+def batch_coherence(stacked_time_series, repetition_time, coherence_bands=None, nperseg=None, noverlap=None,
+                    window='hann'):
+    """Compute the band averaged coherence of each subject.
+
+    Parameters
+    ----------
+    stacked_time_series: numpy.array, shape (number of subjects, number of time points, number of regions)
+        The stacked time series.
+    repetition_time: float
+        The sampling interval of the time series, in seconds.
+    coherence_bands: dict, optional
+        The bands names as keys, and the (lowest, highest) frequencies in Hz
+        as values. Default is None, the slow-5 and slow-4 bands.
+    nperseg: int, optional
+        The number of time points of a Welch segment. Default is None, a quarter
+        of the number of time points.
+    noverlap: int, optional
+        The number of time points shared by two consecutive segments. Default is
+        None, half of a segment.
+    window: str or tuple, optional
+        The window of the segments, see scipy.signal.get_window. Default is 'hann'.
+
+    Returns
+    -------
+    output: dict
+        The coherence kinds as keys, see coherence_kinds, and the magnitude squared
+        coherences of shape (number of subjects, number of regions, number of regions)
+        as values.
+
+    Notes
+    -----
+    The segments of all the subjects and regions are detrended, windowed and
+    transformed with one batched FFT. In each band, the cross-spectral densities
+    of all the pairs of regions are averaged over the frequencies of the band and
+    the segments with one batched product, like the average of the one-sided
+    densities of scipy.signal.csd, and the coherence is the squared magnitude of
+    the averaged cross-spectral density, normalized by the averaged power spectral
+    densities of the two regions.
+    """
+    if coherence_bands is None:
+        coherence_bands = COHERENCE_BANDS
+    n_subjects, n_time_points, n_regions = stacked_time_series.shape
+    if nperseg is None:
+        nperseg = max(n_time_points // 4, 1)
+    nperseg = min(nperseg, n_time_points)
+    if noverlap is None:
+        noverlap = nperseg // 2
+    if not 0 <= noverlap < nperseg:
+        raise ValueError('The overlap of the segments must be smaller than the segment length {}, '
+                         'got {}.'.format(nperseg, noverlap))
+
+    # Segments of shape (number of subjects, number of segments, number of regions, nperseg)
+    segments = np.lib.stride_tricks.sliding_window_view(stacked_time_series, nperseg, axis=1)[
+        :, ::nperseg - noverlap]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    spectra = np.fft.rfft(segments * get_window(window, nperseg), axis=-1)
+    frequencies = np.fft.rfftfreq(nperseg, d=repetition_time)
+    # The one-sided densities double the frequencies with a negative counterpart
+    one_sided_weights = np.full(len(frequencies), 2.0)
+    one_sided_weights[0] = 1.0
+    if nperseg % 2 == 0:
+        one_sided_weights[-1] = 1.0
+
+    connectivity_kinds = dict()
+    regions_index = np.arange(n_regions)
+    for kind, (lowest_frequency, highest_frequency) in zip(coherence_kinds(coherence_bands),
+                                                           coherence_bands.values()):
+        band = (frequencies >= lowest_frequency) & (frequencies <= highest_frequency)
+        if not band.any():
+            raise ValueError('No frequency of the segments falls in the band {} of [{}, {}] Hz, the '
+                             'frequency resolution is {} Hz.'.format(kind, lowest_frequency, highest_frequency,
+                                                                     frequencies[1] if nperseg > 1 else 0.0))
+        band_spectra = spectra[..., band] * np.sqrt(one_sided_weights[band])
+        band_spectra = band_spectra.transpose(0, 2, 1, 3).reshape(n_subjects, n_regions, -1)
+        cross_spectral_densities = np.matmul(band_spectra.conj(), band_spectra.transpose(0, 2, 1))
+        power_spectral_densities = cross_spectral_densities.real[:, regions_index, regions_index]
+        coherences = np.abs(cross_spectral_densities) ** 2 / power_spectral_densities[:, :, np.newaxis] \
+            / power_spectral_densities[:, np.newaxis, :]
+        coherences[:, regions_index, regions_index] = 1.0
+        connectivity_kinds[kind] = coherences
+
+    return connectivity_kinds
+
+
+def subjects_coherence(time_series, repetition_time, coherence_bands=None, **kwargs):
+    """Compute the band averaged coherence for a list of subjects.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    repetition_time: float
+        The sampling interval of the time series, in seconds.
+    coherence_bands: dict, optional
+        The frequency bands, see batch_coherence. Default is None.
+    **kwargs:
+        The Welch segments parameters of batch_coherence.
+
+    Returns
+    -------
+    output: dict
+        The coherence kinds as keys, see coherence_kinds, and the lists of
+        coherence matrices of shape (number of regions, number of regions),
+        in the order of `time_series`, as values.
+    """
+    connectivity_kinds = {kind: [None] * len(time_series) for kind in coherence_kinds(coherence_bands)}
+    for subjects_positions, stacked_time_series in stack_time_series(time_series):
+        batch_kinds = batch_coherence(stacked_time_series=stacked_time_series, repetition_time=repetition_time,
+                                      coherence_bands=coherence_bands, **kwargs)
+        for kind, kind_matrices in batch_kinds.items():
+            for position, subject_matrix in zip(subjects_positions, kind_matrices):
+                connectivity_kinds[kind][position] = subject_matrix
+
+    return connectivity_kinds
+
+
+def window_onsets(n_time_points, window_length, step=1):
+    """Compute the first time point of each sliding window.
+
+    Parameters
+    ----------
+    n_time_points: int
+        The number of time points.
+    window_length: int
+        The number of time points in a window.
+    step: int, optional
+        The number of time points between two consecutive windows.
+        Default is 1.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of windows, )
+        The onsets of the windows fitting in the time series.
+    """
+    if window_length < 1 or window_length > n_time_points:
+        raise ValueError('The window length must be between 1 and the number of time points {}, '
+                         'got {}.'.format(n_time_points, window_length))
+    if step < 1:
+        raise ValueError('The step between two windows must be a positive integer, got {}.'.format(step))
+
+    return np.arange(0, n_time_points - window_length + 1, step)
+
+
+def window_taper(taper, window_length):
+    """Compute the normalized weights of the time points in a window.
+
+    Parameters
+    ----------
+    taper: str, tuple or numpy.array
+        A window accepted by scipy.signal.get_window, like 'hamming' or
+        ('gaussian', 10), or the weights of the time points, of shape
+        (window length, ).
+    window_length: int
+        The number of time points in a window.
+
+    Returns
+    -------
+    output: numpy.array, shape (window length, )
+        The non negative weights of the time points, summing to one.
+    """
+    if isinstance(taper, (str, tuple)):
+        weights = get_window(taper, window_length, fftbins=False)
+    else:
+        weights = np.asarray(taper, dtype=np.float64)
+    if weights.shape != (window_length, ):
+        raise ValueError('The taper should have one weight per time point of the window, '
+                         'got shape {} for a window length of {}.'.format(weights.shape, window_length))
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError('The taper weights should be non negative, with a positive sum.')
+
+    return weights / weights.sum()
+
+
+def rolling_window_covariances(time_series, window_length, step=1, taper=None, block_size=64):
+    """Compute the empirical covariance in sliding windows of a time series.
+
+    Parameters
+    ----------
+    time_series: numpy.array, shape (number of time points, number of regions)
+        The time series of one subject.
+    window_length: int
+        The number of time points in a window.
+    step: int, optional
+        The number of time points between two consecutive windows.
+        Default is 1.
+    taper: str, tuple or numpy.array, optional
+        The weights of the time points in a window, see window_taper.
+        Default is None, the time points are equally weighted.
+    block_size: int, optional
+        The number of windows computed at once. Default is 64.
+
+    Yields
+    ------
+    output 1: numpy.array, shape (number of windows in block, )
+        The onsets of the windows of the block.
+    output 2: numpy.array, shape (number of windows in block, number of regions, number of regions)
+        The empirical covariances of the windows of the block, centered
+        on the window (weighted) mean.
+
+    Notes
+    -----
+    Without a taper, the sums of the time points, and of their outer products,
+    are updated from one window to the next with a rank-`step` addition of the
+    entering time points, and a rank-`step` subtraction of the leaving time
+    points, instead of a full window product, and the outer product of the
+    window mean with a rank-2 update. The updates of a block are computed with
+    one batched product, and accumulated.
+    The sums are computed from scratch at the beginning of each block, which
+    bounds the accumulation of rounding errors, and for all the windows when
+    the step is larger than half the window length, since the update is then
+    more expensive than the product. The time series are centered once
+    beforehand, to limit the cancellation in the covariances.
+    The weights of a tapered window change with the position of a time point
+    in the window, so that the tapered covariances can not be updated: they
+    are computed with one batched product per block.
+    """
+    time_series = np.asarray(time_series, dtype=np.float64)
+    n_time_points, n_regions = time_series.shape
+    onsets = window_onsets(n_time_points=n_time_points, window_length=window_length, step=step)
+    centered_time_series = time_series - time_series.mean(axis=0)
+
+    if taper is not None or 2 * step >= window_length:
+        if taper is None:
+            weights = np.full(window_length, 1.0 / window_length)
+        else:
+            weights = window_taper(taper=taper, window_length=window_length)
+        # Views of shape (number of windows, number of regions, window length), no copy
+        windows = np.lib.stride_tricks.sliding_window_view(centered_time_series, window_length, axis=0)
+        for block_start in range(0, len(onsets), block_size):
+            block_onsets = onsets[block_start:block_start + block_size]
+            block_windows = windows[block_onsets]
+            windows_means = np.matmul(block_windows, weights)
+            covariances = np.matmul(block_windows * weights, block_windows.transpose(0, 2, 1))
+            covariances -= windows_means[:, :, np.newaxis] * windows_means[:, np.newaxis, :]
+            yield block_onsets, covariances
+        return
+
+    for block_start in range(0, len(onsets), block_size):
+        block_onsets = onsets[block_start:block_start + block_size]
+        first_onset, last_onset = block_onsets[0], block_onsets[-1]
+        first_window = centered_time_series[first_onset:first_onset + window_length]
+        # The time points entering and leaving each following window of the block
+        # are consecutive, shape (number of windows in block - 1, step, number of regions)
+        entering = centered_time_series[first_onset + window_length:last_onset + window_length].reshape(
+            -1, step, n_regions)
+        leaving = centered_time_series[first_onset:last_onset].reshape(-1, step, n_regions)
+        windows_means = np.cumsum(np.concatenate([first_window.sum(axis=0, keepdims=True),
+                                                  entering.sum(axis=1) - leaving.sum(axis=1)]), axis=0)
+        windows_means /= window_length
+        # The covariance of a window differs from the covariance of the previous
+        # window by the rank-`step` updates of the outer products sums, and the
+        # rank-2 update of the outer product of the mean: all the differences
+        # of the block are computed with one batched product, and accumulated
+        covariances = np.empty((len(block_onsets), n_regions, n_regions))
+        np.matmul(first_window.T / window_length, first_window, out=covariances[0])
+        covariances[0] -= np.outer(windows_means[0], windows_means[0])
+        left_factors = np.concatenate([entering / window_length, leaving / window_length,
+                                       windows_means[1:, np.newaxis], windows_means[:-1, np.newaxis]], axis=1)
+        right_factors = np.concatenate([entering, -leaving, -windows_means[1:, np.newaxis],
+                                        windows_means[:-1, np.newaxis]], axis=1)
+        np.matmul(left_factors.transpose(0, 2, 1), right_factors, out=covariances[1:])
+        for window in range(1, len(block_onsets)):
+            covariances[window] += covariances[window - 1]
+        yield block_onsets, covariances
+
+
+def empirical_connectivity_kinds(empirical_covariances, kinds, covariance_estimator, n_time_points):
+    """Derive several connectivity kinds from empirical covariances.
+
+    Parameters
+    ----------
+    empirical_covariances: numpy.array, shape (number of matrices, number of regions, number of regions)
+        The empirical covariances.
+    kinds: list
+        The connectivity kinds, see batch_connectivity_kinds.
+    covariance_estimator: EmpiricalCovariance, ShrunkCovariance or OAS
+        The covariance estimator.
+    n_time_points: int
+        The number of time points of the empirical covariances, used by the
+        OAS shrinkage.
+
+    Returns
+    -------
+    output: dict
+        The connectivity kinds as keys, and the connectivity matrices of shape
+        (number of matrices, number of regions, number of regions) as values,
+        derived like batch_connectivity_kinds.
+    """
+    estimator_type = type(covariance_estimator)
+
+    def shrunk(covariances):
+        if estimator_type is EmpiricalCovariance:
+            return covariances
+        if estimator_type is ShrunkCovariance:
+            shrinkages = np.full(len(covariances), covariance_estimator.shrinkage)
+        else:
+            shrinkages = oas_shrinkages(empirical_covariances=covariances, n_time_points=n_time_points)
+        return shrink_covariances(empirical_covariances=covariances, shrinkages=shrinkages)
+
+    connectivity_kinds = dict()
+    if 'correlation' in kinds and estimator_type is EmpiricalCovariance:
+        # The standardization is a rescaling, undone by the correlation
+        connectivity_kinds['correlation'] = covariance_to_correlation(empirical_covariances)
+    elif 'correlation' in kinds:
+        if n_time_points == 1:
+            time_series_std = np.ones(empirical_covariances.shape[:2])
+        else:
+            time_series_std = np.sqrt(np.diagonal(empirical_covariances, axis1=1, axis2=2))
+            time_series_std[time_series_std < np.finfo(np.float64).eps] = 1.0
+        standardized_covariances = empirical_covariances / time_series_std[:, :, np.newaxis] \
+            / time_series_std[:, np.newaxis, :]
+        connectivity_kinds['correlation'] = covariance_to_correlation(shrunk(standardized_covariances))
+    if set(kinds).difference(['correlation']):
+        covariances = shrunk(empirical_covariances)
+        if 'covariance' in kinds:
+            connectivity_kinds['covariance'] = covariances
+        if 'precision' in kinds or 'partial correlation' in kinds:
+            precisions = np.linalg.inv(covariances)
+            if 'precision' in kinds:
+                connectivity_kinds['precision'] = precisions
+            if 'partial correlation' in kinds:
+                connectivity_kinds['partial correlation'] = precision_to_partial_correlation(precisions)
+
+    return connectivity_kinds
+
+
+def sliding_window_connectivity_kinds(time_series, kinds, covariance_estimator, window_length, step=1,
+                                      taper=None, block_size=64):
+    """Compute several connectivity kinds in sliding windows of a time series.
+
+    Parameters
+    ----------
+    time_series: numpy.array, shape (number of time points, number of regions)
+        The time series of one subject.
+    kinds: list
+        The connectivity kinds, see batch_connectivity_kinds.
+    covariance_estimator: estimator object
+        A scikit-learn covariance estimator.
+    window_length: int
+        The number of time points in a window.
+    step: int, optional
+        The number of time points between two consecutive windows.
+        Default is 1.
+    taper: str, tuple or numpy.array, optional
+        The weights of the time points in a window, see window_taper.
+        Default is None.
+    block_size: int, optional
+        The number of windows computed at once. Default is 64.
+
+    Yields
+    ------
+    output 1: numpy.array, shape (number of windows in block, )
+        The onsets of the windows of the block.
+    output 2: dict
+        The connectivity kinds as keys, and the connectivity matrices of the
+        windows of the block, of shape (number of windows in block, number of
+        regions, number of regions) as values.
+
+    Notes
+    -----
+    For the EmpiricalCovariance, ShrunkCovariance and OAS estimators, the
+    kinds are derived from the rolling empirical covariances, see
+    rolling_window_covariances. The windows of the other estimators are
+    stacked like subjects, and computed with batch_connectivity_kinds, which
+    does not support a taper.
+    """
+    allowed_kinds = ['correlation', 'partial correlation', 'covariance', 'precision']
+    for kind in kinds:
+        if kind not in allowed_kinds:
+            raise ValueError('Allowed connectivity kinds are correlation, partial correlation, '
+                             'covariance and precision, got kind {}.'.format(kind))
+
+    if type(covariance_estimator) in [EmpiricalCovariance, ShrunkCovariance, OAS] and \
+            not covariance_estimator.assume_centered:
+        for block_onsets, empirical_covariances in rolling_window_covariances(
+                time_series=time_series, window_length=window_length, step=step, taper=taper,
+                block_size=block_size):
+            yield block_onsets, empirical_connectivity_kinds(empirical_covariances=empirical_covariances,
+                                                             kinds=kinds,
+                                                             covariance_estimator=covariance_estimator,
+                                                             n_time_points=window_length)
+        return
+
+    if taper is not None:
+        raise ValueError('A taper is only supported for the EmpiricalCovariance, ShrunkCovariance '
+                         'and OAS estimators, got {}.'.format(type(covariance_estimator).__name__))
+    time_series = np.asarray(time_series, dtype=np.float64)
+    onsets = window_onsets(n_time_points=time_series.shape[0], window_length=window_length, step=step)
+    windows = np.lib.stride_tricks.sliding_window_view(time_series, window_length, axis=0)
+    for block_start in range(0, len(onsets), block_size):
+        block_onsets = onsets[block_start:block_start + block_size]
+        yield block_onsets, batch_connectivity_kinds(stacked_time_series=windows[block_onsets].transpose(0, 2, 1),
+                                                     kinds=kinds, covariance_estimator=covariance_estimator)
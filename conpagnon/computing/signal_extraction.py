@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Region signals extraction engines.
+
+The regions signals of a map based atlas are the least-squares projection
+of each volume onto the atlas maps. As most of the atlas voxels are zero,
+the maps are stored as a sparse voxels x regions matrix of their support,
+read one map at a time, and the least-squares problem is solved with the
+small regions x regions Gram matrix of the maps, whose pseudo-inverse is
+computed once for each atlas grid. The functional images are streamed
+from the disk in blocks of volumes, so that the memory needed does not
+grow with the run length. The extracted signals are then cleaned with
+nilearn.signal.clean on the whole run, like nilearn.input_data.NiftiMapsMasker
+does.
+
+Deterministic labels atlases are handled the same way, with a sparse
+regions x voxels indicator operator giving the regions mean signals.
+
+As the cleaning only depends on the regions signals, several extraction
+variants, like denoising strategies or filtering bands, can be applied to
+the same raw regions signals, the functional image and the confounds file
+being read only once.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+import numpy as np
+import pandas as pd
+import nibabel as nb
+from scipy import linalg, sparse
+from nilearn import image, signal
+
+
+def maps_projection_operator(maps_img):
+    """Build the least-squares projection operator of a 4D atlas.
+
+    Parameters
+    ----------
+    maps_img: str or Nifti1Image
+        The 4D atlas, already on the grid of the functional images.
+
+    Returns
+    -------
+    output: dict
+        A dictionary with the following keys:
+            - 'atlas_type': 'maps'.
+            - 'support': the flat index of the voxels belonging to
+            at least one map.
+            - 'maps': the sparse CSC matrix of the maps restricted to
+            their support, of shape (number of voxels in the support,
+            number of regions).
+            - 'gram_pseudo_inverse': the pseudo-inverse of the Gram matrix
+            of the maps, of shape (number of regions, number of regions).
+            - 'shape', 'affine': the grid of the atlas.
+            - 'dtype': the atlas data type.
+
+    Notes
+    -----
+    Voxels outside every map do not contribute to the least-squares
+    problem, so the projection restricted to the maps support is the same
+    as the least-squares projection on the whole volume. The maps are read
+    one at a time from the image, so that the 4D atlas is never copied as a
+    dense array, and only their non zero values are kept. The pseudo-inverse
+    of the maps is the pseudo-inverse of their Gram matrix times the transposed
+    maps, computed once from the eigendecomposition of the Gram matrix.
+    Eigenvalues below the numpy.linalg.pinv cutoff are discarded, so that
+    empty or linearly dependent maps get the minimum norm least-squares
+    solution. The Gram matrix squares the condition number of the maps, which
+    stays far from the float64 precision for overlapping probabilistic maps.
+    """
+    maps_img = image.load_img(maps_img)
+    maps_dtype = maps_img.get_data_dtype()
+    n_regions = maps_img.shape[3]
+
+    # The non zero values of each map, read one map at a time, non finite values are set to zero
+    maps_rows, maps_values, maps_columns_sizes = [], [], []
+    for region in range(n_regions):
+        region_map = np.asarray(maps_img.dataobj[..., region], dtype=np.float64).ravel()
+        region_voxels = np.flatnonzero(np.isfinite(region_map) & (region_map != 0))
+        maps_rows.append(region_voxels)
+        maps_values.append(region_map[region_voxels])
+        maps_columns_sizes.append(region_voxels.size)
+    maps_rows = np.concatenate(maps_rows)
+    support, support_rows = np.unique(maps_rows, return_inverse=True)
+    maps_indptr = np.concatenate([[0], np.cumsum(maps_columns_sizes)])
+    support_maps = sparse.csc_matrix((np.concatenate(maps_values), support_rows, maps_indptr),
+                                     shape=(support.size, n_regions))
+
+    # Pseudo-inverse of the Gram matrix of the maps
+    gram = (support_maps.T @ support_maps).toarray()
+    eigenvalues, eigenvectors = linalg.eigh(gram)
+    cutoff = np.finfo(np.float64).eps * max(support_maps.shape) * max(eigenvalues.max(initial=0.), 0.)
+    kept = eigenvalues > cutoff
+    gram_pseudo_inverse = (eigenvectors[:, kept] / eigenvalues[kept]) @ eigenvectors[:, kept].T
+
+    return {'atlas_type': 'maps', 'support': support, 'maps': support_maps,
+            'gram_pseudo_inverse': gram_pseudo_inverse,
+            'shape': maps_img.shape[:3], 'affine': maps_img.affine,
+            'dtype': maps_dtype}
+
+
+def project_volumes(projection_operator, voxels_signals):
+    """Project a block of volumes onto the atlas maps.
+
+    Parameters
+    ----------
+    projection_operator: dict
+        The projection operator computed by maps_projection_operator.
+    voxels_signals: numpy.array, shape (number of voxels in the support, number of time points)
+        The signals of the voxels in the maps support.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The regions signals, the least-squares solution of minimum norm.
+    """
+    voxels_signals = np.array(voxels_signals, dtype=np.float64)
+    voxels_signals[np.logical_not(np.isfinite(voxels_signals))] = 0
+
+    # The transposed sparse maps reduce the block to the regions, before the Gram pseudo-inverse
+    maps_products = projection_operator['maps'].T @ voxels_signals
+    regions_signals = (projection_operator['gram_pseudo_inverse'] @ maps_products).T
+
+    return regions_signals
+
+
+def load_functional_image(img):
+    """Load a 4D functional image without reading its data.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The full path to the functional image, or the image itself.
+
+    Returns
+    -------
+    output: Nifti1Image
+        The image, whose data are only accessed through its array proxy:
+        uncompressed files are memory mapped, and slicing the proxy along
+        the time axis reads only the corresponding volumes.
+    """
+    if isinstance(img, str):
+        return nb.load(img, mmap=True)
+
+    return image.load_img(img)
+
+
+def time_blocks(n_time_points, time_block_size):
+    """Generate the consecutive time blocks of a run.
+
+    Parameters
+    ----------
+    n_time_points: int
+        The number of volumes in the run.
+    time_block_size: int
+        The maximum number of volumes in a block.
+
+    Returns
+    -------
+    output: generator
+        The slices of the volumes of each block.
+    """
+    for block_start in range(0, n_time_points, time_block_size):
+        yield slice(block_start, min(block_start + time_block_size, n_time_points))
+
+
+def stream_volumes(img, extraction_operator, time_block_size=100):
+    """Read a 4D functional image, one block of volumes at a time.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The 4D functional image, on the grid of the extraction operator.
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    time_block_size: int, optional
+        The number of volumes read at once. Default is 100.
+
+    Returns
+    -------
+    output: generator
+        For each block, the slice of the block volumes, and the block
+        data of shape (x, y, z, number of volumes in the block), in the
+        data type of the image.
+
+    Notes
+    -----
+    The peak memory depends on the time block size and the volume size, not
+    on the number of volumes in the run. Uncompressed NIfTI files are memory
+    mapped, compressed files are decompressed block by block.
+    """
+    img = load_functional_image(img)
+    if len(img.shape) != 4:
+        raise ValueError('A 4D functional image is expected, got an image '
+                         'of shape {}.'.format(img.shape))
+    if img.shape[:3] != tuple(extraction_operator['shape']) or \
+            not np.allclose(img.affine, extraction_operator['affine']):
+        raise ValueError('The functional image and the atlas are not on the same grid, '
+                         'the atlas should be resampled to the functional image first.')
+
+    for block in time_blocks(n_time_points=img.shape[3], time_block_size=time_block_size):
+        # Only the volumes of the block are read from the disk
+        yield block, np.asanyarray(img.dataobj[..., block])
+
+
+def block_support_signals(block_data, extraction_operator, smoothing_fwhm=None):
+    """Fetch the signals of the atlas support voxels in a block of volumes.
+
+    Parameters
+    ----------
+    block_data: numpy.array, shape (x, y, z, number of volumes in the block)
+        The block of volumes.
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    smoothing_fwhm: float or None, optional
+        The full-width half maximum in millimeters of a Gaussian
+        spatial smoothing applied to each volume. Default is None,
+        no smoothing.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of voxels in the support, number of volumes in the block)
+        The support voxels signals.
+    """
+    if smoothing_fwhm is not None:
+        # The smoothing is spatial, each volume is smoothed on its own
+        block_data = np.asanyarray(image.smooth_img(nb.Nifti1Image(block_data, extraction_operator['affine']),
+                                                    smoothing_fwhm).dataobj)
+
+    return block_data.reshape(-1, block_data.shape[3])[extraction_operator['support'], :]
+
+
+def stream_support_signals(img, extraction_operator, time_block_size=100, smoothing_fwhm=None):
+    """Read the signals of the atlas support voxels, one block of volumes at a time.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The 4D functional image, on the grid of the extraction operator.
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    time_block_size: int, optional
+        The number of volumes read at once. Default is 100.
+    smoothing_fwhm: float or None, optional
+        The full-width half maximum in millimeters of a Gaussian
+        spatial smoothing applied to each volume. Default is None,
+        no smoothing.
+
+    Returns
+    -------
+    output: generator
+        For each block, the slice of the block volumes, and the signals
+        of the support voxels of shape (number of voxels in the support,
+        number of volumes in the block), in the data type of the image.
+
+    See Also
+    --------
+    stream_volumes : The block reader.
+    """
+    for block, block_data in stream_volumes(img=img, extraction_operator=extraction_operator,
+                                            time_block_size=time_block_size):
+        yield block, block_support_signals(block_data=block_data, extraction_operator=extraction_operator,
+                                           smoothing_fwhm=smoothing_fwhm)
+
+
+def block_regions_signals(extraction_operator, support_signals):
+    """Compute the raw regions signals of a block of volumes.
+
+    Parameters
+    ----------
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    support_signals: numpy.array, shape (number of voxels in the support, number of volumes in the block)
+        The support voxels signals.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of volumes in the block, number of regions)
+        The least-squares projection on the maps for a maps atlas, and the
+        regions means, null for empty regions, for a labels atlas.
+    """
+    if extraction_operator['atlas_type'] != 'labels':
+        return project_volumes(projection_operator=extraction_operator, voxels_signals=support_signals)
+
+    support_signals = np.array(support_signals, dtype=np.float64)
+    support_signals[np.logical_not(np.isfinite(support_signals))] = 0
+    # Sum of the voxels signals in each region, for all the volumes of the block
+    regions_signals = (extraction_operator['indicator'] @ support_signals).T
+    non_empty_labels = np.logical_not(extraction_operator['empty_labels'])
+    regions_signals[:, non_empty_labels] /= extraction_operator['voxels_count'][non_empty_labels]
+
+    return regions_signals
+
+
+def regions_signals_dtype(extraction_operator, data_dtype):
+    """The data type nilearn maskers give to the regions signals.
+
+    Parameters
+    ----------
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    data_dtype: numpy.dtype
+        The data type of the functional image, after smoothing.
+
+    Returns
+    -------
+    output: numpy.dtype
+        The regions signals data type.
+    """
+    if extraction_operator['atlas_type'] == 'labels':
+        # nilearn.input_data.NiftiLabelsMasker keep single precision only
+        return np.dtype(np.float32 if data_dtype == np.float32 else np.float64)
+
+    # nilearn least-squares solution keep the input floating point type
+    signals_dtype = np.result_type(extraction_operator['dtype'], data_dtype)
+    if signals_dtype.kind != 'f':
+        signals_dtype = np.dtype(np.float64)
+
+    return signals_dtype
+
+
+def smoothed_raw_signals(img, extraction_operator, smoothings_fwhm, time_block_size=100):
+    """Extract the raw regions signals for several spatial smoothing, reading the image once.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The 4D functional image, on the grid of the extraction operator.
+    extraction_operator: dict
+        A projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    smoothings_fwhm: list
+        The full-width half maximum in millimeters of the Gaussian spatial
+        smoothing, None for no smoothing.
+    time_block_size: int, optional
+        The number of volumes read at once. Default is 100.
+
+    Returns
+    -------
+    output: dict
+        The raw regions signals, of shape (number of time points, number of
+        regions), with the smoothing full-width half maximum as keys.
+    """
+    smoothings_fwhm = list(dict.fromkeys(smoothings_fwhm))
+    blocks_signals = {smoothing_fwhm: [] for smoothing_fwhm in smoothings_fwhm}
+    data_dtypes = dict()
+    for block, block_data in stream_volumes(img=img, extraction_operator=extraction_operator,
+                                            time_block_size=time_block_size):
+        # Each block is read once, and smoothed for each smoothing
+        for smoothing_fwhm in smoothings_fwhm:
+            support_signals = block_support_signals(block_data=block_data, extraction_operator=extraction_operator,
+                                                    smoothing_fwhm=smoothing_fwhm)
+            data_dtypes[smoothing_fwhm] = support_signals.dtype
+            blocks_signals[smoothing_fwhm].append(block_regions_signals(extraction_operator=extraction_operator,
+                                                                        support_signals=support_signals))
+
+    return {smoothing_fwhm: np.vstack(blocks_signals[smoothing_fwhm]).astype(
+        regions_signals_dtype(extraction_operator=extraction_operator, data_dtype=data_dtypes[smoothing_fwhm]),
+        copy=False)
+        for smoothing_fwhm in smoothings_fwhm}
+
+
+def raw_regions_signals(img, projection_operator, time_block_size=100, smoothing_fwhm=None):
+    """Extract the un-cleaned regions signals of a 4D functional image.
+
+    The image is streamed: only one block of volumes is read, and
+    optionally smoothed, at a time, see stream_volumes.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The 4D functional image, on the grid of the projection operator.
+    projection_operator: dict
+        The projection operator of the atlas, see maps_projection_operator.
+    time_block_size: int, optional
+        The number of volumes projected at once. Default is 100.
+    smoothing_fwhm: float or None, optional
+        The full-width half maximum in millimeters of a Gaussian
+        spatial smoothing applied to each volume before the projection.
+        Default is None, no smoothing.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The regions signals, in the data type nilearn would have returned.
+    """
+    return smoothed_raw_signals(img=img, extraction_operator=projection_operator,
+                                smoothings_fwhm=[smoothing_fwhm],
+                                time_block_size=time_block_size)[smoothing_fwhm]
+
+
+def atlas_labels(labels_img, background_label=0):
+    """Fetch the sorted labels of a deterministic atlas.
+
+    Parameters
+    ----------
+    labels_img: str or Nifti1Image
+        The 3D labels atlas.
+    background_label: int or float, optional
+        The label of the voxels outside of every region. Default is 0.
+
+    Returns
+    -------
+    output: numpy.array
+        The sorted labels found in the atlas, background excluded.
+    """
+    labels_data = np.asanyarray(image.load_img(labels_img).dataobj)
+    labels = np.unique(labels_data)
+
+    return labels[labels != background_label]
+
+
+def labels_indicator_operator(labels_img, labels=None, background_label=0):
+    """Build the sparse averaging operator of a 3D deterministic atlas.
+
+    Parameters
+    ----------
+    labels_img: str or Nifti1Image
+        The 3D labels atlas, already on the grid of the functional images.
+    labels: numpy.array, optional
+        The labels of the regions, in the order of the extracted signals.
+        Labels without any voxel on this grid give a null signal. If None,
+        the labels found in the atlas are used, see atlas_labels.
+    background_label: int or float, optional
+        The label of the voxels outside of every region. Default is 0.
+
+    Returns
+    -------
+    output: dict
+        A dictionary with the following keys:
+            - 'atlas_type': 'labels'.
+            - 'support': the flat index of the voxels belonging to
+            one of the regions.
+            - 'indicator': the sparse matrix of shape (number of regions,
+            number of voxels in the support), one where the voxel belong
+            to the region, zero elsewhere.
+            - 'labels': the labels of the regions.
+            - 'voxels_count': the number of voxels of each region.
+            - 'empty_labels': the boolean array flagging the regions
+            without any voxel, after resampling for example.
+            - 'shape', 'affine': the grid of the atlas.
+    """
+    labels_img = image.load_img(labels_img)
+    labels_data = np.asanyarray(labels_img.dataobj)
+    if labels_data.ndim == 4 and labels_data.shape[3] == 1:
+        labels_data = labels_data[..., 0]
+    if labels_data.ndim != 3:
+        raise ValueError('A 3D labels atlas is expected, got an image '
+                         'of shape {}.'.format(labels_data.shape))
+    if labels is None:
+        labels = atlas_labels(labels_img=labels_img, background_label=background_label)
+    labels = np.asarray(labels)
+
+    # The label volume is flattened once, and each voxel is assigned to its region
+    flat_labels = labels_data.ravel()
+    support = np.flatnonzero(np.isin(flat_labels, labels))
+    labels_order = np.argsort(labels)
+    regions_index = labels_order[np.searchsorted(labels, flat_labels[support], sorter=labels_order)]
+    voxels_count = np.bincount(regions_index, minlength=labels.size)
+    indicator = sparse.csr_matrix((np.ones(support.size), (regions_index, np.arange(support.size))),
+                                  shape=(labels.size, support.size))
+
+    return {'atlas_type': 'labels', 'support': support, 'indicator': indicator,
+            'labels': labels, 'voxels_count': voxels_count,
+            'empty_labels': voxels_count == 0,
+            'shape': labels_img.shape[:3], 'affine': labels_img.affine}
+
+
+def raw_labels_signals(img, labels_operator, time_block_size=100, smoothing_fwhm=None):
+    """Extract the un-cleaned regions mean signals of a 4D functional image.
+
+    Parameters
+    ----------
+    img: str or Nifti1Image
+        The 4D functional image, on the grid of the labels operator.
+    labels_operator: dict
+        The labels operator of the atlas, see labels_indicator_operator.
+    time_block_size: int, optional
+        The number of volumes averaged at once. Default is 100.
+    smoothing_fwhm: float or None, optional
+        The full-width half maximum in millimeters of a Gaussian
+        spatial smoothing applied to each volume. Default is None,
+        no smoothing.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The mean signal of each region, null for empty regions, in the
+        data type nilearn.input_data.NiftiLabelsMasker would have returned.
+    """
+    return smoothed_raw_signals(img=img, extraction_operator=labels_operator,
+                                smoothings_fwhm=[smoothing_fwhm],
+                                time_block_size=time_block_size)[smoothing_fwhm]
+
+
+def clean_regions_signals(regions_signals, confounds, masker_parameters):
+    """Clean the regions signals, like nilearn.input_data.NiftiMapsMasker does.
+
+    Parameters
+    ----------
+    regions_signals: numpy.array, shape (number of time points, number of regions)
+        The raw regions signals.
+    confounds: str, numpy.array or None
+        The confounds to regress, passed to nilearn.signal.clean.
+    masker_parameters: dict
+        The masker parameters, see time_series_extraction.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The cleaned regions signals.
+    """
+    return signal.clean(regions_signals,
+                        detrend=masker_parameters['detrend'],
+                        standardize=masker_parameters['standardize'],
+                        standardize_confounds=True,
+                        t_r=masker_parameters['t_r'],
+                        low_pass=masker_parameters['low_pass'],
+                        high_pass=masker_parameters['high_pass'],
+                        confounds=confounds)
+
+
+def raw_masker_parameters(masker_parameters):
+    """Disable the cleaning steps of masker parameters.
+
+    Parameters
+    ----------
+    masker_parameters: dict
+        The masker parameters, see time_series_extraction.
+
+    Returns
+    -------
+    output: dict
+        A copy of the masker parameters, without detrending, filtering
+        and standardization, so that the masker return the raw regions
+        signals. The resampling and smoothing are unchanged.
+    """
+    raw_parameters = dict(masker_parameters)
+    raw_parameters.update(detrend=False, standardize=False, low_pass=None, high_pass=None)
+
+    return raw_parameters
+
+
+def extract_raw_signals(subject_fmri, projection_operator, time_block_size=100, smoothing_fwhm=None):
+    """Extract the un-cleaned regions signals, whatever the atlas type.
+
+    Parameters
+    ----------
+    subject_fmri: str or Nifti1Image
+        The subject 4D functional image.
+    projection_operator: dict
+        A maps projection operator, see maps_projection_operator, or a
+        labels operator, see labels_indicator_operator.
+    time_block_size: int, optional
+        The number of volumes read at once. Default is 100.
+    smoothing_fwhm: float or None, optional
+        The full-width half maximum in millimeters of a Gaussian
+        spatial smoothing. Default is None, no smoothing.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The raw regions signals.
+    """
+    return smoothed_raw_signals(img=subject_fmri, extraction_operator=projection_operator,
+                                smoothings_fwhm=[smoothing_fwhm],
+                                time_block_size=time_block_size)[smoothing_fwhm]
+
+
+def load_confounds_table(confounds_file, header='infer'):
+    """Load a confounds file, the way nilearn.signal.clean does.
+
+    Parameters
+    ----------
+    confounds_file: str
+        The full path to the confounds file, a delimited text file
+        with one column for each confound, with or without header.
+    header: bool or 'infer', optional
+        If True, the first line of the file holds the confounds names,
+        if False, the file has no header. If 'infer', the first line is a
+        header if one of its fields is not a number, missing values like
+        'n/a' being numbers. Default is 'infer'.
+
+    Returns
+    -------
+    output: pandas.DataFrame, shape (number of time points, number of confounds)
+        The confounds. The columns are named after the header if
+        the file has one, and numbered from 0 if not.
+    """
+    if header not in [True, False, 'infer']:
+        raise ValueError('header should be True, False or infer, got {}.'.format(header))
+    with open(confounds_file) as f:
+        first_line = f.readline()
+
+    # The delimiter is a tabulation, a comma, a semicolon, or else white spaces
+    delimiter = next((delimiter for delimiter in ['\t', ',', ';'] if delimiter in first_line), None)
+    first_line_fields = [field.strip() for field in first_line.strip().split(delimiter)]
+
+    if header == 'infer':
+        def is_number(field):
+            try:
+                float(field)
+            except ValueError:
+                return field.lower() in ['', 'n/a', 'na', 'nan']
+            return True
+        header = not all(is_number(field) for field in first_line_fields)
+
+    confounds = np.genfromtxt(confounds_file, delimiter=delimiter, skip_header=int(header), encoding=None,
+                              ndmin=2)
+
+    return pd.DataFrame(confounds, columns=first_line_fields if header else None)
+
+
+def strategy_confounds(confounds_table, strategy):
+    """Build the nuisance design of a denoising strategy.
+
+    Parameters
+    ----------
+    confounds_table: pandas.DataFrame or None
+        The subject confounds, see load_confounds_table. None if
+        the subject has no confounds file.
+    strategy: None, str, list or callable
+        The denoising strategy: None for no confounds regression,
+        'all' for all the confounds of the table, a list of column
+        names or positions, or a function taking the confounds table
+        and returning the nuisance design.
+
+    Returns
+    -------
+    output: numpy.array or None
+        The nuisance design of shape (number of time points, number
+        of regressors), None if no confounds should be regressed.
+    """
+    if strategy is None or confounds_table is None:
+        return None
+    if callable(strategy):
+        return np.asarray(strategy(confounds_table), dtype=np.float64)
+    if isinstance(strategy, str) and strategy == 'all':
+        return confounds_table.values
+    if all(isinstance(column, (int, np.integer)) for column in strategy):
+        return confounds_table.iloc[:, list(strategy)].values
+
+    return confounds_table.loc[:, list(strategy)].values
+
+
+def clean_variants_signals(raw_signals, confounds_table, extraction_variants):
+    """Clean the raw regions signals for several extraction variants.
+
+    Parameters
+    ----------
+    raw_signals: dict
+        The raw regions signals, with the smoothing full-width half
+        maximum as keys, see smoothed_raw_signals.
+    confounds_table: pandas.DataFrame or None
+        The subject confounds, loaded once, see load_confounds_table.
+    extraction_variants: dict
+        The extraction variants, with the variants names as keys, and
+        tuples (masker parameters, confounds strategy) as values. The
+        confounds strategy gives the confounds to regress, see
+        strategy_confounds.
+
+    Returns
+    -------
+    output: dict
+        The cleaned time series of each variant.
+
+    Notes
+    -----
+    The nuisance design of each variant is orthogonalized once, with a QR
+    factorization, by nilearn.signal.clean, and projected out of all the
+    regions signals at once.
+    """
+    return {variant_name: clean_regions_signals(
+        regions_signals=raw_signals[variant_parameters['smoothing_fwhm']],
+        confounds=strategy_confounds(confounds_table=confounds_table, strategy=confounds_strategy),
+        masker_parameters=variant_parameters)
+        for variant_name, (variant_parameters, confounds_strategy) in extraction_variants.items()}
+
+
+def sparse_maps_time_series(subject_fmri, subject_confounds, projection_operator, masker_parameters,
+                            time_block_size=100):
+    """Extract the time series of a subject with the sparse projection engine.
+
+    Parameters
+    ----------
+    subject_fmri: str or Nifti1Image
+        The subject 4D functional image.
+    subject_confounds: str or None
+        The subject confounds file, None if no regressors
+        should be removed.
+    projection_operator: dict
+        The projection operator of the atlas, on the subject
+        grid, see maps_projection_operator. A labels operator,
+        see labels_indicator_operator, is also accepted, the
+        regions signals being then the regions means.
+    masker_parameters: dict
+        The masker parameters, see time_series_extraction.
+    time_block_size: int, optional
+        The number of volumes projected at once. Default is 100.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of time points, number of regions)
+        The subject time series.
+    """
+    # The time series are extracted block by block, while the cleaning
+    # is done on the whole regions signals
+    regions_signals = extract_raw_signals(subject_fmri=subject_fmri, projection_operator=projection_operator,
+                                          time_block_size=time_block_size,
+                                          smoothing_fwhm=masker_parameters['smoothing_fwhm'])
+
+    return clean_regions_signals(regions_signals=regions_signals, confounds=subject_confounds,
+                                 masker_parameters=masker_parameters)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sparse precision estimation along a shared regularization path.
+
+The graphical lasso of each subject is estimated along a decreasing grid of
+regularization parameters, shared by all the subjects, each estimate being
+initialized with the estimate of the previous parameter. The parameter of each
+subject is selected by cross-validation on contiguous folds of time points, and
+the subjects are dispatched in a pool of processes. The group sparse variant
+estimates one common support for all the subjects, with
+nilearn.connectome.GroupSparseCovarianceCV. The precisions are then read as
+the precision and partial correlation connectivity kinds.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+import numpy as np
+from joblib import Parallel, delayed
+from nilearn.connectome import GroupSparseCovarianceCV
+from sklearn.covariance import graphical_lasso, empirical_covariance, log_likelihood
+from sklearn.model_selection import KFold
+from conpagnon.computing.covariance_engine import standardize_time_series, precision_to_partial_correlation
+try:
+    # The warm started path of sklearn.covariance.GraphicalLassoCV, which is private
+    from sklearn.covariance._graph_lasso import graphical_lasso_path
+except ImportError:
+    graphical_lasso_path = None
+
+
+def standardized_time_series(time_series):
+    """Standardize the time series of one subject.
+
+    Parameters
+    ----------
+    time_series: numpy.array, shape (number of time points, number of regions)
+        The time series of one subject.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (number of time points, number of regions)
+        The centered time series, with unit population variance.
+    output 2: numpy.array, shape (number of regions, )
+        The standard deviations of the time series, set to one when
+        numerically null, like standardize_time_series.
+    """
+    time_series = np.asarray(time_series, dtype=np.float64)
+    time_series_std = time_series.std(axis=0)
+    time_series_std[time_series_std < np.finfo(np.float64).eps] = 1.0
+
+    return standardize_time_series(time_series[np.newaxis, ...])[0], time_series_std
+
+
+def alpha_grid(empirical_correlations, n_alphas=10, alpha_min_ratio=1e-2):
+    """Compute a regularization path shared by several subjects.
+
+    Parameters
+    ----------
+    empirical_correlations: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The empirical correlations of the subjects.
+    n_alphas: int, optional
+        The number of regularization parameters. Default is 10.
+    alpha_min_ratio: float, optional
+        The ratio of the smallest to the largest regularization parameter.
+        Default is 1e-2, like sklearn.covariance.GraphicalLassoCV.
+
+    Returns
+    -------
+    output: numpy.array, shape (n_alphas, )
+        The decreasing regularization parameters, log-spaced from the largest
+        off diagonal absolute correlation of all the subjects, above which all
+        the precisions are diagonal.
+    """
+    n_regions = empirical_correlations.shape[-1]
+    off_diagonal = ~np.eye(n_regions, dtype=bool)
+    alpha_max = np.abs(empirical_correlations[:, off_diagonal]).max()
+
+    return np.logspace(np.log10(alpha_max), np.log10(alpha_min_ratio * alpha_max), n_alphas)
+
+
+def cold_start_graphical_lasso_path(X, alphas, cov_init=None, X_test=None, mode='cd', tol=1e-4, max_iter=100):
+    """Estimate the graphical lasso along a regularization path with the public scikit-learn API.
+
+    This is the fallback of the private sklearn.covariance graphical_lasso_path,
+    with the same parameters and outputs.
+
+    Parameters
+    ----------
+    X: numpy.array, shape (number of time points, number of regions)
+        The time series.
+    alphas: numpy.array
+        The decreasing regularization parameters.
+    cov_init: numpy.array, shape (number of regions, number of regions), optional
+        Unused, sklearn.covariance.graphical_lasso starts each estimation
+        from the empirical covariance. Default is None.
+    X_test: numpy.array, shape (number of time points, number of regions), optional
+        The held out time points. Default is None.
+    mode: str, optional
+        The lasso solver, 'cd' or 'lars'. Default is 'cd'.
+    tol: float, optional
+        The tolerance on the dual gap of each estimation. Default is 1e-4.
+    max_iter: int, optional
+        The maximum number of iterations of each estimation. Default is 100.
+
+    Returns
+    -------
+    output 1: list
+        The covariances for each regularization parameter, nan for a failed
+        estimation.
+    output 2: list
+        The precisions for each regularization parameter, nan for a failed
+        estimation.
+    output 3: list
+        The log-likelihood of the held out time points for each regularization
+        parameter, -inf for a failed estimation. Only returned with `X_test`.
+    """
+    train_covariance = empirical_covariance(X)
+    test_covariance = empirical_covariance(X_test) if X_test is not None else None
+    covariances, precisions, scores = [], [], []
+    for alpha in alphas:
+        try:
+            covariance, precision = graphical_lasso(train_covariance, alpha=alpha, mode=mode, tol=tol,
+                                                    max_iter=max_iter)
+            score = log_likelihood(test_covariance, precision) if X_test is not None else -np.inf
+        except FloatingPointError:
+            covariance, precision, score = np.nan, np.nan, -np.inf
+        covariances.append(covariance)
+        precisions.append(precision)
+        scores.append(score if np.isfinite(score) else -np.inf)
+
+    if X_test is not None:
+        return covariances, precisions, scores
+    return covariances, precisions
+
+
+def subject_graphical_lasso_path(time_series, alphas, n_folds=3, covariance_init=None, mode='cd', tol=1e-4,
+                                 max_iter=100):
+    """Estimate the sparse precision of one subject along a regularization path.
+
+    Parameters
+    ----------
+    time_series: numpy.array, shape (number of time points, number of regions)
+        The time series of one subject.
+    alphas: numpy.array
+        The decreasing regularization parameters.
+    n_folds: int, optional
+        The number of contiguous folds of time points of the cross-validation.
+        If None, or if only one regularization parameter is given, the smallest
+        parameter is selected. Default is 3.
+    covariance_init: numpy.array, shape (number of regions, number of regions), optional
+        The initial covariance of the estimation at the first regularization
+        parameter, like the group estimate. Default is None, the empirical
+        correlation.
+    mode: str, optional
+        The lasso solver, 'cd' or 'lars'. Default is 'cd'.
+    tol: float, optional
+        The tolerance on the dual gap of each estimation. Default is 1e-4.
+    max_iter: int, optional
+        The maximum number of iterations of each estimation. Default is 100.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (number of regions, number of regions)
+        The sparse precision at the selected regularization parameter.
+    output 2: float
+        The selected regularization parameter.
+    output 3: numpy.array, shape (number of alphas, )
+        The mean log-likelihood of the held out time points for each
+        regularization parameter, None without cross-validation.
+
+    Notes
+    -----
+    The graphical lasso is estimated on the standardized time series, so that
+    the regularization parameters are comparable between subjects, and the
+    precision is rescaled by the standard deviations of the time series.
+    Along the path, each estimation is initialized with the previous one,
+    with the private path of sklearn.covariance.GraphicalLassoCV. If it can't
+    be imported, each estimation starts from the empirical covariance, see
+    cold_start_graphical_lasso_path.
+    """
+    standardized, time_series_std = standardized_time_series(time_series)
+    alphas = np.asarray(alphas, dtype=np.float64)
+    path = graphical_lasso_path if graphical_lasso_path is not None else cold_start_graphical_lasso_path
+
+    scores = None
+    best_index = len(alphas) - 1
+    if n_folds is not None and len(alphas) > 1:
+        scores = np.zeros(len(alphas))
+        for train, test in KFold(n_splits=n_folds).split(standardized):
+            _, _, fold_scores = path(standardized[train], alphas=alphas, cov_init=covariance_init,
+                                     X_test=standardized[test], mode=mode, tol=tol, max_iter=max_iter)
+            scores += fold_scores
+        scores /= n_folds
+        # The smallest regularization parameter in case of equality, like GraphicalLassoCV
+        best_index = len(alphas) - 1 - np.argmax(scores[::-1])
+
+    _, precisions = path(standardized, alphas=alphas[:best_index + 1], cov_init=covariance_init, mode=mode, tol=tol,
+                         max_iter=max_iter)
+    # A failed estimation is a nan, we keep the last converged estimate
+    while best_index > 0 and not np.all(np.isfinite(precisions[best_index])):
+        best_index -= 1
+    precision = precisions[best_index] / time_series_std[:, np.newaxis] / time_series_std[np.newaxis, :]
+
+    return precision, alphas[best_index], scores
+
+
+def subjects_graphical_lasso(time_series, alphas=10, n_folds=3, n_jobs=1, backend='multiprocessing', verbose=0,
+                             mode='cd', tol=1e-4, max_iter=100):
+    """Estimate the sparse precision of each subject along a shared regularization path.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    alphas: int or numpy.array, optional
+        The decreasing regularization parameters, or their number, see
+        alpha_grid. Default is 10.
+    n_folds: int, optional
+        The number of folds of the cross-validation of each subject, see
+        subject_graphical_lasso_path. Default is 3.
+    n_jobs: int, optional
+        The number of processes. Default is 1.
+    backend: str, optional
+        The joblib backend. Default is 'multiprocessing'.
+    verbose: int, optional
+        The verbosity level of joblib. Default is 0.
+    mode: str, optional
+        The lasso solver, 'cd' or 'lars'. Default is 'cd'.
+    tol: float, optional
+        The tolerance of each estimation. Default is 1e-4.
+    max_iter: int, optional
+        The maximum number of iterations of each estimation. Default is 100.
+
+    Returns
+    -------
+    output 1: list
+        The sparse precisions, arrays of shape (number of regions, number of
+        regions), in the order of `time_series`.
+    output 2: numpy.array, shape (number of subjects, )
+        The selected regularization parameter of each subject.
+
+    Notes
+    -----
+    The path of each subject starts from the graphical lasso of the mean
+    empirical correlation of the subjects at the first regularization parameter,
+    which is computed once.
+    """
+    empirical_correlations = np.array([np.corrcoef(subject_time_series, rowvar=False)
+                                       for subject_time_series in time_series])
+    # Constant time series have no correlation
+    empirical_correlations[~np.isfinite(empirical_correlations)] = 0.0
+    regions_index = np.arange(empirical_correlations.shape[1])
+    empirical_correlations[:, regions_index, regions_index] = 1.0
+    if np.isscalar(alphas):
+        alphas = alpha_grid(empirical_correlations=empirical_correlations, n_alphas=int(alphas))
+    alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+    group_covariance, _ = graphical_lasso(empirical_correlations.mean(axis=0), alpha=alphas[0], mode=mode, tol=tol,
+                                          max_iter=max_iter)
+
+    subjects_estimates = Parallel(n_jobs=n_jobs, backend=backend, verbose=verbose)(
+        delayed(subject_graphical_lasso_path)(time_series=subject_time_series, alphas=alphas, n_folds=n_folds,
+                                              covariance_init=group_covariance, mode=mode, tol=tol,
+                                              max_iter=max_iter)
+        for subject_time_series in time_series)
+    precisions = [subject_precision for subject_precision, _, _ in subjects_estimates]
+    selected_alphas = np.array([subject_alpha for _, subject_alpha, _ in subjects_estimates])
+
+    return precisions, selected_alphas
+
+
+def group_sparse_precisions(time_series, alphas=10, n_folds=3, n_jobs=1, verbose=0, tol=1e-3, max_iter=10):
+    """Estimate the precisions of the subjects with a common sparse support.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    alphas: int or list, optional
+        The regularization parameters, or their number. Default is 10.
+    n_folds: int, optional
+        The number of folds of the cross-validation. Default is 3.
+    n_jobs: int, optional
+        The number of processes computing the folds. Default is 1.
+    verbose: int, optional
+        The verbosity level. Default is 0.
+    tol: float, optional
+        The tolerance of the final estimation. Default is 1e-3.
+    max_iter: int, optional
+        The maximum number of iterations of the final estimation. Default is 10.
+
+    Returns
+    -------
+    output 1: list
+        The precisions, arrays of shape (number of regions, number of
+        regions), in the order of `time_series`.
+    output 2: float
+        The selected regularization parameter.
+
+    Notes
+    -----
+    The path is computed with warm starts by nilearn.connectome.GroupSparseCovarianceCV,
+    one fold of time points for all the subjects by process.
+    """
+    if not np.isscalar(alphas):
+        alphas = list(alphas)
+    estimator = GroupSparseCovarianceCV(alphas=alphas, cv=n_folds, n_jobs=n_jobs, verbose=verbose, tol=tol,
+                                        max_iter=max_iter)
+    estimator.fit([np.asarray(subject_time_series, dtype=np.float64) for subject_time_series in time_series])
+
+    return list(estimator.precisions_.transpose(2, 0, 1)), estimator.alpha_
+
+
+def sparse_precision_kinds(time_series, kinds, group_sparse=False, **kwargs):
+    """Compute the precision and partial correlation kinds from sparse precisions.
+
+    Parameters
+    ----------
+    time_series: list
+        The subjects time series, arrays of shape (number of time
+        points, number of regions).
+    kinds: list
+        The connectivity kinds, among 'precision' and 'partial correlation'.
+    group_sparse: bool, optional
+        If True, the precisions share a common support, see
+        group_sparse_precisions, and are estimated subject by subject
+        else, see subjects_graphical_lasso. Default is False.
+    **kwargs:
+        The keyword arguments of group_sparse_precisions, or subjects_graphical_lasso.
+
+    Returns
+    -------
+    output: dict
+        The connectivity kinds as keys, and the lists of connectivity
+        matrices of shape (number of regions, number of regions), in
+        the order of `time_series`, as values.
+    """
+    for kind in kinds:
+        if kind not in ['precision', 'partial correlation']:
+            raise ValueError('Sparse precisions give the precision and partial correlation kinds, '
+                             'got kind {}.'.format(kind))
+    if group_sparse:
+        precisions, _ = group_sparse_precisions(time_series=time_series, **kwargs)
+    else:
+        precisions, _ = subjects_graphical_lasso(time_series=time_series, **kwargs)
+
+    connectivity_kinds = dict()
+    if 'precision' in kinds:
+        connectivity_kinds['precision'] = precisions
+    if 'partial correlation' in kinds:
+        connectivity_kinds['partial correlation'] = list(precision_to_partial_correlation(np.array(precisions)))
+
+    return connectivity_kinds
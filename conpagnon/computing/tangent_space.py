@@ -0,0 +1,660 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tangent space reference, and batched projections.
+
+The tangent kind projects each subject covariance on the space tangent to
+the manifold of symmetric positive definite matrices, at the geometric mean
+of a reference group. The reference is stored once, along with the
+eigendecomposition of the geometric mean, and the whitening and unwhitening
+matrices derived from it, so that projecting a new subject, or a batch of
+subjects, costs one batched eigendecomposition. The reference can be saved
+on disk, and later projections don't need the reference group time series.
+The geometric mean of a growing cohort is updated batch after batch by
+IncrementalGeometricMean.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+import json
+import warnings
+import numpy as np
+import sklearn.covariance
+from sklearn.covariance import LedoitWolf
+from nilearn.connectome import sym_matrix_to_vec
+from conpagnon.computing import covariance_engine
+
+
+def map_eigenvalues(function, symmetric_matrices):
+    """Apply a function to the eigenvalues of a stack of symmetric matrices.
+
+    Parameters
+    ----------
+    function: function
+        The function applied to the eigenvalues, like numpy.log.
+    symmetric_matrices: numpy.array, shape (..., number of regions, number of regions)
+        The symmetric matrices.
+
+    Returns
+    -------
+    output: numpy.array, shape (..., number of regions, number of regions)
+        The matrices with the same eigenvectors, and the transformed
+        eigenvalues.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(symmetric_matrices)
+
+    return form_symmetric(function=function, eigenvalues=eigenvalues, eigenvectors=eigenvectors)
+
+
+def form_symmetric(function, eigenvalues, eigenvectors):
+    """Build symmetric matrices from their eigenvectors and transformed eigenvalues.
+
+    Parameters
+    ----------
+    function: function
+        The function applied to the eigenvalues.
+    eigenvalues: numpy.array, shape (..., number of regions)
+        The eigenvalues.
+    eigenvectors: numpy.array, shape (..., number of regions, number of regions)
+        The eigenvectors, in columns.
+
+    Returns
+    -------
+    output: numpy.array, shape (..., number of regions, number of regions)
+        The symmetric matrices.
+    """
+    return np.matmul(eigenvectors * function(eigenvalues)[..., np.newaxis, :], np.swapaxes(eigenvectors, -1, -2))
+
+
+def check_spd(matrices):
+    """Check that a stack of matrices are symmetric positive definite.
+
+    Parameters
+    ----------
+    matrices: numpy.array, shape (number of matrices, number of regions, number of regions)
+        The matrices.
+
+    Raises
+    ------
+    ValueError
+        If one of the matrices is not symmetric positive definite,
+        like nilearn.connectome does.
+    """
+    if not np.allclose(matrices, np.swapaxes(matrices, -1, -2), atol=0, rtol=1e-7) or \
+            np.min(np.linalg.eigvalsh(matrices)) <= 0:
+        raise ValueError('Expected symmetric positive definite matrices.')
+
+
+def geometric_mean(covariances, init=None, max_iter=30, tol=1e-7, weights=None):
+    """Compute the geometric mean of symmetric positive definite matrices.
+
+    Parameters
+    ----------
+    covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The symmetric positive definite matrices.
+    init: numpy.array, shape (number of regions, number of regions), optional
+        The initial point of the gradient descent. Default is None, the
+        arithmetic mean of the matrices.
+    max_iter: int, optional
+        The maximum number of iterations. Default is 30, like the
+        tangent kind of nilearn.connectome.ConnectivityMeasure.
+    tol: float, optional
+        The gradient norm, divided by the matrices size, under which the
+        descent stops. Default is 1e-7.
+    weights: numpy.array, shape (number of subjects, ), optional
+        The weights of the matrices in the mean. Default is None, all
+        the matrices have the same weight.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of regions, number of regions)
+        The geometric mean.
+
+    Notes
+    -----
+    This is the gradient descent of nilearn.connectome, where the
+    whitened matrices logarithms are computed for all the subjects with
+    one batched eigendecomposition at each iteration.
+    """
+    covariances = np.asarray(covariances, dtype=np.float64)
+    check_spd(covariances)
+    if init is None:
+        gmean = np.average(covariances, axis=0, weights=weights)
+    else:
+        check_spd(init[np.newaxis, ...])
+        gmean = np.array(init, dtype=np.float64)
+
+    norm_old = np.inf
+    step = 1.0
+    norm = np.inf
+    for _ in range(max_iter):
+        # Computation of the gradient
+        vals_gmean, vecs_gmean = np.linalg.eigh(gmean)
+        gmean_inv_sqrt = form_symmetric(np.sqrt, 1.0 / vals_gmean, vecs_gmean)
+        whitened_matrices = np.matmul(np.matmul(gmean_inv_sqrt, covariances), gmean_inv_sqrt)
+        logs_mean = np.average(map_eigenvalues(np.log, whitened_matrices), axis=0, weights=weights)
+        if np.any(np.isnan(logs_mean)):
+            raise FloatingPointError('Nan value after logarithm operation.')
+        # Norm of the covariant derivative on the tangent space at point gmean
+        norm = np.linalg.norm(logs_mean)
+        # Move along the geodesic
+        vals_log, vecs_log = np.linalg.eigh(logs_mean)
+        gmean_sqrt = form_symmetric(np.sqrt, vals_gmean, vecs_gmean)
+        gmean = gmean_sqrt.dot(form_symmetric(np.exp, vals_log * step, vecs_log)).dot(gmean_sqrt)
+        # Update the norm and the step size
+        if norm < norm_old:
+            norm_old = norm
+        elif norm > norm_old:
+            step = step / 2.0
+            norm = norm_old
+        if tol is not None and norm / gmean.size < tol:
+            break
+    if tol is not None and norm / gmean.size >= tol:
+        warnings.warn('Maximum number of iterations {} reached without getting to the '
+                      'requested tolerance level {}.'.format(max_iter, tol))
+
+    return gmean
+
+
+def covariance_estimator_to_json(covariance_estimator):
+    """Describe a scikit-learn covariance estimator in JSON.
+
+    Parameters
+    ----------
+    covariance_estimator: estimator object
+        An estimator of sklearn.covariance, like LedoitWolf or OAS.
+
+    Returns
+    -------
+    output: str
+        The JSON description, the class name and the parameters of the
+        estimator.
+
+    Raises
+    ------
+    ValueError
+        If the estimator is not a sklearn.covariance estimator, or if its
+        parameters can't be written in JSON.
+    """
+    estimator_class = type(covariance_estimator)
+    if getattr(sklearn.covariance, estimator_class.__name__, None) is not estimator_class:
+        raise ValueError('Only the estimators of sklearn.covariance can be saved, '
+                         'got {}.'.format(estimator_class.__name__))
+    try:
+        return json.dumps({'class': estimator_class.__name__,
+                           'params': covariance_estimator.get_params(deep=False)})
+    except TypeError:
+        raise ValueError('The parameters of {} can\'t be saved in JSON: {}.'.format(
+            estimator_class.__name__, covariance_estimator.get_params(deep=False)))
+
+
+def covariance_estimator_from_json(description):
+    """Rebuild a covariance estimator described by covariance_estimator_to_json.
+
+    Parameters
+    ----------
+    description: str
+        The JSON description of the estimator.
+
+    Returns
+    -------
+    output: estimator object
+        A new, unfitted, sklearn.covariance estimator.
+    """
+    description = json.loads(description)
+    estimator_class = getattr(sklearn.covariance, description['class'], None)
+    if not isinstance(estimator_class, type):
+        raise ValueError('Unknown covariance estimator: {}.'.format(description['class']))
+
+    return estimator_class(**description['params'])
+
+
+class TangentReference(object):
+    """The reference point of a tangent space projection.
+
+    Parameters
+    ----------
+    mean: numpy.array, shape (number of regions, number of regions)
+        The geometric mean of the reference group covariances.
+    covariance_estimator: estimator object, optional
+        The scikit-learn covariance estimator used to compute the subjects
+        covariances from their time series. Default is the Ledoit-Wolf
+        estimator, like nilearn.connectome.ConnectivityMeasure.
+
+    Attributes
+    ----------
+    mean_: numpy.array, shape (number of regions, number of regions)
+        The geometric mean.
+    eigenvalues_: numpy.array, shape (number of regions, )
+        The geometric mean eigenvalues.
+    eigenvectors_: numpy.array, shape (number of regions, number of regions)
+        The geometric mean eigenvectors.
+    whitening_: numpy.array, shape (number of regions, number of regions)
+        The inverse square root of the geometric mean.
+    unwhitening_: numpy.array, shape (number of regions, number of regions)
+        The square root of the geometric mean.
+
+    See Also
+    --------
+    TangentReference.from_covariances, TangentReference.from_time_series :
+        Build the reference from a reference group.
+    TangentReference.load : Load a saved reference.
+    """
+
+    def __init__(self, mean, covariance_estimator=None):
+        self.mean_ = np.array(mean, dtype=np.float64)
+        self.covariance_estimator = LedoitWolf(store_precision=False) if covariance_estimator is None \
+            else covariance_estimator
+        self.eigenvalues_, self.eigenvectors_ = np.linalg.eigh(self.mean_)
+        self.whitening_ = form_symmetric(lambda x: 1.0 / np.sqrt(x), self.eigenvalues_, self.eigenvectors_)
+        self.unwhitening_ = form_symmetric(np.sqrt, self.eigenvalues_, self.eigenvectors_)
+
+    @classmethod
+    def from_covariances(cls, covariances, covariance_estimator=None, init=None, max_iter=30, tol=1e-7):
+        """Build the reference at the geometric mean of covariances.
+
+        Parameters
+        ----------
+        covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The reference group covariances.
+        covariance_estimator: estimator object, optional
+            The estimator the covariances were computed with.
+        init, max_iter, tol: optional
+            The geometric mean descent parameters, see geometric_mean.
+
+        Returns
+        -------
+        output: TangentReference
+            The tangent space reference.
+        """
+        return cls(mean=geometric_mean(covariances=covariances, init=init, max_iter=max_iter, tol=tol),
+                   covariance_estimator=covariance_estimator)
+
+    @classmethod
+    def from_time_series(cls, time_series, covariance_estimator=None, init=None, max_iter=30, tol=1e-7):
+        """Build the reference from the reference group time series.
+
+        Parameters
+        ----------
+        time_series: list
+            The reference group time series, arrays of shape (number
+            of time points, number of regions).
+        covariance_estimator: estimator object, optional
+            The covariance estimator. Default is the Ledoit-Wolf estimator.
+        init, max_iter, tol: optional
+            The geometric mean descent parameters, see geometric_mean.
+
+        Returns
+        -------
+        output: TangentReference
+            The tangent space reference.
+        """
+        covariance_estimator = LedoitWolf(store_precision=False) if covariance_estimator is None \
+            else covariance_estimator
+        covariances = np.array(covariance_engine.subjects_connectivity_matrices(
+            time_series=time_series, kind='covariance', covariance_estimator=covariance_estimator))
+
+        return cls.from_covariances(covariances=covariances, covariance_estimator=covariance_estimator,
+                                    init=init, max_iter=max_iter, tol=tol)
+
+    def transform(self, covariances, vectorize=False, discard_diagonal=False):
+        """Project covariances in the tangent space.
+
+        Parameters
+        ----------
+        covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The covariances to project.
+        vectorize: bool, optional
+            If True, the tangent matrices are vectorized, like
+            nilearn.connectome.sym_matrix_to_vec does. Default is False.
+        discard_diagonal: bool, optional
+            If True, the diagonal is discarded in the vectorization.
+            Default is False.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The tangent matrices, i.e the logarithms of the whitened covariances.
+        """
+        covariances = np.asarray(covariances, dtype=np.float64)
+        tangent_matrices = map_eigenvalues(np.log, np.matmul(np.matmul(self.whitening_, covariances),
+                                                             self.whitening_))
+        if vectorize:
+            return sym_matrix_to_vec(tangent_matrices, discard_diagonal=discard_diagonal)
+
+        return tangent_matrices
+
+    def transform_time_series(self, time_series, vectorize=False, discard_diagonal=False):
+        """Project subjects time series in the tangent space.
+
+        Parameters
+        ----------
+        time_series: list
+            The subjects time series, arrays of shape (number of time
+            points, number of regions).
+        vectorize, discard_diagonal: bool, optional
+            See TangentReference.transform.
+
+        Returns
+        -------
+        output: numpy.array
+            The tangent matrices, see TangentReference.transform.
+        """
+        covariances = np.array(covariance_engine.subjects_connectivity_matrices(
+            time_series=time_series, kind='covariance', covariance_estimator=self.covariance_estimator))
+
+        return self.transform(covariances=covariances, vectorize=vectorize, discard_diagonal=discard_diagonal)
+
+    def inverse_transform(self, tangent_matrices):
+        """Map tangent matrices back to covariances.
+
+        Parameters
+        ----------
+        tangent_matrices: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The tangent matrices.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The covariances, i.e the unwhitened exponential of the tangent matrices.
+        """
+        return np.matmul(np.matmul(self.unwhitening_, map_eigenvalues(np.exp, tangent_matrices)),
+                         self.unwhitening_)
+
+    def save(self, file_path):
+        """Save the reference in a .npz file.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Notes
+        -----
+        Only arrays are saved, the covariance estimator is described by its
+        class name and parameters in JSON, see covariance_estimator_to_json.
+        The file is read back without unpickling anything.
+        """
+        np.savez(file_path, mean=self.mean_, eigenvalues=self.eigenvalues_, eigenvectors=self.eigenvectors_,
+                 whitening=self.whitening_, unwhitening=self.unwhitening_,
+                 covariance_estimator=np.array(covariance_estimator_to_json(self.covariance_estimator)))
+
+    @classmethod
+    def load(cls, file_path):
+        """Load a reference saved by TangentReference.save.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Returns
+        -------
+        output: TangentReference
+            The tangent space reference.
+        """
+        with np.load(file_path, allow_pickle=False) as saved_reference:
+            reference = cls.__new__(cls)
+            reference.mean_ = saved_reference['mean']
+            reference.eigenvalues_ = saved_reference['eigenvalues']
+            reference.eigenvectors_ = saved_reference['eigenvectors']
+            reference.whitening_ = saved_reference['whitening']
+            reference.unwhitening_ = saved_reference['unwhitening']
+            reference.covariance_estimator = covariance_estimator_from_json(
+                str(saved_reference['covariance_estimator']))
+
+        return reference
+
+    def __repr__(self):
+        return 'TangentReference(number_of_regions={}, covariance_estimator={})'.format(
+            self.mean_.shape[0], self.covariance_estimator)
+
+
+def riemannian_distance(first_matrix, second_matrix):
+    """Compute the affine invariant distance between two symmetric positive definite matrices.
+
+    Parameters
+    ----------
+    first_matrix: numpy.array, shape (number of regions, number of regions)
+        The first matrix.
+    second_matrix: numpy.array, shape (number of regions, number of regions)
+        The second matrix.
+
+    Returns
+    -------
+    output: float
+        The Frobenius norm of the logarithm of the second matrix whitened by
+        the first one, i.e the norm of its projection in the space tangent
+        at the first matrix.
+    """
+    return np.linalg.norm(TangentReference(mean=first_matrix).transform(
+        covariances=np.asarray(second_matrix)[np.newaxis, ...])[0])
+
+
+class IncrementalGeometricMean(object):
+    """Geometric mean of a growing cohort, and the tangent matrices of its subjects.
+
+    The mean is updated with each new batch of covariances by the descent of
+    geometric_mean, warm started at the previous mean, which only needs a few
+    iterations when the batch is small compared to the cohort. The tangent
+    matrices of the subjects are projected at a reference which follows the mean
+    lazily: the projected subjects are projected again only when the tangent
+    matrices are requested, and the mean has moved from the reference by more
+    than a tolerance.
+
+    Parameters
+    ----------
+    mean: numpy.array, shape (number of regions, number of regions), optional
+        A previously computed geometric mean, the starting point of the
+        first update. Default is None.
+    number_of_subjects: int, optional
+        The number of subjects the previous mean was computed on, when their
+        covariances are not given to update: the previous mean then stands for
+        them in the updated mean, with their weight. Default is 0, the
+        previous mean is only a starting point.
+    covariance_estimator: estimator object, optional
+        The covariance estimator of the subjects time series. Default is the
+        Ledoit-Wolf estimator.
+    max_iter: int, optional
+        The maximum number of iterations of each update. Default is 30.
+    tol: float, optional
+        The tolerance of the descent, see geometric_mean. Default is 1e-7.
+    reprojection_tol: float, optional
+        The distance between the mean and the projection reference, see
+        riemannian_distance, above which the subjects are projected again.
+        Default is 1e-3.
+
+    Attributes
+    ----------
+    mean_: numpy.array, shape (number of regions, number of regions)
+        The geometric mean of the cohort.
+    covariances_: numpy.array, shape (number of subjects, number of regions, number of regions)
+        The covariances of the subjects given to update.
+    reference_: TangentReference
+        The reference the tangent matrices are projected at.
+
+    Notes
+    -----
+    Accounting for earlier subjects with their mean gives an approximation of
+    the geometric mean of the whole cohort, which is exact when all the
+    covariances are given to update.
+    """
+
+    def __init__(self, mean=None, number_of_subjects=0, covariance_estimator=None, max_iter=30, tol=1e-7,
+                 reprojection_tol=1e-3):
+        self.mean_ = None if mean is None else np.array(mean, dtype=np.float64)
+        self.number_of_subjects = int(number_of_subjects) if mean is not None else 0
+        self.summary_mean_ = self.mean_ if self.number_of_subjects > 0 else None
+        self.covariance_estimator = LedoitWolf(store_precision=False) if covariance_estimator is None \
+            else covariance_estimator
+        self.max_iter = max_iter
+        self.tol = tol
+        self.reprojection_tol = reprojection_tol
+        self.covariances_ = None
+        self.reference_ = None
+        self.tangent_matrices_ = None
+
+    def update(self, covariances):
+        """Add new subjects covariances, and update the geometric mean.
+
+        Parameters
+        ----------
+        covariances: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The new subjects covariances.
+
+        Returns
+        -------
+        output: IncrementalGeometricMean
+            The updated mean.
+        """
+        covariances = np.asarray(covariances, dtype=np.float64)
+        if covariances.ndim == 2:
+            covariances = covariances[np.newaxis, ...]
+        check_spd(covariances)
+        self.covariances_ = covariances if self.covariances_ is None \
+            else np.concatenate([self.covariances_, covariances])
+
+        if self.summary_mean_ is not None:
+            points = np.concatenate([self.summary_mean_[np.newaxis, ...], self.covariances_])
+            weights = np.concatenate([[self.number_of_subjects], np.ones(self.covariances_.shape[0])])
+        else:
+            points, weights = self.covariances_, None
+        self.mean_ = geometric_mean(covariances=points, init=self.mean_, max_iter=self.max_iter, tol=self.tol,
+                                    weights=weights)
+
+        return self
+
+    def update_time_series(self, time_series):
+        """Add new subjects time series, and update the geometric mean.
+
+        Parameters
+        ----------
+        time_series: list
+            The new subjects time series, arrays of shape (number of time
+            points, number of regions).
+
+        Returns
+        -------
+        output: IncrementalGeometricMean
+            The updated mean.
+        """
+        return self.update(covariances=np.array(covariance_engine.subjects_connectivity_matrices(
+            time_series=time_series, kind='covariance', covariance_estimator=self.covariance_estimator)))
+
+    def reference_shift(self):
+        """The distance between the mean and the projection reference, infinite without reference."""
+        if self.reference_ is None:
+            return np.inf
+        return riemannian_distance(self.reference_.mean_, self.mean_)
+
+    def reference(self):
+        """The projection reference, moved to the mean if it is farther than the tolerance.
+
+        Returns
+        -------
+        output: TangentReference
+            The reference the tangent matrices are projected at.
+        """
+        if self.mean_ is None:
+            raise ValueError('The geometric mean is not computed yet, call update first.')
+        if self.reference_shift() > self.reprojection_tol:
+            self.reference_ = TangentReference(mean=self.mean_, covariance_estimator=self.covariance_estimator)
+            # The projected subjects are projected again at the new reference
+            self.tangent_matrices_ = None
+
+        return self.reference_
+
+    def tangent_matrices(self, vectorize=False, discard_diagonal=False):
+        """The tangent matrices of the subjects given to update.
+
+        Only the subjects not projected yet are projected, unless the mean
+        moved from the projection reference by more than the tolerance.
+
+        Parameters
+        ----------
+        vectorize, discard_diagonal: bool, optional
+            See TangentReference.transform.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of subjects, number of regions, number of regions)
+            The tangent matrices, in the order of the updates.
+        """
+        reference = self.reference()
+        number_of_projected = 0 if self.tangent_matrices_ is None else self.tangent_matrices_.shape[0]
+        if self.covariances_ is not None and number_of_projected < self.covariances_.shape[0]:
+            new_tangent_matrices = reference.transform(covariances=self.covariances_[number_of_projected:])
+            self.tangent_matrices_ = new_tangent_matrices if self.tangent_matrices_ is None \
+                else np.concatenate([self.tangent_matrices_, new_tangent_matrices])
+        if self.tangent_matrices_ is None:
+            return np.empty((0,) + self.mean_.shape)
+        if vectorize:
+            return sym_matrix_to_vec(self.tangent_matrices_, discard_diagonal=discard_diagonal)
+
+        return self.tangent_matrices_.copy()
+
+    def save(self, file_path):
+        """Save the mean, the covariances and the projections in a .npz file.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Notes
+        -----
+        As in TangentReference.save, the covariance estimator is saved as
+        JSON, and the file holds no pickled object.
+        """
+        number_of_regions = self.mean_.shape[0] if self.mean_ is not None else 0
+        empty_stack = np.empty((0, number_of_regions, number_of_regions))
+        np.savez(file_path,
+                 mean=self.mean_ if self.mean_ is not None else np.empty((0, 0)),
+                 summary_mean=self.summary_mean_ if self.summary_mean_ is not None else np.empty((0, 0)),
+                 number_of_subjects=self.number_of_subjects,
+                 covariances=self.covariances_ if self.covariances_ is not None else empty_stack,
+                 reference_mean=self.reference_.mean_ if self.reference_ is not None else np.empty((0, 0)),
+                 tangent_matrices=self.tangent_matrices_ if self.tangent_matrices_ is not None else empty_stack,
+                 parameters=np.array([self.max_iter, self.tol if self.tol is not None else np.nan,
+                                      self.reprojection_tol]),
+                 covariance_estimator=np.array(covariance_estimator_to_json(self.covariance_estimator)))
+
+    @classmethod
+    def load(cls, file_path):
+        """Load a mean saved by IncrementalGeometricMean.save, to warm start the next update.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Returns
+        -------
+        output: IncrementalGeometricMean
+            The incremental geometric mean.
+        """
+        with np.load(file_path, allow_pickle=False) as saved_mean:
+            max_iter, tol, reprojection_tol = saved_mean['parameters']
+            incremental_mean = cls(covariance_estimator=covariance_estimator_from_json(
+                                       str(saved_mean['covariance_estimator'])),
+                                   max_iter=int(max_iter), tol=None if np.isnan(tol) else tol,
+                                   reprojection_tol=reprojection_tol)
+            if saved_mean['mean'].size:
+                incremental_mean.mean_ = saved_mean['mean']
+            if saved_mean['summary_mean'].size:
+                incremental_mean.summary_mean_ = saved_mean['summary_mean']
+                incremental_mean.number_of_subjects = int(saved_mean['number_of_subjects'])
+            if saved_mean['covariances'].shape[0]:
+                incremental_mean.covariances_ = saved_mean['covariances']
+            if saved_mean['reference_mean'].size:
+                incremental_mean.reference_ = TangentReference(mean=saved_mean['reference_mean'],
+                                                               covariance_estimator=incremental_mean.covariance_estimator)
+            if saved_mean['tangent_matrices'].shape[0]:
+                incremental_mean.tangent_matrices_ = saved_mean['tangent_matrices']
+
+        return incremental_mean
+
+    def __repr__(self):
+        return 'IncrementalGeometricMean(number_of_subjects={}, reprojection_tol={})'.format(
+            self.number_of_subjects + (self.covariances_.shape[0] if self.covariances_ is not None else 0),
+            self.reprojection_tol)
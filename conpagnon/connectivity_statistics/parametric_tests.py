@@ -2,13 +2,15 @@ import importlib
 from conpagnon.utils import pre_preprocessing, folders_and_files_management
 from conpagnon.utils import array_operation
 from conpagnon.utils.array_operation import vectorizer
-from scipy.stats import mstats, norm, ttest_ind, pearsonr, ttest_rel
+from scipy.stats import norm, ttest_ind, pearsonr, ttest_rel
+from scipy.stats import t as t_distribution
 from nilearn.connectome import sym_matrix_to_vec, vec_to_sym_matrix
 import numpy as np
 from statsmodels.sandbox.stats.multicomp import multipletests
 import statsmodels.api as sm
 import warnings
 from conpagnon.computing import compute_connectivity_matrices as ccm
+from conpagnon.data_handling import connectivity_store
 from patsy import dmatrix, dmatrices
 import pandas as pd
 from conpagnon.pylearn_mulm import mulm
@@ -31,6 +33,90 @@ Parametric test used in a resting state group connectivity analysis.
 """
 
 
+def two_samples_t_statistics(first_group_statistics, second_group_statistics, contrast=(1.0, -1.0)):
+    """Compute two samples t-tests from the sufficient statistics of the two groups.
+
+    Parameters
+    ----------
+    first_group_statistics : tuple
+        The number of unmasked values, the mean, and the sum of squared deviations
+        to the mean of each variable in the first group, arrays of the same shape,
+        see array_operation.masked_sufficient_statistics.
+    second_group_statistics : tuple
+        The statistics of the second group.
+    contrast : list, optional
+        The contrast of the group means, [1.0, -1.0] to test the first group
+        against the second, or [-1.0, 1.0]. Default is (1.0, -1.0).
+
+    Returns
+    -------
+    output : dict
+        A dictionnary containing, in arrays of the shape of the statistics:
+            - 'tstatistic' and 'pvalues': the t statistic of the contrast, and the two
+            sided p-values, assuming equal variances, like scipy.stats.ttest_ind.
+
+            - 'degrees of freedom': the degrees of freedom of the t-test.
+
+            - 'welch tstatistic', 'welch pvalues' and 'welch degrees of freedom': the same
+            for the Welch t-test, without the equal variances assumption.
+
+            - 'mean effect': the difference of the group means of the tested values, like
+            the Fisher transformed coefficients, according to the contrast.
+
+            - 'cohen d': the mean effect, divided by the pooled standard deviation.
+
+    Notes
+    -----
+    The statistics are combined variable by variable, so that the tests of all the
+    connectivity coefficients are computed at once. Where a statistic is not defined,
+    because of too few unmasked values or of null variances, it is set to zero, and
+    its p-value to one. Non finite values in the groups propagate as nan.
+    """
+    first_counts, first_means, first_squares = [np.asarray(statistic, dtype=float)
+                                                 for statistic in first_group_statistics]
+    second_counts, second_means, second_squares = [np.asarray(statistic, dtype=float)
+                                                   for statistic in second_group_statistics]
+    first_weight, second_weight = contrast
+    mean_effect = first_weight * first_means + second_weight * second_means
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Pooled variance
+        degrees_of_freedom = first_counts + second_counts - 2.
+        pooled_variance = (first_squares + second_squares) / degrees_of_freedom
+        pooled_defined = (first_counts > 0) & (second_counts > 0) & (degrees_of_freedom > 0) & \
+            (pooled_variance != 0)
+        tstatistic = mean_effect / np.sqrt(pooled_variance * (1. / first_counts + 1. / second_counts))
+        cohen_d = mean_effect / np.sqrt(pooled_variance)
+
+        # Welch unequal variances
+        first_variance_of_mean = first_squares / (first_counts - 1.) / first_counts
+        second_variance_of_mean = second_squares / (second_counts - 1.) / second_counts
+        welch_variance = first_variance_of_mean + second_variance_of_mean
+        welch_defined = (first_counts > 1) & (second_counts > 1) & (welch_variance != 0)
+        welch_tstatistic = mean_effect / np.sqrt(welch_variance)
+        welch_degrees_of_freedom = welch_variance ** 2 / (first_variance_of_mean ** 2 / (first_counts - 1.) +
+                                                          second_variance_of_mean ** 2 / (second_counts - 1.))
+
+    # Non finite values propagate, undefined statistics are not significant
+    for statistic, defined in [(tstatistic, pooled_defined), (cohen_d, pooled_defined),
+                               (welch_tstatistic, welch_defined)]:
+        statistic[~defined & np.isfinite(mean_effect + first_squares + second_squares)] = 0.
+    degrees_of_freedom[~pooled_defined] = np.nan
+    welch_degrees_of_freedom[~welch_defined] = np.nan
+
+    pvalues = np.ones_like(tstatistic)
+    pvalues[pooled_defined] = 2. * t_distribution.sf(np.abs(tstatistic[pooled_defined]),
+                                                     degrees_of_freedom[pooled_defined])
+    welch_pvalues = np.ones_like(welch_tstatistic)
+    welch_pvalues[welch_defined] = 2. * t_distribution.sf(np.abs(welch_tstatistic[welch_defined]),
+                                                          welch_degrees_of_freedom[welch_defined])
+
+    return {'tstatistic': tstatistic, 'pvalues': pvalues, 'degrees of freedom': degrees_of_freedom,
+            'welch tstatistic': welch_tstatistic, 'welch pvalues': welch_pvalues,
+            'welch degrees of freedom': welch_degrees_of_freedom,
+            'mean effect': mean_effect, 'cohen d': cohen_d}
+
+
 def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kinds, contrast,
                        preprocessing_method='fisher',
                        alpha=.05, multicomp_method='fdr_bh'):
@@ -100,6 +186,20 @@ def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kind
             connexion are mask at alpha level. 2D numpy array of shape
             (number of regions, number of regions).
 
+            - 'total mean effect', 'uncorrected mean effect' : The differences of mean
+            connectivity for all the connexions, and for the connexions whose
+            uncorrected pvalues are below alpha, computed on the raw connectivity
+            matrices, see Notes. 2D numpy arrays of shape (number of regions,
+            number of regions).
+
+            - 'welch tstatistic', 'welch uncorrected pvalues' : The statistic t-map, and
+            the raw pvalues, of the Welch t-test, without the equal variance assumption.
+            2D numpy arrays of shape (number of regions, number of regions).
+
+            - 'cohen d' : The effect size, the difference of the group means of the
+            tested coefficients divided by their pooled standard deviation. 2D numpy
+            array of shape (number of regions, number of regions).
+
     Raises
     ------
     ValueError : If the number in groupes is strictly less than 2 raise
@@ -121,11 +221,27 @@ def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kind
 
     Notes
     -----
-    The two sample t-test I perform here account for masked array using
-    statistical test for masked array in the Scipy packages. That is,
+    The two sample t-test I perform here account for masked array, like
+    the statistical test for masked array in the Scipy packages. That is,
     if in the subjects masked_array, some regions are masked, they will be
     discarded when performing the t-test. If the mask contain only False
-    value, no region are discarded.
+    value, no region are discarded. The number of unmasked coefficients, their
+    mean and their sum of squared deviations are computed once for each group
+    and kind, and all the edges are tested at once from them, see
+    two_samples_t_statistics. Edges whose t statistic is not defined, like
+    edges discarded for all the subjects of a group, have a null t statistic,
+    and a p-value of one. This is a change from the former scipy.stats.mstats.ttest_ind
+    based test, where those edges were masked values, with an arbitrary
+    underlying t statistic, in the reconstructed matrices.
+
+    The t statistics, and the Cohen's d, are computed on the preprocessed
+    coefficients, Fisher transformed by default. The 'total mean effect',
+    and the significant and uncorrected mean effects derived from it, are the
+    difference of the group mean matrices of compute_connectivity_matrices.group_mean_connectivity,
+    computed on the raw, not Fisher transformed, connectivity matrices, so that
+    they read in the unit of the connectivity kind. The 'mean effect' of
+    two_samples_t_statistics, the difference of the means of the tested values,
+    is not reported.
 
     All the metric are symmetric, therefore I only compute the t-test
     for the lower part of the matrices of shape n_columns * (n_columns + 1) /2
@@ -176,6 +292,17 @@ def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kind
         warnings.warn('I think using a two sample t-test in this fashion on tangent '
                       'space should be interpreted carefully !')
 
+    # The group means are computed once for all the kinds
+    groupes_mean_matrices = ccm.group_mean_connectivity(
+        subjects_connectivity_matrices=subjects_connectivity_matrices_dictionnary,
+        kinds=kinds)
+
+    # Vectorize the boolean arrays of the groups, once for all the kinds
+    vec_X_mask = array_operation.vectorize_boolean_mask(
+        symmetric_boolean_mask=stacked_matrices[groupes[0]]['masked_array'])
+    vec_Y_mask = array_operation.vectorize_boolean_mask(
+        symmetric_boolean_mask=stacked_matrices[groupes[1]]['masked_array'])
+
     # Fisher transform coefficients
     for kind in kinds:
         if preprocessing_method == 'fisher':
@@ -191,39 +318,32 @@ def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kind
         else:
             raise ValueError('Unrecognized pre-processing method')
 
-        # Vectorize the connectivity matrices, discarding the diagonal
+        # Vectorize the connectivity matrices
         X_vectorize = sym_matrix_to_vec(symmetric=X)
         Y_vectorize = sym_matrix_to_vec(symmetric=Y)
-        # Vectorize the corresponding boolean array
-        vec_X_mask = array_operation.vectorize_boolean_mask(
-            symmetric_boolean_mask=stacked_matrices[groupes[0]]['masked_array'])
-        vec_Y_mask = array_operation.vectorize_boolean_mask(
-            symmetric_boolean_mask=stacked_matrices[groupes[1]]['masked_array'])
-
-        # Create a numpy masked array structure for the two sample
-        X_ = np.ma.array(data=X_vectorize, mask=vec_X_mask)
-        Y_ = np.ma.array(data=Y_vectorize, mask=vec_Y_mask)
-
-        # Finally perform a two sample t-test for masked array along the first
-        # dimension according contrast, accounting for discarded rois
-        if contrast == [1.0, -1.0]:
-            t_stats_vec, pvalues_vec = mstats.ttest_ind(a=X_, b=Y_, axis=0)
-        elif contrast == [-1.0, 1.0]:
-            t_stats_vec, pvalues_vec = mstats.ttest_ind(a=Y_, b=X_, axis=0)
+
+        # Finally perform a two sample t-test from the counts, means and sums of squared
+        # deviations of the unmasked coefficients of each group, accounting for discarded rois
+        t_statistics = two_samples_t_statistics(
+            first_group_statistics=array_operation.masked_sufficient_statistics(arrays=X_vectorize,
+                                                                                masked_array=vec_X_mask),
+            second_group_statistics=array_operation.masked_sufficient_statistics(arrays=Y_vectorize,
+                                                                                 masked_array=vec_Y_mask),
+            contrast=contrast)
+        t_stats_vec = t_statistics['tstatistic']
+        pvalues_vec = t_statistics['pvalues']
 
         # Replace nan values in pvalues_vec by 1 to avoid failure in correction method
         pvalues_vec[np.isnan(pvalues_vec)] = 1.
+        welch_pvalues_vec = t_statistics['welch pvalues']
+        welch_pvalues_vec[np.isnan(welch_pvalues_vec)] = 1.
 
         # Correction of pvalues, reject of null hypotheses below alpha level.
-        reject_, pvalues_vec_corrected, _, _ = multipletests(pvals=pvalues_vec.data,
+        reject_, pvalues_vec_corrected, _, _ = multipletests(pvals=pvalues_vec,
                                                              alpha=alpha,
                                                              method=multicomp_method)
 
         # Computing the effect: difference between mean according to the contrast vector:
-        groupes_mean_matrices = ccm.group_mean_connectivity(
-            subjects_connectivity_matrices=subjects_connectivity_matrices_dictionnary,
-            kinds=kinds)
-
         mean_X = groupes_mean_matrices[groupes[0]][kind]
         mean_Y = groupes_mean_matrices[groupes[1]][kind]
 
@@ -260,6 +380,9 @@ def two_samples_t_test(subjects_connectivity_matrices_dictionnary, groupes, kind
                                     'significant mean effect': significant_mean_effect,
                                     'total mean effect': mean_effect,
                                     'uncorrected mean effect': uncorrected_mean_effect,
+                                    'welch tstatistic': vec_to_sym_matrix(vec=t_statistics['welch tstatistic']),
+                                    'welch uncorrected pvalues': vec_to_sym_matrix(vec=welch_pvalues_vec),
+                                    'cohen d': vec_to_sym_matrix(vec=t_statistics['cohen d']),
                                     'tested_contrast': contrast}
 
     return t_test_dictionnary
@@ -280,6 +403,8 @@ def linear_regression(connectivity_data, data, formula, NA_action,
         The connectivity matrix organised in a dictionary. The subject identifier
         as keys, and metric as values, i.e the matrix which contain the connectivity coefficient.
         As metric are symmetric, matrix as to be vectorize in a 1D array of shape n_features.
+        A ConnectivityStore is also accepted, the subjects being identified in all
+        the groups of the store.
     formula: string
         The model, in a R fashion.
     data: string
@@ -352,14 +477,22 @@ def linear_regression(connectivity_data, data, formula, NA_action,
     general_regression_subjects_list = X_df.index
     # Intersection of subjects to perform regression and the general list because
     # of possible dropped NA values.
-    regression_subjects_list = \
-        list(set(connectivity_data.keys()).intersection(general_regression_subjects_list))
-    y = np.array([connectivity_data[subject][kind] for subject in regression_subjects_list])
-    
-    if vectorize:
-        y = sym_matrix_to_vec(y, discard_diagonal=discard_diagonal)
+    if isinstance(connectivity_data, connectivity_store.ConnectivityStore):
+        # The subjects matrices are read from the store arrays
+        regression_subjects_list = \
+            list(set([subject for _, subject in connectivity_data.subjects]).intersection(
+                general_regression_subjects_list))
+        y = connectivity_data.stacked(kind)[connectivity_data.subjects_rows(regression_subjects_list)]
+        y = y.vectorize(discard_diagonal=discard_diagonal) if vectorize else y.dense()
     else:
-        y = y
+        regression_subjects_list = \
+            list(set(connectivity_data.keys()).intersection(general_regression_subjects_list))
+        y = np.array([connectivity_data[subject][kind] for subject in regression_subjects_list])
+
+        if vectorize:
+            y = sym_matrix_to_vec(y, discard_diagonal=discard_diagonal)
+        else:
+            y = y
     
     # Conversion of X_df into a classic numpy array
     X_df = X_df.loc[regression_subjects_list]
@@ -927,6 +1060,8 @@ def regress_confounds(vectorize_subjects_connectivity, confound_dictionary, grou
     vectorize_subjects_connectivity: dict
         The subject connectivity matrices dictionary, with vectorized matrices,
         WITHOUT the diagonal.
+        A ConnectivityStore is also accepted: the confounds are regressed on its
+        vectorized matrices, without the diagonal, and a regressed store is returned.
     confound_dictionary: dict
         The nested dictionary containing for each group and kind: a field
         named 'confounds' containing a list of confounds. A second field named
@@ -953,7 +1088,9 @@ def regress_confounds(vectorize_subjects_connectivity, confound_dictionary, grou
 
     # Copy of the vectorized connectivity matrices dictionary
     # to override the matrices
-    regressed_subjects_connectivity_dictionary = copy.deepcopy(vectorize_subjects_connectivity)
+    regressed_subjects_connectivity_dictionary = vectorize_subjects_connectivity.copy() \
+        if isinstance(vectorize_subjects_connectivity, connectivity_store.ConnectivityStore) \
+        else copy.deepcopy(vectorize_subjects_connectivity)
     regression_by_kind = dict.fromkeys(groupes, dict.fromkeys(kinds))
     # Save the design matrix, and the stack of matrices before and after
     # regressing
@@ -999,8 +1136,11 @@ def regress_confounds(vectorize_subjects_connectivity, confound_dictionary, grou
 
         for kind in kinds:
             # stack the vectorized array into a numpy array of shape (n_subjects, n_features)
-            y = np.array([vectorize_subjects_connectivity[group][subject][kind]
-                          for subject in group_subjects_list])
+            if isinstance(vectorize_subjects_connectivity, connectivity_store.ConnectivityStore):
+                y = vectorize_subjects_connectivity.features(kind=kind, group=group, discard_diagonal=True)
+            else:
+                y = np.array([vectorize_subjects_connectivity[group][subject][kind]
+                              for subject in group_subjects_list])
 
             # check first dimension of X and y, it should be the same
             if y.shape[0] != X.shape[0]:
@@ -1011,15 +1151,19 @@ def regress_confounds(vectorize_subjects_connectivity, confound_dictionary, grou
             # QR decomposition of X matrix
             Q, R, _ = linalg.qr(X, mode='economic', pivoting=True)
             # Improve numerical stability
-            Q = Q[:, np.abs(np.diag(R)) > np.finfo(np.float).eps * 100.]
+            Q = Q[:, np.abs(np.diag(R)) > np.finfo(float).eps * 100.]
 
             # Regress the confounds in X on y
             y_regressed = y - Q.dot(Q.T).dot(y)
 
             # Override the connectivity matrices for the current group and kind
-            for subject in group_subjects_list:
-                regressed_subjects_connectivity_dictionary[group][subject][kind] = \
-                    y_regressed[group_subjects_list.index(subject), ...]
+            if isinstance(regressed_subjects_connectivity_dictionary, connectivity_store.ConnectivityStore):
+                regressed_subjects_connectivity_dictionary.set_features(kind=kind, features=y_regressed, group=group,
+                                                                        discard_diagonal=True)
+            else:
+                for subject in group_subjects_list:
+                    regressed_subjects_connectivity_dictionary[group][subject][kind] = \
+                        y_regressed[group_subjects_list.index(subject), ...]
 
             regression_by_kind[group][kind] = {'original matrices': y, 'after regression': y_regressed}
 
@@ -5,6 +5,10 @@ from nilearn import plotting
 import pandas as pd
 import webcolors
 import nibabel as nb
+import itertools
+import io
+import json
+from conpagnon.utils import array_operation
 
 # !/usr/bin/env python3
 # -*- coding: utf-8 -*-
@@ -240,20 +244,434 @@ def fetch_atlas_functional_network(atlas_excel_file, sheetname, network_column_n
     return networks_dictionary
 
 
+class NetworkPartition(object):
+    """The regions of an atlas grouped in functional networks.
+
+    The partition is read once from the atlas excel file, and holds the
+    index arrays of the regions of each network, and the positions of the
+    within network and between networks coefficients in the vectorized
+    lower triangle of the connectivity matrices, so that the network level
+    functions do not parse the excel file, nor derive the indices again.
+
+    Parameters
+    ----------
+    networks_rois: dict
+        The networks names as keys, in the order of the analysis, and the
+        index of the network regions in the 4D atlas file as values.
+    networks_colors: dict, optional
+        The networks names as keys, and the color name of each network as
+        values. Default is None.
+    number_of_regions: int, optional
+        The number of regions of the connectivity matrices. Default is None,
+        the largest region index plus one.
+    networks_dictionary: dict, optional
+        The networks dictionary read in the excel file, see
+        fetch_atlas_functional_network. Default is None.
+
+    Attributes
+    ----------
+    network_labels: list
+        The networks names.
+    network_pairs: list
+        The pairs of networks, in the order of itertools.combinations.
+    assignment: numpy.array, shape (number of regions, number of networks)
+        The number of times each region is listed in each network,
+        one or zero for a partition of the regions.
+
+    Notes
+    -----
+    The positions are those of the lower triangle vectorized with the diagonal,
+    like sym_matrix_to_vec(discard_diagonal=False), or the arrays of a
+    ConnectivityStore, or without the diagonal when discard_diagonal is True,
+    like the features of the classification.
+    """
+
+    def __init__(self, networks_rois, networks_colors=None, number_of_regions=None, networks_dictionary=None):
+        self.network_labels = list(networks_rois.keys())
+        self.networks_rois = dict()
+        for network in self.network_labels:
+            network_rois = np.array(networks_rois[network], dtype=int)
+            network_rois.setflags(write=False)
+            self.networks_rois[network] = network_rois
+        self.networks_colors = networks_colors
+        if number_of_regions is None:
+            number_of_regions = max(int(network_rois.max()) + 1 for network_rois in self.networks_rois.values()
+                                    if network_rois.size)
+        self.number_of_regions = number_of_regions
+        self.networks_dictionary = networks_dictionary
+        self.network_pairs = list(itertools.combinations(self.network_labels, 2))
+        self.assignment = np.zeros((number_of_regions, len(self.network_labels)))
+        for network_position, network in enumerate(self.network_labels):
+            np.add.at(self.assignment[:, network_position], self.networks_rois[network], 1.0)
+
+        # The coefficients of each network, in the order of the vectorized network sub-matrix,
+        # and the coefficients between each pair of networks, in the order of the first network
+        # regions, then the second network regions.
+        self._within_network_coefficients = dict()
+        for network, network_rois in self.networks_rois.items():
+            rows, columns = array_operation.lower_triangle_indices(network_rois.size, True)
+            self._within_network_coefficients[network] = (network_rois[rows], network_rois[columns])
+        self._between_networks_coefficients = {
+            pair_of_network: self._pair_coefficients(*pair_of_network) for pair_of_network in self.network_pairs}
+        self._networks_coefficients = dict()
+        self._positions = dict()
+        for discard_diagonal in [False, True]:
+            self._positions[('within', discard_diagonal)] = {
+                network: self.vectorized_positions(*coefficients, discard_diagonal=discard_diagonal)
+                for network, coefficients in self._within_network_coefficients.items()}
+            self._positions[('between', discard_diagonal)] = {
+                pair_of_network: self.vectorized_positions(*coefficients, discard_diagonal=discard_diagonal)
+                for pair_of_network, coefficients in self._between_networks_coefficients.items()}
+
+    @classmethod
+    def from_networks_dictionary(cls, networks_dictionary, roi_indices_column_name, color_of_network_column=None,
+                                 number_of_regions=None):
+        """Build the partition from a networks dictionary.
+
+        Parameters
+        ----------
+        networks_dictionary: dict
+            The networks dictionary, see fetch_atlas_functional_network.
+        roi_indices_column_name: str
+            The name of the column containing the index of each ROI in the 4D atlas file.
+        color_of_network_column: str, optional
+            The name of the column containing the color of the network of each ROI.
+            Default is None.
+        number_of_regions: int, optional
+            The number of regions of the connectivity matrices. Default is None.
+
+        Returns
+        -------
+        output: NetworkPartition
+            The network partition, in the order of the networks dictionary.
+        """
+        networks_rois = {network: np.asarray(networks_dictionary[network]['dataframe'][roi_indices_column_name])
+                         for network in networks_dictionary.keys()}
+        networks_colors = None
+        if color_of_network_column is not None:
+            networks_colors = {network: list(set(networks_dictionary[network]['dataframe'][color_of_network_column]))[0]
+                               for network in networks_dictionary.keys()}
+
+        return cls(networks_rois=networks_rois, networks_colors=networks_colors, number_of_regions=number_of_regions,
+                   networks_dictionary=networks_dictionary)
+
+    @classmethod
+    def from_excel(cls, atlas_excel_file, sheetname, network_column_name, roi_indices_column_name,
+                   color_of_network_column=None, number_of_regions=None):
+        """Build the partition from the atlas excel file.
+
+        Parameters
+        ----------
+        atlas_excel_file: str
+            The full path to the excel file containing all the information on your atlas.
+        sheetname: str
+            The active sheet name in the atlas excel file.
+        network_column_name: str
+            The name of columns containing the label for all the functional networks.
+        roi_indices_column_name: str
+            The name of the column containing the index of each ROI in the 4D atlas file.
+        color_of_network_column: str, optional
+            The name of the column containing the color of the network of each ROI.
+            Default is None.
+        number_of_regions: int, optional
+            The number of regions of the connectivity matrices. Default is None.
+
+        Returns
+        -------
+        output: NetworkPartition
+            The network partition.
+        """
+        networks_dictionary = fetch_atlas_functional_network(atlas_excel_file=atlas_excel_file, sheetname=sheetname,
+                                                             network_column_name=network_column_name)
+
+        return cls.from_networks_dictionary(networks_dictionary=networks_dictionary,
+                                            roi_indices_column_name=roi_indices_column_name,
+                                            color_of_network_column=color_of_network_column,
+                                            number_of_regions=number_of_regions)
+
+    @staticmethod
+    def vectorized_positions(rows, columns, discard_diagonal=False):
+        """Compute the positions of coefficients in the vectorized lower triangle.
+
+        Parameters
+        ----------
+        rows: numpy.array
+            The rows of the coefficients.
+        columns: numpy.array
+            The columns of the coefficients.
+        discard_diagonal: bool, optional
+            If True, the positions in the vectorized lower triangle without the
+            diagonal, the coefficients being off the diagonal. Default is False.
+
+        Returns
+        -------
+        output: numpy.array
+            The positions, the coefficients above the diagonal being read at the
+            position of their symmetric.
+        """
+        if not discard_diagonal:
+            return array_operation.packed_index(rows, columns)
+        rows, columns = np.asarray(rows), np.asarray(columns)
+        lower_rows = np.maximum(rows, columns)
+
+        return lower_rows * (lower_rows - 1) // 2 + np.minimum(rows, columns)
+
+    def _pair_coefficients(self, first_network, second_network):
+        # The coefficients [i, j], for j in the first network, then i in the second network
+        first_network_rois = self.networks_rois[first_network]
+        second_network_rois = self.networks_rois[second_network]
+        return (np.tile(second_network_rois, first_network_rois.size),
+                np.repeat(first_network_rois, second_network_rois.size))
+
+    def number_of_rois(self, network):
+        """Return the number of regions of a network."""
+        return self.networks_rois[network].size
+
+    def within_network_edges(self, network, discard_diagonal=False):
+        """Return the positions of the coefficients of a network.
+
+        Parameters
+        ----------
+        network: str
+            The network name.
+        discard_diagonal: bool, optional
+            If True, the positions in the vectorized lower triangle without the
+            diagonal. Default is False.
+
+        Returns
+        -------
+        output: numpy.array
+            The positions of the coefficients below the diagonal of the network
+            sub-matrix, in the order of its vectorization.
+        """
+        return self._positions[('within', discard_diagonal)][network]
+
+    def within_networks_coefficients(self, networks=None):
+        """Return the coefficients of several networks, network after network.
+
+        Parameters
+        ----------
+        networks: list, optional
+            The networks names. Default is None, the networks with at least two regions.
+
+        Returns
+        -------
+        output 1: numpy.array
+            The rows of the coefficients below the diagonal of each network sub-matrix,
+            in the order of its vectorization, network after network.
+        output 2: numpy.array
+            The columns of the coefficients.
+        output 3: numpy.array, shape (number of networks, )
+            The position of the first coefficient of each network, the edge to
+            network map of a grouped reduction, like numpy.add.reduceat.
+        """
+        if networks is None:
+            networks = [network for network in self.network_labels if self.number_of_rois(network) >= 2]
+        networks = tuple(networks)
+        if networks not in self._networks_coefficients:
+            networks_rows = [np.empty(0, dtype=int)] + [self._within_network_coefficients[network][0]
+                                                        for network in networks]
+            networks_columns = [np.empty(0, dtype=int)] + [self._within_network_coefficients[network][1]
+                                                           for network in networks]
+            starts = np.cumsum([network_rows.size for network_rows in networks_rows])[:-1]
+            self._networks_coefficients[networks] = (np.concatenate(networks_rows).astype(int),
+                                                     np.concatenate(networks_columns).astype(int), starts)
+        return self._networks_coefficients[networks]
+
+    def within_network_diagonal(self, network):
+        """Return the positions of the diagonal coefficients of a network, in the vectorized lower triangle."""
+        network_rois = self.networks_rois[network]
+        return array_operation.packed_index(network_rois, network_rois)
+
+    def between_network_edges(self, first_network, second_network, discard_diagonal=False):
+        """Return the positions of the coefficients between two networks.
+
+        Parameters
+        ----------
+        first_network: str
+            The first network name.
+        second_network: str
+            The second network name.
+        discard_diagonal: bool, optional
+            If True, the positions in the vectorized lower triangle without the
+            diagonal. Default is False.
+
+        Returns
+        -------
+        output: numpy.array
+            The positions of the coefficients [i, j], for j in the first network
+            regions, then i in the second network regions.
+        """
+        pair_of_network = (first_network, second_network)
+        if pair_of_network in self._positions[('between', discard_diagonal)]:
+            return self._positions[('between', discard_diagonal)][pair_of_network]
+        return self.vectorized_positions(*self._pair_coefficients(first_network, second_network),
+                                         discard_diagonal=discard_diagonal)
+
+    def assignment_matrix(self, number_of_regions=None):
+        """Return the indicator matrix of the regions of each network.
+
+        Parameters
+        ----------
+        number_of_regions: int, optional
+            The number of regions of the connectivity matrices, at least the
+            number of regions of the partition. Default is None, the number of
+            regions of the partition.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of regions, number of networks)
+            The indicator matrix, the regions out of the partition having no network.
+        """
+        if number_of_regions is None or number_of_regions == self.number_of_regions:
+            return self.assignment
+        if number_of_regions < self.number_of_regions:
+            raise ValueError('The partition has {} regions, the connectivity matrices only {}.'.format(
+                self.number_of_regions, number_of_regions))
+        return np.concatenate([self.assignment,
+                               np.zeros((number_of_regions - self.number_of_regions, len(self.network_labels)))])
+
+    def network_colors(self, network_labels=None):
+        """Return the colors of the networks, in the normalized RGB space.
+
+        Parameters
+        ----------
+        network_labels: list, optional
+            The networks names. Default is None, all the networks.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of networks, 3)
+            The colors, in the order of network_labels.
+        """
+        if self.networks_colors is None:
+            raise ValueError('The network partition has no color.')
+        if network_labels is None:
+            network_labels = self.network_labels
+        return (1/255)*np.array([webcolors.name_to_rgb(self.networks_colors[network]) for network in network_labels])
+
+    def save(self, file_path):
+        """Save the partition in a .npz file.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Notes
+        -----
+        The regions indices are saved as arrays, the networks names, the
+        colors and the dataframes of the networks dictionary are saved
+        as JSON, and the file holds no pickled object.
+        """
+        metadata = {'network_labels': self.network_labels,
+                    'networks_colors': None if self.networks_colors is None else
+                    [self.networks_colors[network] for network in self.network_labels],
+                    'networks_dataframes': None if self.networks_dictionary is None else
+                    [self.networks_dictionary[network]['dataframe'].to_json(orient='split', double_precision=15)
+                     for network in self.network_labels]}
+        np.savez(file_path, metadata=np.array(json.dumps(metadata)),
+                 rois=np.concatenate([self.networks_rois[network] for network in self.network_labels]),
+                 number_of_rois=np.array([self.number_of_rois(network) for network in self.network_labels]),
+                 number_of_regions=self.number_of_regions)
+
+    @classmethod
+    def load(cls, file_path):
+        """Load a partition saved by NetworkPartition.save.
+
+        Parameters
+        ----------
+        file_path: str
+            The full path to the file.
+
+        Returns
+        -------
+        output: NetworkPartition
+            The network partition.
+        """
+        with np.load(file_path, allow_pickle=False) as saved_partition:
+            metadata = json.loads(str(saved_partition['metadata']))
+            network_labels = metadata['network_labels']
+            networks_rois = dict(zip(network_labels, np.split(saved_partition['rois'],
+                                                              np.cumsum(saved_partition['number_of_rois'])[:-1])))
+            number_of_regions = int(saved_partition['number_of_regions'])
+        networks_colors = None
+        if metadata['networks_colors'] is not None:
+            networks_colors = dict(zip(network_labels, metadata['networks_colors']))
+        networks_dictionary = None
+        if metadata['networks_dataframes'] is not None:
+            networks_dictionary = dict()
+            for network, network_dataframe in zip(network_labels, metadata['networks_dataframes']):
+                network_df = pd.read_json(io.StringIO(network_dataframe), orient='split', dtype=False)
+                networks_dictionary[network] = {'dataframe': network_df, 'number of rois': len(network_df.index)}
+
+        return cls(networks_rois=networks_rois, networks_colors=networks_colors,
+                   number_of_regions=number_of_regions, networks_dictionary=networks_dictionary)
+
+    def __len__(self):
+        return len(self.network_labels)
+
+    def __repr__(self):
+        return 'NetworkPartition(number_of_networks={}, number_of_regions={})'.format(
+            len(self.network_labels), self.number_of_regions)
+
+
+def network_partition(atlas_file, sheetname=None, network_column_name=None, roi_indices_column_name=None,
+                      color_of_network_column=None):
+    """Return the network partition of an atlas, read in the excel file if needed.
+
+    Parameters
+    ----------
+    atlas_file: str or NetworkPartition
+        The full path to the atlas excel file, or an already built partition,
+        returned as is.
+    sheetname: str, optional
+        The active sheet name in the atlas excel file.
+    network_column_name: str, optional
+        The name of columns containing the label for all the functional networks.
+    roi_indices_column_name: str, optional
+        The name of the column containing the index of each ROI in the 4D atlas file.
+    color_of_network_column: str, optional
+        The name of the column containing the color of the network of each ROI.
+
+    Returns
+    -------
+    output: NetworkPartition
+        The network partition.
+    """
+    if isinstance(atlas_file, NetworkPartition):
+        return atlas_file
+    return NetworkPartition.from_excel(atlas_excel_file=atlas_file, sheetname=sheetname,
+                                       network_column_name=network_column_name,
+                                       roi_indices_column_name=roi_indices_column_name,
+                                       color_of_network_column=color_of_network_column)
+
+
 def generate_3d_img_network(reference_4datlas, atlas_information_xlsx_file, network_column_name,
                             sheetname, atlas4d_index_keys, atlas3d_label_key,
                             save_network_img_directory):
     """This function generate a 3D NifTi file for each defined functional network in a 4D atlas.
 
+    A NetworkPartition built from the excel file is also accepted as atlas_information_xlsx_file.
+    The 3D labels of the rois are read in the atlas sheet: a partition without the dataframes of the
+    networks, like a partition built from the rois of each network only, raises a ValueError.
     """
     # Fetch network information for all networks
-    networks_dictionnary = fetch_atlas_functional_network(
-        atlas_excel_file=atlas_information_xlsx_file,
-        sheetname=sheetname, network_column_name=network_column_name)
+    if isinstance(atlas_information_xlsx_file, NetworkPartition):
+        networks_dictionnary = atlas_information_xlsx_file.networks_dictionary
+        if networks_dictionnary is None or \
+                any(networks_dictionnary[network].get('dataframe') is None for network in networks_dictionnary):
+            raise ValueError('The 3D labels of the rois are read in the dataframes of the networks, build the '
+                             'network partition with NetworkPartition.from_excel, or '
+                             'NetworkPartition.from_networks_dictionary.')
+    else:
+        networks_dictionnary = fetch_atlas_functional_network(
+            atlas_excel_file=atlas_information_xlsx_file,
+            sheetname=sheetname, network_column_name=network_column_name)
 
     # Load the atlas to get the shape and affine of images
     atlas4d = image.load_img(reference_4datlas)
-    atlas4d_array = atlas4d.get_data()
+    atlas4d_array = np.asanyarray(atlas4d.dataobj)
     atlas_affine = atlas4d.affine
     atlas_shape = atlas4d.shape[:3]
 
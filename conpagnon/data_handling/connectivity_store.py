@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Array backed storage of the subjects connectivity matrices.
+
+The connectivity matrices of each kind are stored in one contiguous
+array of shape (number of subjects, number of edges), holding the packed
+lower triangle of the matrices, diagonal included, in the order of
+np.tril_indices. The subjects of a group occupy contiguous rows, so that
+the matrices of a group are views of the store arrays. The store behave
+like the nested dictionary returned by individual_connectivity_matrices,
+organised by group, subject and kind, for the existing scripts.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+from collections.abc import Mapping
+import copy
+import numpy as np
+from conpagnon.utils import array_operation
+
+
+# The subjects dictionary keys which are not connectivity kinds
+NOT_KIND_KEYS = ['masked_array', 'diagonal_mask', 'discarded_rois']
+
+
+class ConnectivityStore(Mapping):
+    """Subjects connectivity matrices stored as (subjects x edges) arrays.
+
+    Parameters
+    ----------
+    subjects: list
+        The list of (group, subject identifier) tuples, in the order of the
+        rows of the arrays. The subjects of a group must be contiguous.
+    kinds_arrays: dict
+        The kinds as keys, and the packed lower triangle of the subjects
+        connectivity matrices as values, in arrays of shape (number of subjects,
+        number of regions * (number of regions + 1) / 2).
+    rois_masks: numpy.array of shape (number of subjects, number of regions), optional
+        The compact masks of the subjects: True for the discarded rois. A
+        coefficient is masked if its row or its column is discarded.
+    edges_masks: numpy.array of shape (number of subjects, number of edges), optional
+        The masks of the subjects, for the packed lower triangle, when they
+        can't be described by discarded rois. If both masks are None, no
+        coefficient is masked.
+
+    Notes
+    -----
+    Indexing the store with a group returns a read-only mapping of the
+    subjects of the group, and indexing it with a subject returns a mapping
+    with the kinds, 'masked_array' and 'diagonal_mask' keys, like the
+    dictionary of individual_connectivity_matrices. The matrices are views of the
+    store arrays, in a PackedSymmetricMatrix.
+    """
+
+    def __init__(self, subjects, kinds_arrays, rois_masks=None, edges_masks=None):
+        self.subjects = [tuple(subject) for subject in subjects]
+        self.kinds_arrays = dict(kinds_arrays)
+        self.kinds = list(self.kinds_arrays.keys())
+        if not self.kinds:
+            raise ValueError('A connectivity store needs at least one kind.')
+        number_of_coefficients = self.kinds_arrays[self.kinds[0]].shape[-1]
+        self.number_of_regions = array_operation.PackedSymmetricMatrix(
+            np.empty(number_of_coefficients)).number_of_regions
+        for kind, kind_array in self.kinds_arrays.items():
+            if kind_array.shape != (len(self.subjects), number_of_coefficients):
+                raise ValueError('The array of kind {} has shape {}, expected {}.'.format(
+                    kind, kind_array.shape, (len(self.subjects), number_of_coefficients)))
+
+        if rois_masks is None and edges_masks is None:
+            rois_masks = np.zeros((len(self.subjects), self.number_of_regions), dtype=bool)
+        self.rois_masks = rois_masks
+        self.edges_masks = edges_masks
+
+        # The rows of each group
+        self.groups = []
+        self.group_slices = {}
+        for row, (group, _) in enumerate(self.subjects):
+            if not self.groups or self.groups[-1] != group:
+                if group in self.group_slices:
+                    raise ValueError('The subjects of group {} are not contiguous.'.format(group))
+                self.groups.append(group)
+                self.group_slices[group] = slice(row, row + 1)
+            else:
+                self.group_slices[group] = slice(self.group_slices[group].start, row + 1)
+
+    @classmethod
+    def from_dictionary(cls, subjects_connectivity_matrices, kinds=None, groupes=None, dtype=None):
+        """Build a store from a subjects connectivity matrices dictionary.
+
+        Parameters
+        ----------
+        subjects_connectivity_matrices: dict
+            The subjects connectivity matrices dictionary, organised by group,
+            subject and kind, with matrices of shape (number of regions, number
+            of regions), dense or packed.
+        kinds: list, optional
+            The kinds to store. Default is None, all the kinds of the dictionary.
+        groupes: list, optional
+            The groups to store. Default is None, all the groups.
+        dtype: numpy.dtype, optional
+            The storage data type, like numpy.float32. Default is None,
+            the data type of the matrices.
+
+        Returns
+        -------
+        output: ConnectivityStore
+            The connectivity store.
+        """
+        if groupes is None:
+            groupes = list(subjects_connectivity_matrices.keys())
+        subjects = [(group, subject) for group in groupes for subject in subjects_connectivity_matrices[group].keys()]
+        if not subjects:
+            raise ValueError('No subjects found in the connectivity matrices dictionary.')
+        first_subject = subjects_connectivity_matrices[subjects[0][0]][subjects[0][1]]
+        if kinds is None:
+            kinds = [key for key in first_subject.keys() if key not in NOT_KIND_KEYS and
+                     not str(key).endswith('_diagonal')]
+
+        number_of_regions = np.shape(first_subject[kinds[0]])[-1]
+        for kind in kinds:
+            if np.ndim(first_subject[kind]) != 2:
+                raise ValueError('The connectivity matrices of kind {} should have shape (number of regions, '
+                                 'number of regions), vectorized matrices are not accepted.'.format(kind))
+        rows, columns = array_operation.lower_triangle_indices(number_of_regions)
+
+        kinds_arrays = {}
+        for kind in kinds:
+            kind_dtype = dtype if dtype is not None else np.result_type(first_subject[kind].dtype)
+            kind_array = np.empty((len(subjects), rows.size), dtype=kind_dtype)
+            for row, (group, subject) in enumerate(subjects):
+                subject_matrix = subjects_connectivity_matrices[group][subject][kind]
+                if isinstance(subject_matrix, array_operation.PackedSymmetricMatrix):
+                    kind_array[row] = subject_matrix.lower_triangle
+                else:
+                    kind_array[row] = subject_matrix[rows, columns]
+            kinds_arrays[kind] = kind_array
+
+        # The masks are kept compact as long as they are masks of discarded rois
+        rois_masks = np.zeros((len(subjects), number_of_regions), dtype=bool)
+        subjects_edges_masks = {}
+        for row, (group, subject) in enumerate(subjects):
+            subject_mask = subjects_connectivity_matrices[group][subject].get('masked_array')
+            if subject_mask is None:
+                continue
+            if isinstance(subject_mask, array_operation.DiscardedRoisMask) and not subject_mask.vectorized:
+                rois_masks[row] = subject_mask.rois_mask
+            elif isinstance(subject_mask, array_operation.PackedSymmetricMatrix):
+                subjects_edges_masks[row] = subject_mask.lower_triangle.astype(bool)
+            else:
+                subject_mask = np.asarray(subject_mask, dtype=bool)
+                if subject_mask.shape != (number_of_regions, number_of_regions):
+                    raise ValueError('The mask of subject {} has shape {}, vectorized masks are '
+                                     'not accepted.'.format(subject, subject_mask.shape))
+                subject_rois_mask = subject_mask.diagonal()
+                if np.array_equal(subject_mask, subject_rois_mask[:, np.newaxis] | subject_rois_mask[np.newaxis, :]):
+                    rois_masks[row] = subject_rois_mask
+                else:
+                    subjects_edges_masks[row] = subject_mask[rows, columns]
+        edges_masks = None
+        if subjects_edges_masks:
+            edges_masks = rois_masks[:, rows] | rois_masks[:, columns]
+            for row, subject_edges_mask in subjects_edges_masks.items():
+                edges_masks[row] = subject_edges_mask
+            rois_masks = None
+
+        return cls(subjects=subjects, kinds_arrays=kinds_arrays, rois_masks=rois_masks, edges_masks=edges_masks)
+
+    def rows(self, group=None):
+        """The rows of a group in the store arrays, a slice, all the rows if group is None."""
+        if group is None:
+            return slice(0, len(self.subjects))
+        return self.group_slices[group]
+
+    def group_subjects(self, group):
+        """The list of the subjects identifiers of a group."""
+        return [subject for _, subject in self.subjects[self.rows(group)]]
+
+    def subjects_rows(self, subjects):
+        """The rows of a list of subjects identifiers.
+
+        The first row of a subject identifier is returned if it appears in
+        several groups.
+        """
+        subjects_positions = {}
+        for row, (_, subject) in enumerate(self.subjects):
+            subjects_positions.setdefault(subject, row)
+        return np.array([subjects_positions[subject] for subject in subjects], dtype=int)
+
+    def group_labels(self):
+        """The position of the group of each subject, in the order of the groups attribute."""
+        return np.repeat(np.arange(len(self.groups)),
+                         [self.group_slices[group].stop - self.group_slices[group].start for group in self.groups])
+
+    @property
+    def number_of_subjects(self):
+        return len(self.subjects)
+
+    def kind_array(self, kind, group=None):
+        """The packed lower triangles of a kind, a view of shape (number of subjects, number of edges)."""
+        return self.kinds_arrays[kind][self.rows(group)]
+
+    def stacked(self, kind, group=None):
+        """The stacked matrices of a kind, a PackedSymmetricMatrix view of the store."""
+        return array_operation.PackedSymmetricMatrix(lower_triangle=self.kind_array(kind, group))
+
+    def masks(self, group=None, positions=None):
+        """The masks of the packed lower triangles, of shape (number of subjects, number of edges).
+
+        Only the edges at the given positions of the packed lower triangle are
+        returned, if positions is not None.
+        """
+        if self.edges_masks is not None:
+            group_masks = self.edges_masks[self.rows(group)]
+            return group_masks if positions is None else group_masks[:, positions]
+        rows, columns = array_operation.lower_triangle_indices(self.number_of_regions)
+        if positions is not None:
+            rows, columns = rows[positions], columns[positions]
+        rois_masks = self.rois_masks[self.rows(group)]
+        return rois_masks[:, rows] | rois_masks[:, columns]
+
+    def stacked_masks(self, group=None):
+        """The stacked masks, a PackedSymmetricMatrix of boolean."""
+        return array_operation.PackedSymmetricMatrix(lower_triangle=self.masks(group))
+
+    def subject_mask(self, row):
+        """The mask of the subject of a row, a DiscardedRoisMask when the masks are compact."""
+        if self.edges_masks is not None:
+            return array_operation.PackedSymmetricMatrix(lower_triangle=self.edges_masks[row])
+        return array_operation.DiscardedRoisMask(discarded_rois=np.flatnonzero(self.rois_masks[row]),
+                                                 number_of_regions=self.number_of_regions)
+
+    def features(self, kind, group=None, discard_diagonal=True):
+        """The vectorized matrices of a kind, like sym_matrix_to_vec.
+
+        Parameters
+        ----------
+        kind: str
+            The kind.
+        group: str, optional
+            The group. Default is None, all the subjects.
+        discard_diagonal: bool, optional
+            If True, the diagonal is discarded. Else the diagonal coefficients
+            are divided by sqrt(2). Default is True.
+
+        Returns
+        -------
+        output: numpy.array, shape (number of subjects, number of features)
+            The features array.
+        """
+        return self.stacked(kind, group).vectorize(discard_diagonal=discard_diagonal)
+
+    def set_features(self, kind, features, group=None, discard_diagonal=True):
+        """Overwrite the coefficients of a kind with vectorized matrices.
+
+        Parameters
+        ----------
+        kind: str
+            The kind.
+        features: numpy.array, shape (number of subjects, number of features)
+            The vectorized matrices, in the order of sym_matrix_to_vec.
+        group: str, optional
+            The group. Default is None, all the subjects.
+        discard_diagonal: bool, optional
+            If True, the features don't contain the diagonal, which is left
+            unchanged. Default is True.
+        """
+        kind_array = self.kind_array(kind, group)
+        if discard_diagonal:
+            kind_array[:, array_operation.packed_triangle_positions(self.number_of_regions, True)] = features
+        else:
+            kind_array[...] = features
+            kind_array[:, array_operation.packed_triangle_positions(self.number_of_regions)] *= np.sqrt(2.)
+
+    def group_view(self, group):
+        """A store of the subjects of one group, whose arrays are views of this store."""
+        group_rows = self.rows(group)
+        return ConnectivityStore(
+            subjects=self.subjects[group_rows],
+            kinds_arrays={kind: kind_array[group_rows] for kind, kind_array in self.kinds_arrays.items()},
+            rois_masks=self.rois_masks[group_rows] if self.rois_masks is not None else None,
+            edges_masks=self.edges_masks[group_rows] if self.edges_masks is not None else None)
+
+    def take_regions(self, regions_index):
+        """A store of the sub-matrices of a subset of regions.
+
+        Parameters
+        ----------
+        regions_index: list, numpy.array or SubMatrixIndex
+            The index of the regions, in the order of the rows of the sub-matrices,
+            or their precomputed SubMatrixIndex.
+
+        Returns
+        -------
+        output: ConnectivityStore
+            The store of the sub-matrices of all the subjects, each kind being
+            extracted with one fancy index on the store array, and the compact
+            masks being kept compact.
+        """
+        if not isinstance(regions_index, array_operation.SubMatrixIndex):
+            regions_index = array_operation.SubMatrixIndex(regions_index)
+        positions = regions_index.positions()
+        return ConnectivityStore(
+            subjects=self.subjects,
+            kinds_arrays={kind: kind_array[:, positions] for kind, kind_array in self.kinds_arrays.items()},
+            rois_masks=self.rois_masks[:, regions_index.regions_index] if self.rois_masks is not None else None,
+            edges_masks=self.edges_masks[:, positions] if self.edges_masks is not None else None)
+
+    def copy(self):
+        """A deep copy of the store."""
+        return copy.deepcopy(self)
+
+    def to_dictionary(self, storage='dense'):
+        """Convert the store into a subjects connectivity matrices dictionary.
+
+        Parameters
+        ----------
+        storage: str, optional
+            The storage of the connectivity matrices, 'dense' or 'packed'.
+            Default is 'dense'.
+
+        Returns
+        -------
+        output: dict
+            The subjects connectivity matrices dictionary, organised by
+            group, subject, and kind, with a 'masked_array' and a
+            'diagonal_mask' key for each subject.
+        """
+        subjects_connectivity_matrices = {group: {} for group in self.groups}
+        for row, (group, subject) in enumerate(self.subjects):
+            subject_dictionary = {}
+            for kind in self.kinds:
+                packed_matrix = array_operation.PackedSymmetricMatrix(lower_triangle=self.kinds_arrays[kind][row].copy())
+                subject_dictionary[kind] = packed_matrix if storage == 'packed' else packed_matrix.dense()
+            subject_dictionary['masked_array'] = self.subject_mask(row)
+            subject_dictionary['diagonal_mask'] = np.asarray(self.subject_mask(row).diagonal(), dtype=bool)
+            subjects_connectivity_matrices[group][subject] = subject_dictionary
+
+        return subjects_connectivity_matrices
+
+    def __getitem__(self, group):
+        if group not in self.group_slices:
+            raise KeyError(group)
+        return GroupConnectivityView(store=self, group=group)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __repr__(self):
+        return 'ConnectivityStore(groups={}, subjects={}, kinds={}, number_of_regions={})'.format(
+            self.groups, len(self.subjects), self.kinds, self.number_of_regions)
+
+
+class GroupConnectivityView(Mapping):
+    """Read-only mapping of the subjects of a group in a ConnectivityStore."""
+
+    def __init__(self, store, group):
+        self.store = store
+        self.group = group
+        group_rows = store.rows(group)
+        self.subjects_rows = {subject: row for row, (_, subject) in
+                              enumerate(store.subjects[group_rows], start=group_rows.start)}
+
+    def __getitem__(self, subject):
+        return SubjectConnectivityView(store=self.store, row=self.subjects_rows[subject])
+
+    def __iter__(self):
+        return iter(self.subjects_rows)
+
+    def __len__(self):
+        return len(self.subjects_rows)
+
+
+class SubjectConnectivityView(Mapping):
+    """Read-only mapping of the connectivity matrices of a subject in a ConnectivityStore."""
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        if key == 'masked_array':
+            return self.store.subject_mask(self.row)
+        if key == 'diagonal_mask':
+            return np.asarray(self.store.subject_mask(self.row).diagonal(), dtype=bool)
+        if key not in self.store.kinds_arrays:
+            raise KeyError(key)
+        return array_operation.PackedSymmetricMatrix(lower_triangle=self.store.kinds_arrays[key][self.row])
+
+    def __iter__(self):
+        return iter(self.store.kinds + ['masked_array', 'diagonal_mask'])
+
+    def __len__(self):
+        return len(self.store.kinds) + 2
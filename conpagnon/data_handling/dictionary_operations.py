@@ -88,7 +88,9 @@ def random_draw_of_connectivity_matrices(subjects_connectivity_dictionary, group
         instance used by `np.random`.
     extract_kwargs: dict, optional
         A dictionnary of argument passed to extract_sub_connectivity_matrices
-        function. Default is None
+        function, with at least the 'kinds' and 'regions_index' keys. For repeated
+        draws, a SubMatrixIndex of the regions, computed once, can be passed as
+        'regions_index'. Default is None
 
     Returns
     -------
@@ -119,12 +121,8 @@ def random_draw_of_connectivity_matrices(subjects_connectivity_dictionary, group
     # if we want specific sub-matrices we extract them
     # extract sub connectivity matrices function
     if extract_kwargs is not None:
-        random_dictionary = ccm.extract_sub_connectivity_matrices(
-            subjects_connectivity_matrices=random_dictionary,
-            kinds=extract_kwargs['kinds'],
-            regions_index=extract_kwargs['regions_index'],
-            vectorize=extract_kwargs['vectorize'],
-            discard_diagonal=extract_kwargs['discard_diagonal'])
+        random_dictionary = ccm.extract_sub_connectivity_matrices(subjects_connectivity_matrices=random_dictionary,
+                                                                  **extract_kwargs)
 
     return random_dictionary, random_draw_subjects_id
 
@@ -167,6 +165,9 @@ def stack_subjects_connectivity_matrices(subjects_connectivity_dictionary, group
     """Re-arrange the subjects connectivity dictionary to return a stack version per group
     and kind.
 
+    A ConnectivityStore is also accepted as subjects connectivity dictionary, the
+    subjects matrices being packed views of the store arrays.
+
     :param subjects_connectivity_dictionary:
     :param groupes:
     :param kinds:
@@ -0,0 +1,54 @@
+import numpy as np
+import nibabel as nb
+from nilearn.input_data import NiftiMapsMasker
+from conpagnon.computing import signal_extraction
+
+"""
+Check of the maps projection engine: the raw regions signals of the 'sparse'
+extraction method are compared with the signals of the nilearn
+NiftiMapsMasker, on overlapping, ill conditioned, probabilistic maps, with an
+empty map. With a linearly dependent map, the signals are compared with the
+minimum norm least-squares solution of numpy.linalg.lstsq.
+
+"""
+
+rng = np.random.RandomState(0)
+grid_shape = (12, 12, 12)
+affine = np.eye(4)
+n_time_points = 50
+
+# Overlapping gaussian blobs, whose centers are close to each other
+grid = np.indices(grid_shape).reshape(3, -1).T
+centers = [(5, 5, 5), (5.5, 5, 5), (5, 5.5, 5.5), (7, 7, 7), (7, 6.5, 7)]
+maps = np.array([np.exp(-np.sum((grid - center) ** 2, axis=1) / 40.) for center in centers]).T
+maps[maps < 1e-3] = 0
+# An empty map
+maps = np.column_stack([maps, np.zeros(maps.shape[0])])
+maps_img = nb.Nifti1Image(maps.reshape(grid_shape + (maps.shape[1], )), affine)
+
+functional_data = rng.randn(*(grid_shape + (n_time_points, )))
+functional_img = nb.Nifti1Image(functional_data, affine)
+
+# Raw signals of the projection engine, read in several time blocks
+projection_operator = signal_extraction.maps_projection_operator(maps_img)
+engine_signals = signal_extraction.raw_regions_signals(img=functional_img, projection_operator=projection_operator,
+                                                       time_block_size=16)
+
+# Raw signals of the nilearn masker
+masker = NiftiMapsMasker(maps_img=maps_img, standardize=False, detrend=False, keep_masked_maps=True)
+masker_signals = masker.fit_transform(functional_img)
+
+print('Condition number of the maps: {}'.format(np.linalg.cond(maps[:, :5])))
+print('Maximum absolute difference with NiftiMapsMasker: {}'.format(np.abs(engine_signals - masker_signals).max()))
+assert np.allclose(engine_signals, masker_signals, rtol=1e-8, atol=1e-10)
+
+# A linear combination of two maps: the least-squares solution is not unique
+dependent_maps = np.column_stack([maps, maps[:, 0] + 0.5 * maps[:, 1]])
+dependent_maps_img = nb.Nifti1Image(dependent_maps.reshape(grid_shape + (dependent_maps.shape[1], )), affine)
+dependent_operator = signal_extraction.maps_projection_operator(dependent_maps_img)
+dependent_signals = signal_extraction.raw_regions_signals(img=functional_img, projection_operator=dependent_operator,
+                                                          time_block_size=16)
+minimum_norm_signals = np.linalg.lstsq(dependent_maps, functional_data.reshape(-1, n_time_points), rcond=None)[0].T
+print('Maximum absolute difference with the minimum norm solution: {}'.format(
+    np.abs(dependent_signals - minimum_norm_signals).max()))
+assert np.allclose(dependent_signals, minimum_norm_signals, rtol=1e-8, atol=1e-10)
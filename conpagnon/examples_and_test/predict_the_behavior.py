@@ -97,7 +97,8 @@ intra_network_connectivity_dict, network_dict, network_labels_list, network_labe
         sheetname=sheetname,
         roi_indices_column_name='atlas4D index',
         network_column_name='network',
-        color_of_network_column='Color')
+        color_of_network_column='Color',
+        return_network_arrays=True)
 homotopic_intra_network_connectivity = dict.fromkeys(network_name)
 
 for network in network_name:
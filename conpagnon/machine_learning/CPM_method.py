@@ -16,6 +16,7 @@ from scipy.stats import t
 import statsmodels.api as sm
 from conpagnon.connectivity_statistics.parametric_tests import partial_corr
 from sklearn.model_selection import LeaveOneOut
+from conpagnon.utils.array_operation import features_array
 
 """
 This module contain useful function for the connectome predictive modelling algorithm.
@@ -184,7 +185,9 @@ def predict_behavior(vectorized_connectivity_matrices, behavioral_scores,
     ----------
     vectorized_connectivity_matrices: numpy.array, shape (n_sample, n_features)
         The subjects connectivity matrices in a vectorized form, i.e, you must
-        give a array of shape (n_subjects, 0.5*n_features*(n_features-1)).
+        give a array of shape (n_subjects, 0.5*n_features*(n_features-1)). A stack
+        of packed connectivity matrices, see PackedSymmetricMatrix, is vectorized
+        discarding the diagonal.
     behavioral_scores: pandas.DataFrame or numpy.array of shape(n_subjects, 1)
         The behavioral scores in a pandas DataFrame or numpy array form. Off course
         the behavioral scores should ordered in the same order of subjects matrices.
@@ -217,6 +220,8 @@ def predict_behavior(vectorized_connectivity_matrices, behavioral_scores,
 
 
     """
+    # A stack of packed connectivity matrices is vectorized, discarding the diagonal
+    vectorized_connectivity_matrices = features_array(vectorized_connectivity_matrices)
     # Initialize leave one out object
     leave_one_out_generator = LeaveOneOut()
 
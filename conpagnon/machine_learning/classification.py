@@ -11,6 +11,8 @@ from sklearn.model_selection import cross_val_score, StratifiedShuffleSplit
 from sklearn.svm import LinearSVC
 import matplotlib.pylab as plt
 import seaborn as sns
+from conpagnon.utils.array_operation import features_array
+from conpagnon.data_handling import connectivity_store
 
 
 def two_groups_classification(pooled_groups_connectivity_matrices, kinds, labels, n_splits, test_size,train_size, C=1.0,
@@ -29,6 +31,10 @@ def two_groups_classification(pooled_groups_connectivity_matrices, kinds, labels
              - The second key is the different kinds you want to test
              for classification. The values are simply the stacked connectivity
              matrices as a ndarray of shape (..., number of regions, number of regions)
+             A stack of packed connectivity matrices, see PackedSymmetricMatrix, is
+             vectorized discarding the diagonal.
+             A ConnectivityStore is also accepted, its matrices are vectorized
+             discarding the diagonal, in the order of its subjects.
     kinds : list
         The different kind you want to test for classification.
     labels : numpy.array of shape (number of subjects)
@@ -122,7 +128,11 @@ def two_groups_classification(pooled_groups_connectivity_matrices, kinds, labels
         svc = LinearSVC(random_state=random_state, penalty=penalty, loss=loss, fit_intercept=fit_intercept, C=C,
                         dual = dual, max_iter = max_iter)
         # On estime les parametres du model et on calcules les scores pour chaque fold par cross-validation
-        cv_scores = cross_val_score(estimator = svc, X = pooled_groups_connectivity_matrices[kind], y = labels, cv = cv, scoring = scoring)
+        if isinstance(pooled_groups_connectivity_matrices, connectivity_store.ConnectivityStore):
+            X = pooled_groups_connectivity_matrices.features(kind=kind)
+        else:
+            X = features_array(pooled_groups_connectivity_matrices[kind])
+        cv_scores = cross_val_score(estimator = svc, X = X, y = labels, cv = cv, scoring = scoring)
         # On calcule la moyenne selon les k-fold et on empile dans mean_scores:
         mean_scores.append(cv_scores.mean())
         mean_score_dict[kind] = cv_scores.mean()
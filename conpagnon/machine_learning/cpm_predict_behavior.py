@@ -3,6 +3,7 @@ from patsy import dmatrix
 from sklearn.model_selection import LeaveOneOut
 from scipy import stats
 import pandas as pd
+from conpagnon.utils.array_operation import features_array
 from conpagnon.machine_learning.CPM_method import predictors_selection_linear_model, fit_model_on_training_set, \
     compute_summary_subjects_summary_values, predictors_selection_correlation, predictor_selection_pcorrelation
 
@@ -20,7 +21,8 @@ def predict_behavior(vectorized_connectivity_matrices, behavioral_scores,
     vectorized_connectivity_matrices: numpy.array of shape (n_subjects, n_features)
         The stack of the vectorized (lower or upper triangle of the connectivity matrices)
         connectivity matrices. Be careful, the matrices should be stack in the same order
-        as the vector of scores to predict !
+        as the vector of scores to predict ! A stack of packed connectivity matrices,
+        see PackedSymmetricMatrix, is vectorized discarding the diagonal.
     behavioral_scores: numpy.array of shape (n_subject, 1)
         The vector of scores to predict. The scores should be in the same
         order as the vectorized connectivity matrices stack.
@@ -50,6 +52,8 @@ def predict_behavior(vectorized_connectivity_matrices, behavioral_scores,
         from the negatively correlated set of features.
 
     """
+    # A stack of packed connectivity matrices is vectorized, discarding the diagonal
+    vectorized_connectivity_matrices = features_array(vectorized_connectivity_matrices)
     # Initialize leave one out object
     leave_one_out_generator = LeaveOneOut()
 
@@ -26,7 +26,7 @@ import time
 from scipy.stats import norm
 from statsmodels.stats.multitest import multipletests
 from sklearn.multiclass import OneVsRestClassifier
-from conpagnon.utils.array_operation import array_rebuilder
+from conpagnon.utils.array_operation import array_rebuilder, features_array
 from conpagnon.utils.folders_and_files_management import save_object
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
@@ -702,6 +702,8 @@ def compute_weight_distribution(vectorized_connectivity_matrices,
                                 verbose_bootstrap=1,
                                 verbose_permutations=1):
 
+    # A stack of packed connectivity matrices is vectorized, discarding the diagonal
+    vectorized_connectivity_matrices = features_array(vectorized_connectivity_matrices)
     # Number of subjects
     n_subjects = vectorized_connectivity_matrices.shape[0]
 
@@ -792,6 +794,8 @@ def discriminative_brain_connection_identification(vectorized_connectivity_matri
                                                    C=1):
     """Identify important connection when performing a binary classification task.
     """
+    # A stack of packed connectivity matrices is vectorized, discarding the diagonal
+    vectorized_connectivity_matrices = features_array(vectorized_connectivity_matrices)
     # Number of subjects
     n_subjects = vectorized_connectivity_matrices.shape[0]
 
@@ -6,6 +6,7 @@ from sklearn.model_selection import LeaveOneOut
 from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVR
 import numpy as np
+from conpagnon.utils.array_operation import features_array
 from scipy.stats import pearsonr
 import scipy.special as special
 from sklearn.linear_model import Ridge
@@ -39,6 +40,8 @@ def predict_scores(connectivity_matrices, raw_score,
                    with_mean=False,
                    with_std=False):
 
+    # A stack of packed connectivity matrices is vectorized, discarding the diagonal
+    connectivity_matrices = features_array(connectivity_matrices)
     sc = StandardScaler(with_std=with_std, with_mean=with_mean)
     # Store the score prediction for each subject
     score_pred = []
@@ -18,6 +18,648 @@ import nibabel as nb
 import glob
 import os
 from math import sqrt
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from functools import lru_cache
+
+
+@lru_cache(maxsize=32)
+def lower_triangle_indices(number_of_regions, discard_diagonal=False):
+    """Compute the row and column indices of the lower triangle of a square array.
+
+    Parameters
+    ----------
+    number_of_regions: int
+        The number of rows of the square array.
+    discard_diagonal: bool, optional
+        If True, the diagonal is excluded. Default is False.
+
+    Returns
+    -------
+    output 1: numpy.array
+        The row indices.
+    output 2: numpy.array
+        The column indices.
+
+    Notes
+    -----
+    The indices follow the order of nilearn.connectome.sym_matrix_to_vec,
+    and are computed once for each number of regions. The returned arrays
+    are read-only.
+    """
+    rows, columns = np.tril_indices(number_of_regions, k=-1 if discard_diagonal else 0)
+    rows.flags.writeable = False
+    columns.flags.writeable = False
+
+    return rows, columns
+
+
+class DiscardedRoisMask(NDArrayOperatorsMixin):
+    """Compact boolean mask of the connectivity coefficients involving discarded rois.
+
+    Only the discarded rois index are stored. The mask behave like the dense
+    boolean array, of shape (number of regions, number of regions), or of the
+    vectorized shape, it stands for: the dense array is only built when it
+    is needed, from cached index arithmetic, and kept for further use.
+
+    Parameters
+    ----------
+    discarded_rois: numpy.array
+        The index of the discarded rois.
+    number_of_regions: int
+        The number of regions.
+    vectorized: bool, optional
+        If True, the mask stands for the vectorized lower triangle of the
+        connectivity matrices, in the order of sym_matrix_to_vec.
+        Default is False.
+    discard_diagonal: bool, optional
+        If True, and the mask is vectorized, the diagonal is excluded
+        from the lower triangle. Default is False.
+
+    Notes
+    -----
+    The mask is True for a coefficient in the row or the column of a
+    discarded roi, like the masks built by create_connectivity_mask
+    in older versions. The numpy functions, the arithmetic and comparison
+    operators, indexing, and the other attributes of numpy arrays, like
+    reshape or nonzero, act on the dense array. The mask is read-only:
+    numpy.array(mask), or mask.copy(), returns a writable dense array.
+    """
+
+    __array_priority__ = 10.
+
+    def __init__(self, discarded_rois, number_of_regions, vectorized=False, discard_diagonal=False):
+        self.discarded_rois = np.unique(np.asarray(discarded_rois, dtype=int))
+        self.number_of_regions = int(number_of_regions)
+        self.vectorized = vectorized
+        self.discard_diagonal = discard_diagonal and vectorized
+        self._dense = None
+
+    @property
+    def rois_mask(self):
+        """The boolean array of shape (number of regions, ), True for the discarded rois."""
+        rois_mask = np.zeros(self.number_of_regions, dtype=bool)
+        rois_mask[self.discarded_rois] = True
+        return rois_mask
+
+    @property
+    def shape(self):
+        if not self.vectorized:
+            return self.number_of_regions, self.number_of_regions
+        n = self.number_of_regions
+        return (n * (n - 1) // 2 if self.discard_diagonal else n * (n + 1) // 2),
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return np.dtype(bool)
+
+    @property
+    def T(self):
+        # The mask matrix is symmetric
+        return self
+
+    def diagonal(self):
+        """The diagonal of the mask matrix."""
+        return self.rois_mask
+
+    def matrix(self):
+        """The mask in the matrix form, as a compact mask."""
+        return DiscardedRoisMask(discarded_rois=self.discarded_rois, number_of_regions=self.number_of_regions)
+
+    def vectorize(self, discard_diagonal=False):
+        """The mask in the vectorized form, as a compact mask."""
+        return DiscardedRoisMask(discarded_rois=self.discarded_rois, number_of_regions=self.number_of_regions,
+                                 vectorized=True, discard_diagonal=discard_diagonal)
+
+    def take_rois(self, rois_index):
+        """The compact mask restricted to a subset of regions, in the given order."""
+        rois_index = np.asarray(rois_index)
+        return DiscardedRoisMask(discarded_rois=np.flatnonzero(self.rois_mask[rois_index]),
+                                 number_of_regions=rois_index.size, vectorized=self.vectorized,
+                                 discard_diagonal=self.discard_diagonal)
+
+    def dense(self):
+        """Build the dense boolean array, once. The cached array is read-only."""
+        if self._dense is None:
+            rois_mask = self.rois_mask
+            if self.vectorized:
+                rows, columns = lower_triangle_indices(self.number_of_regions, self.discard_diagonal)
+                self._dense = rois_mask[rows] | rois_mask[columns]
+            else:
+                self._dense = rois_mask[:, np.newaxis] | rois_mask[np.newaxis, :]
+            self._dense.setflags(write=False)
+        return self._dense
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.dense()
+        if dtype is not None:
+            return dense.astype(dtype)
+        # The cached dense array is protected from in-place modifications
+        return dense.copy()
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # The ufuncs, and the arithmetic and comparison operators, act on the dense array
+        inputs = tuple(np.asarray(value) if isinstance(value, DiscardedRoisMask) else value for value in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(value) if isinstance(value, DiscardedRoisMask) else value
+                                  for value in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, item):
+        if isinstance(item, DiscardedRoisMask):
+            item = item.dense()
+        return self.dense()[item]
+
+    def __setitem__(self, item, value):
+        raise TypeError('A DiscardedRoisMask is read-only, build the dense boolean '
+                        'array with numpy.array(mask) to modify it.')
+
+    def __iter__(self):
+        return iter(self.dense())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __bool__(self):
+        return bool(self.dense())
+
+    def __getattr__(self, name):
+        # The other attributes of the dense array, like reshape or nonzero, the
+        # dense array being read-only
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.dense(), name)
+
+    def __invert__(self):
+        return np.invert(self.dense())
+
+    def copy(self):
+        """A writable copy of the dense boolean array."""
+        return self.dense().copy()
+
+    def flatten(self):
+        return self.dense().flatten()
+
+    def ravel(self):
+        return self.dense().ravel()
+
+    def reshape(self, *shape, **kwargs):
+        return self.dense().reshape(*shape, **kwargs)
+
+    def any(self, *args, **kwargs):
+        if not args and not kwargs:
+            return bool(self.discarded_rois.size)
+        return self.dense().any(*args, **kwargs)
+
+    def all(self, *args, **kwargs):
+        return self.dense().all(*args, **kwargs)
+
+    def sum(self, *args, **kwargs):
+        return self.dense().sum(*args, **kwargs)
+
+    def astype(self, dtype):
+        return self.dense().astype(dtype)
+
+    def __repr__(self):
+        return 'DiscardedRoisMask(discarded_rois={}, number_of_regions={}, vectorized={}, ' \
+               'discard_diagonal={})'.format(list(self.discarded_rois), self.number_of_regions,
+                                             self.vectorized, self.discard_diagonal)
+
+
+@lru_cache(maxsize=32)
+def packed_triangle_positions(number_of_regions, discard_diagonal=False):
+    """Compute the positions of the lower triangle coefficients in a packed lower triangle.
+
+    Parameters
+    ----------
+    number_of_regions: int
+        The number of rows of the square array.
+    discard_diagonal: bool, optional
+        If True, the positions of the coefficients below the diagonal are
+        returned, and the positions of the diagonal coefficients else.
+        Default is False.
+
+    Returns
+    -------
+    output: numpy.array
+        The positions in the packed lower triangle, in the order of
+        sym_matrix_to_vec, diagonal included.
+    """
+    rows = np.arange(number_of_regions)
+    diagonal_positions = rows * (rows + 3) // 2
+    if discard_diagonal:
+        positions = np.delete(np.arange(number_of_regions * (number_of_regions + 1) // 2), diagonal_positions)
+    else:
+        positions = diagonal_positions
+    positions.setflags(write=False)
+
+    return positions
+
+
+def packed_index(rows, columns):
+    """Compute the positions of symmetric matrices coefficients in the packed lower triangle.
+
+    Parameters
+    ----------
+    rows: int or numpy.array
+        The rows of the coefficients.
+    columns: int or numpy.array
+        The columns of the coefficients.
+
+    Returns
+    -------
+    output: int or numpy.array
+        The positions of the coefficients, or of their symmetric, in the
+        packed lower triangle, in the order of np.tril_indices.
+    """
+    rows, columns = np.asarray(rows), np.asarray(columns)
+    lower_rows, lower_columns = np.maximum(rows, columns), np.minimum(rows, columns)
+
+    return lower_rows * (lower_rows + 1) // 2 + lower_columns
+
+
+class PackedSymmetricMatrix(object):
+    """Symmetric matrices stored as their lower triangle.
+
+    Only the lower triangle, diagonal included, of the matrices is stored,
+    possibly in single precision, in the row major order of np.tril_indices.
+    The packed matrices behave like the dense arrays of shape (..., number of
+    regions, number of regions) they stand for: the dense array is built when
+    it is needed, at plotting or export time, and the vectorization of
+    sym_matrix_to_vec reads the packed triangle directly.
+
+    Parameters
+    ----------
+    lower_triangle: numpy.array, shape (..., number of regions * (number of regions + 1) / 2)
+        The packed lower triangle of one matrix, or of a stack of matrices.
+
+    Notes
+    -----
+    For a 1000 regions atlas, a packed matrix in single precision is four
+    times lighter than the dense matrix in double precision.
+    """
+
+    __array_priority__ = 10.
+
+    def __init__(self, lower_triangle):
+        self.lower_triangle = np.asarray(lower_triangle)
+        number_of_coefficients = self.lower_triangle.shape[-1]
+        number_of_regions = int((sqrt(8 * number_of_coefficients + 1) - 1) / 2)
+        if number_of_regions * (number_of_regions + 1) // 2 != number_of_coefficients:
+            raise ValueError('A packed lower triangle of {} coefficients does not stand for '
+                             'a square matrix.'.format(number_of_coefficients))
+        self.number_of_regions = number_of_regions
+
+    @classmethod
+    def from_dense(cls, symmetric_array, dtype=None):
+        """Pack the lower triangle of symmetric arrays.
+
+        Parameters
+        ----------
+        symmetric_array: numpy.array, shape (..., number of regions, number of regions)
+            The symmetric arrays.
+        dtype: numpy.dtype, optional
+            The storage data type, like numpy.float32. Default is None,
+            the data type of the arrays.
+
+        Returns
+        -------
+        output: PackedSymmetricMatrix
+            The packed symmetric arrays.
+        """
+        symmetric_array = np.asarray(symmetric_array)
+        rows, columns = lower_triangle_indices(symmetric_array.shape[-1])
+        lower_triangle = symmetric_array[..., rows, columns]
+        if dtype is not None:
+            lower_triangle = lower_triangle.astype(dtype)
+        return cls(lower_triangle=lower_triangle)
+
+    @property
+    def shape(self):
+        return self.lower_triangle.shape[:-1] + (self.number_of_regions, self.number_of_regions)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return self.lower_triangle.dtype
+
+    @property
+    def nbytes(self):
+        return self.lower_triangle.nbytes
+
+    @property
+    def T(self):
+        # The matrices are symmetric
+        return self
+
+    def diagonal(self):
+        """The diagonal of the matrices."""
+        return self.lower_triangle[..., packed_triangle_positions(self.number_of_regions)]
+
+    def vectorize(self, discard_diagonal=False):
+        """The vectorized matrices, like sym_matrix_to_vec does.
+
+        Parameters
+        ----------
+        discard_diagonal: bool, optional
+            If True, the diagonal is discarded. Else the diagonal coefficients
+            are divided by sqrt(2), like nilearn does. Default is False.
+
+        Returns
+        -------
+        output: numpy.array
+            The vectorized matrices.
+        """
+        if discard_diagonal:
+            return self.lower_triangle[..., packed_triangle_positions(self.number_of_regions, True)]
+        vectorized_array = np.array(self.lower_triangle, dtype=np.result_type(self.dtype, np.float64)) \
+            if self.dtype != bool else self.lower_triangle.copy()
+        if self.dtype != bool:
+            vectorized_array[..., packed_triangle_positions(self.number_of_regions)] /= sqrt(2.)
+        return vectorized_array
+
+    def astype(self, dtype):
+        """The packed matrices, stored in another data type."""
+        return PackedSymmetricMatrix(lower_triangle=self.lower_triangle.astype(dtype))
+
+    def dense(self, dtype=None):
+        """Build the dense symmetric arrays."""
+        rows, columns = lower_triangle_indices(self.number_of_regions)
+        dense_array = np.empty(self.shape, dtype=self.dtype if dtype is None else dtype)
+        dense_array[..., rows, columns] = self.lower_triangle
+        dense_array[..., columns, rows] = self.lower_triangle
+        return dense_array
+
+    def __array__(self, dtype=None, copy=None):
+        return self.dense(dtype=dtype)
+
+    def _is_lower_triangle_mask(self, item):
+        if not (isinstance(item, tuple) and len(item) == 2 and item[0] is Ellipsis):
+            return None
+        mask = item[1]
+        if not (isinstance(mask, np.ndarray) and mask.dtype == bool and
+                mask.shape == (self.number_of_regions, self.number_of_regions)):
+            return None
+        for discard_diagonal in [False, True]:
+            if np.array_equal(mask, np.tri(self.number_of_regions, k=-int(discard_diagonal), dtype=bool)):
+                return discard_diagonal
+        return None
+
+    def __getitem__(self, item):
+        # The lower triangle boolean indexing of sym_matrix_to_vec reads the packed
+        # triangle, and the subjects of a stack are selected without expansion
+        discard_diagonal = self._is_lower_triangle_mask(item)
+        if discard_diagonal is not None:
+            if discard_diagonal:
+                return self.lower_triangle[..., packed_triangle_positions(self.number_of_regions, True)]
+            return self.lower_triangle.copy()
+        if self.lower_triangle.ndim > 1 and not isinstance(item, tuple):
+            return PackedSymmetricMatrix(lower_triangle=self.lower_triangle[item])
+        if isinstance(item, tuple) and len(item) == self.ndim and \
+                all(isinstance(index, (int, np.integer)) for index in item):
+            # A single coefficient
+            row, column = [index % self.number_of_regions for index in item[-2:]]
+            return self.lower_triangle[item[:-2] + (packed_index(row, column),)]
+        return self.dense()[item]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'PackedSymmetricMatrix(shape={}, dtype={})'.format(self.shape, self.dtype)
+
+
+def stack_packed_matrices(matrices):
+    """Stack packed symmetric matrices.
+
+    Parameters
+    ----------
+    matrices: list
+        A list of PackedSymmetricMatrix of the same shape.
+
+    Returns
+    -------
+    output: PackedSymmetricMatrix
+        The stacked packed matrices.
+    """
+    return PackedSymmetricMatrix(lower_triangle=np.array([matrix.lower_triangle for matrix in matrices]))
+
+
+def stack_packed_masks(masks):
+    """Stack subjects boolean masks, as packed lower triangles.
+
+    Parameters
+    ----------
+    masks: list
+        A list of subjects boolean masks, numpy arrays or DiscardedRoisMask.
+
+    Returns
+    -------
+    output: PackedSymmetricMatrix
+        The stacked masks, whose lower triangle has shape (number of subjects,
+        number of regions * (number of regions + 1) / 2).
+    """
+    masks = list(masks)
+    vectorized_masks = [mask.vectorize(discard_diagonal=False) if isinstance(mask, DiscardedRoisMask)
+                        else mask.lower_triangle if isinstance(mask, PackedSymmetricMatrix)
+                        else PackedSymmetricMatrix.from_dense(mask).lower_triangle
+                        for mask in masks]
+
+    return PackedSymmetricMatrix(lower_triangle=stack_masks(vectorized_masks))
+
+
+def matrix_coefficients(matrix, rows, columns):
+    """Read coefficients of a symmetric matrix, dense or compact.
+
+    Parameters
+    ----------
+    matrix: numpy.array, PackedSymmetricMatrix or DiscardedRoisMask
+        The matrix, of shape (..., number of regions, number of regions).
+    rows: numpy.array
+        The rows of the coefficients.
+    columns: numpy.array
+        The columns of the coefficients.
+
+    Returns
+    -------
+    output: numpy.array, shape (..., number of coefficients)
+        The coefficients, read in the packed lower triangle of a packed matrix,
+        and in the discarded rois of a compact mask, without building the
+        dense matrix.
+    """
+    if isinstance(matrix, PackedSymmetricMatrix):
+        return matrix.lower_triangle[..., packed_index(rows, columns)]
+    if isinstance(matrix, DiscardedRoisMask) and not matrix.vectorized:
+        rois_mask = matrix.rois_mask
+        return rois_mask[rows] | rois_mask[columns]
+    return np.asarray(matrix)[..., rows, columns]
+
+
+class SubMatrixIndex(object):
+    """Index of the sub-matrices of a subset of regions.
+
+    The index of the sub-matrices, and of their vectorized lower triangle, in
+    the dense and in the packed connectivity matrices are computed once, and
+    applied as a single fancy index on stacked matrices, so that the sub-matrices
+    of many subsets of regions are extracted without copying the matrices.
+
+    Parameters
+    ----------
+    regions_index: list, or numpy.array of shape (number of indices, )
+        The index of the regions, in the order of the rows of the sub-matrices.
+
+    Notes
+    -----
+    The sub-matrices are read in the lower triangle of packed matrices, which
+    assumes, like the packed storage, that the matrices are symmetric.
+    """
+
+    def __init__(self, regions_index):
+        self.regions_index = np.array(regions_index, dtype=int).ravel()
+        self.regions_index.setflags(write=False)
+        self.number_of_regions = self.regions_index.size
+        self.ix = np.ix_(self.regions_index, self.regions_index)
+        # The rows and columns of the vectorized sub-matrices, in the matrices
+        self._triangle_coefficients = {}
+        self._positions = {}
+        for discard_diagonal in [False, True]:
+            rows, columns = lower_triangle_indices(self.number_of_regions, discard_diagonal)
+            rows, columns = self.regions_index[rows], self.regions_index[columns]
+            positions = packed_index(rows, columns)
+            for index in (rows, columns, positions):
+                index.setflags(write=False)
+            self._triangle_coefficients[discard_diagonal] = (rows, columns)
+            self._positions[discard_diagonal] = positions
+
+    def triangle_coefficients(self, discard_diagonal=False):
+        """The rows and columns, in the matrices, of the vectorized lower triangle of the sub-matrices."""
+        return self._triangle_coefficients[discard_diagonal]
+
+    def positions(self, discard_diagonal=False):
+        """The positions, in the packed matrices, of the vectorized lower triangle of the sub-matrices.
+
+        With the diagonal, the positions are the packed lower triangle of the sub-matrices.
+        """
+        return self._positions[discard_diagonal]
+
+    def take(self, matrices, vectorize=False, discard_diagonal=False):
+        """Extract the sub-matrices of matrices.
+
+        Parameters
+        ----------
+        matrices: numpy.array, PackedSymmetricMatrix or DiscardedRoisMask
+            The matrices, or the stacked matrices, of shape (..., number of regions,
+            number of regions). Boolean masks are accepted.
+        vectorize: bool, optional
+            If True, the sub-matrices are vectorized like sym_matrix_to_vec, the
+            diagonal of numerical matrices being divided by sqrt(2), or like
+            vectorize_boolean_mask for boolean masks. Default is False.
+        discard_diagonal: bool, optional
+            If True, the diagonal is discarded when the sub-matrices are vectorized.
+            Default is False.
+
+        Returns
+        -------
+        output: numpy.array, PackedSymmetricMatrix or DiscardedRoisMask
+            The sub-matrices, of shape (..., number of indices, number of indices), packed
+            for packed matrices, and compact for compact masks, or the vectorized sub-matrices.
+        """
+        discard_diagonal = discard_diagonal and vectorize
+        if isinstance(matrices, DiscardedRoisMask) and not matrices.vectorized:
+            sub_mask = matrices.take_rois(self.regions_index)
+            return sub_mask.vectorize(discard_diagonal=discard_diagonal) if vectorize else sub_mask
+        if isinstance(matrices, PackedSymmetricMatrix):
+            sub_matrices = matrices.lower_triangle[..., self.positions(discard_diagonal)]
+            if not vectorize:
+                return PackedSymmetricMatrix(lower_triangle=sub_matrices)
+        else:
+            matrices = np.asarray(matrices)
+            if not vectorize:
+                return matrices[(Ellipsis, ) + self.ix]
+            rows, columns = self.triangle_coefficients(discard_diagonal)
+            sub_matrices = matrices[..., rows, columns]
+        if not discard_diagonal and sub_matrices.dtype != bool:
+            sub_matrices = sub_matrices.astype(np.result_type(sub_matrices.dtype, np.float64), copy=False)
+            sub_matrices[..., packed_triangle_positions(self.number_of_regions)] /= sqrt(2.)
+        return sub_matrices
+
+    def __len__(self):
+        return self.number_of_regions
+
+    def __repr__(self):
+        return 'SubMatrixIndex(regions_index={})'.format(list(self.regions_index))
+
+
+def features_array(connectivity_matrices, discard_diagonal=True):
+    """The features array of packed connectivity matrices.
+
+    Parameters
+    ----------
+    connectivity_matrices: numpy.array or PackedSymmetricMatrix
+        The vectorized connectivity matrices of shape (number of subjects,
+        number of features), or a stack of packed connectivity matrices.
+    discard_diagonal: bool, optional
+        If True, the diagonal of packed matrices is discarded. Default is True.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, number of features)
+        The features array. Arrays are returned unchanged.
+    """
+    if isinstance(connectivity_matrices, PackedSymmetricMatrix):
+        return connectivity_matrices.vectorize(discard_diagonal=discard_diagonal)
+
+    return connectivity_matrices
+
+
+def stack_masks(masks):
+    """Stack subjects boolean masks, dense or compact.
+
+    Parameters
+    ----------
+    masks: list or numpy.array
+        A list of subjects boolean masks, numpy arrays or DiscardedRoisMask,
+        or an already stacked boolean array.
+
+    Returns
+    -------
+    output: numpy.array, shape (number of subjects, ...)
+        The dense stacked boolean masks.
+
+    Notes
+    -----
+    When all the masks are compact masks of the same form, the stack is
+    computed at once from the discarded rois of each subject.
+    """
+    if isinstance(masks, np.ndarray):
+        return masks
+    if isinstance(masks, (DiscardedRoisMask, PackedSymmetricMatrix)):
+        return masks.dense()
+
+    masks = list(masks)
+    if masks and all(isinstance(mask, DiscardedRoisMask) for mask in masks) and \
+            len({(mask.number_of_regions, mask.vectorized, mask.discard_diagonal) for mask in masks}) == 1:
+        rois_masks = np.array([mask.rois_mask for mask in masks])
+        if masks[0].vectorized:
+            rows, columns = lower_triangle_indices(masks[0].number_of_regions, masks[0].discard_diagonal)
+            return rois_masks[:, rows] | rois_masks[:, columns]
+        return rois_masks[:, :, np.newaxis] | rois_masks[:, np.newaxis, :]
+
+    return np.array([np.asarray(mask) for mask in masks], dtype=bool)
 
 
 def masked_void_rois_connectivity_matrix(subject_kinds_connectivity, kinds,
@@ -47,9 +689,12 @@ def masked_void_rois_connectivity_matrix(subject_kinds_connectivity, kinds,
 
     Returns
     -------
-    output : numpy.array, shape (number of regions, number of regions)
-        A boolean array : True when rois are considered discarded, False elsewhere
-        See notes concerning the discarded roi
+    output 1: DiscardedRoisMask, shape (number of regions, number of regions)
+        A compact boolean mask : True when rois are considered discarded, False elsewhere
+        See notes concerning the discarded roi. It is vectorized if `vectorize`
+        is True.
+    output 2: numpy.array, shape (number of regions, )
+        The diagonal of the mask.
         
     See Also
     --------
@@ -71,6 +716,9 @@ def masked_void_rois_connectivity_matrix(subject_kinds_connectivity, kinds,
     array where True are masked values, and False are un-masked values.
     
     Please refer to the numpy documentation for further details.
+
+    The mask only stores the discarded rois index, see DiscardedRoisMask,
+    and is expanded to a dense boolean array when needed.
     """
     # We fetch the number of regions
     # Get the shape of the matrices
@@ -78,63 +726,22 @@ def masked_void_rois_connectivity_matrix(subject_kinds_connectivity, kinds,
 
     # We fetch the index of discarded rois
     subject_empty_roi = subject_kinds_connectivity['discarded_rois']
-    
-    # Masked array: True for discarded rois, else elsewhere.
 
-    # If we have a 2D subjects connectivity matrices, we initialize a 2D boolean mask
+    # Masked array: True for discarded rois, else elsewhere, stored
+    # as a compact mask.
     if not vectorize:
         numbers_of_regions = matrix_shape[0]
-        mask = np.invert(ma.make_mask(np.ones((numbers_of_regions, numbers_of_regions))))
-        if subject_empty_roi.size:
-            for empty_roi in subject_empty_roi:
-                # True for the entire rows corresponding to the current empty roi
-                mask[:, empty_roi] = True
-                # True for the entire columns corresponding to the current empty roi
-                mask[empty_roi, :] = True
-        # Compute the diagonal of the mask
-        diag_mask = np.diagonal(mask)
+        mask = DiscardedRoisMask(discarded_rois=subject_empty_roi, number_of_regions=numbers_of_regions)
     else:
+        c = len(subject_kinds_connectivity[kinds[0]])
         if discard_diagonal:
-            c = len(subject_kinds_connectivity[kinds[0]])
             numbers_of_regions = int(((sqrt(8 * c + 1) - 1.) / 2) + 1)
-            # Initialise a vectorized mask
-            mask = np.invert(ma.make_mask(np.ones(numbers_of_regions)))
-            # Reconstruct the mask to a matrix
-            _ , mask_m = vectorizer(numpy_array=mask, discard_diagonal=discard_diagonal,
-                                  array_type='boolean')
-            # Fill the corresponding empty ROI with True value
-            if subject_empty_roi.size:
-                for empty_roi in subject_empty_roi:
-                    # True for the entire rows corresponding to the current empty roi
-                    mask_m[:, empty_roi] = True
-                    # True for the entire columns corresponding to the current empty roi
-                    mask_m[empty_roi, :] = True
-
-            # Re-vectorized the matrix boolean mask discarding
-            # the diagonal
-            diag_mask, mask = vectorizer(numpy_array=mask_m,
-                                         discard_diagonal=discard_diagonal,
-                                         array_type='boolean')
         else:
-            c = len(subject_kinds_connectivity[kinds[0]])
             numbers_of_regions = int(((sqrt(8 * c + 1) - 1.) / 2))
-            # Initialise a vectorized mask
-            mask = np.invert(ma.make_mask(np.ones(numbers_of_regions)))
-            # Reconstruct the mask to a matrix
-            _, mask_m = vectorizer(numpy_array=mask, discard_diagonal=False,
-                                   array_type='boolean')
-            # Fill the corresponding empty ROI with True value
-            if subject_empty_roi.size:
-                for empty_roi in subject_empty_roi:
-                    # True for the entire rows corresponding to the current empty roi
-                    mask_m[:, empty_roi] = True
-                    # True for the entire columns corresponding to the current empty roi
-                    mask_m[empty_roi, :] = True
-            # If discard_diagonal is False, we vectorized
-            # the mask keeping the diagonal
-            diag_mask, mask = vectorizer(numpy_array=mask_m,
-                                         discard_diagonal=False,
-                                         array_type='boolean')
+        mask = DiscardedRoisMask(discarded_rois=subject_empty_roi, number_of_regions=numbers_of_regions,
+                                 vectorized=True, discard_diagonal=discard_diagonal)
+    # Compute the diagonal of the mask
+    diag_mask = mask.diagonal()
 
     return mask, diag_mask
 
@@ -218,8 +825,9 @@ def append_masks(subjects_connectivity_dictionnary, kinds,
                     subjects_connectivity_dictionnary[groupe][subject]['masked_array'] = subject_mask
                     subjects_connectivity_dictionnary[groupe][subject]['diagonal_masked_array'] = subject_diag_mask
             else:
-                subject_mask = np.invert(ma.make_mask(np.ones(
-                    subjects_connectivity_dictionnary[groupe][subject][kinds[0]].shape)))
+                subject_mask = DiscardedRoisMask(
+                    discarded_rois=[],
+                    number_of_regions=subjects_connectivity_dictionnary[groupe][subject][kinds[0]].shape[0])
                 if vectorize:
                     if discard_diagonal:
                         subject_diag_mask, subject_mask = vectorizer(numpy_array=subject_mask,
@@ -241,6 +849,219 @@ def append_masks(subjects_connectivity_dictionnary, kinds,
     return new_subjects_connectivity_dictionnary
 
 
+def masked_sums(arrays, masked_array, axis=0):
+    """Compute the sums, and the number of unmasked values, of a masked ndimensional array.
+
+    Parameters
+    ----------
+    arrays : ndimensional numpy.array, shape (..., number of regions, number of regions)
+        The ndimensional array.
+    masked_array : ndimensional numpy.array, shape (..., numbers_of_regions, numbers_of_regions)
+        The ndimensional boolean masked accounting for the values you want to discard.
+        True for masked values, False elsewhere. A list of compact masks,
+        see DiscardedRoisMask, is also accepted.
+    axis : int, optional
+        The direction of the sums. Default is 0.
+
+    Returns
+    -------
+    output 1: numpy.array
+        The sums of the unmasked values along axis, with the dimension of axis kept.
+    output 2: numpy.array
+        The number of unmasked values along axis, with the dimension of axis kept.
+    output 3: numpy.array
+        The mask, as a dense boolean array.
+    """
+    # Compact masks are expanded
+    masked_array = stack_masks(masked_array)
+    if masked_array.shape != np.shape(arrays):
+        raise ValueError('Array dimension is {}, but the '
+                         'corresponding mask is shape {}'.format(np.shape(arrays), masked_array.shape))
+    # The masked values are replaced by zeros, like numpy.ma does before summing
+    sums = np.add.reduce(np.where(masked_array, 0, arrays), axis=axis, keepdims=True)
+    counts = np.add.reduce(~masked_array, axis=axis, keepdims=True)
+
+    return sums, counts, masked_array
+
+
+def masked_sufficient_statistics(arrays, masked_array, axis=0):
+    """Compute the number of unmasked values, their mean and their sum of squared deviations.
+
+    Parameters
+    ----------
+    arrays : ndimensional numpy.array, shape (..., number of regions, number of regions)
+        The ndimensional array.
+    masked_array : ndimensional numpy.array, shape (..., numbers_of_regions, numbers_of_regions)
+        The ndimensional boolean masked accounting for the values you want to discard.
+        True for masked values, False elsewhere. A list of compact masks,
+        see DiscardedRoisMask, is also accepted.
+    axis : int, optional
+        The direction for computing the statistics. Default is 0.
+
+    Returns
+    -------
+    output 1: numpy.array
+        The number of unmasked values along axis.
+    output 2: numpy.array
+        The mean of the unmasked values along axis, zero where all the values are masked.
+    output 3: numpy.array
+        The sum of the squared deviations of the unmasked values to their mean, along axis.
+
+    Notes
+    -----
+    The squared deviations to the mean are summed in a second pass, as numpy.ma
+    does, which is more accurate than the difference of the sum of squares and
+    of the squared sum. The statistics of several samples are combined from these
+    ones only, like the pooled variance of a two samples t-test.
+    """
+    sums, counts, masked_array = masked_sums(arrays=arrays, masked_array=masked_array, axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_array = np.where(counts > 0, sums * 1. / counts, 0.)
+        deviations = np.where(masked_array, 0, arrays - mean_array)
+    squared_deviations_sums = np.add.reduce(deviations * deviations, axis=axis)
+
+    return np.squeeze(counts, axis=axis), np.squeeze(mean_array, axis=axis), squared_deviations_sums
+
+
+def masked_statistics(arrays, masked_array, axis=0, ddof=0):
+    """Compute the mean, standard deviation, and number of unmasked values of a masked ndimensional array.
+
+    The statistics are those of numpy.ma, computed on plain arrays.
+
+    Parameters
+    ----------
+    arrays : ndimensional numpy.array, shape (..., number of regions, number of regions)
+        The ndimensional array.
+    masked_array : ndimensional numpy.array, shape (..., numbers_of_regions, numbers_of_regions)
+        The ndimensional boolean masked accounting for the values you want to discard.
+        True for masked values, False elsewhere. A list of compact masks,
+        see DiscardedRoisMask, is also accepted.
+    axis : int, optional
+        The direction for computing the statistics. Default is 0.
+    ddof : int, optional
+        The delta degrees of freedom of the standard deviation. Default is 0.
+
+    Returns
+    -------
+    output 1: numpy.array
+        The mean array along axis.
+    output 2: numpy.array
+        The standard deviation array along axis.
+    output 3: numpy.array
+        The number of unmasked values along axis.
+
+    Notes
+    -----
+    Like the data of the numpy.ma results, the mean and the standard deviation
+    are zero where all the values are masked, and the standard deviation is
+    zero where the number of unmasked values is not greater than ddof.
+    """
+    counts, mean_array, squared_deviations_sums = masked_sufficient_statistics(arrays=arrays,
+                                                                               masked_array=masked_array, axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std_array = np.where(counts - ddof > 0, np.sqrt(squared_deviations_sums / (counts - ddof)),
+                             squared_deviations_sums)
+
+    return mean_array, std_array, counts
+
+
+def masked_segments_means(arrays, masked_array, segments_starts):
+    """Compute the means of the unmasked values in consecutive segments of the last axis.
+
+    Parameters
+    ----------
+    arrays : numpy.array, shape (..., number of values)
+        The arrays, like the vectorized coefficients of all the networks for
+        each subject.
+    masked_array : numpy.array, shape (..., number of values)
+        The boolean masks, True for the discarded values, False elsewhere.
+    segments_starts : numpy.array, shape (number of segments, )
+        The increasing positions of the first value of each non empty segment,
+        the last segment ending with the last axis.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (..., number of segments)
+        The means of the unmasked values of each segment, zero where all the
+        values of a segment are masked, like the data of numpy.ma.
+    output 2: numpy.array, shape (..., number of segments)
+        The number of unmasked values of each segment.
+
+    Notes
+    -----
+    All the segments of all the arrays are reduced with one numpy.add.reduceat
+    call, the masked values being replaced by zeros, like numpy.ma does.
+    """
+    masked_array = np.asarray(masked_array, dtype=bool)
+    if masked_array.shape != np.shape(arrays):
+        raise ValueError('Array dimension is {}, but the '
+                         'corresponding mask is shape {}'.format(np.shape(arrays), masked_array.shape))
+    if len(segments_starts) == 0:
+        return np.zeros(masked_array.shape[:-1] + (0, )), np.zeros(masked_array.shape[:-1] + (0, ), dtype=np.intp)
+    sums = np.add.reduceat(np.where(masked_array, 0, arrays), segments_starts, axis=-1)
+    counts = np.add.reduceat(~masked_array, segments_starts, axis=-1, dtype=np.intp)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        segments_means = np.where(counts > 0, sums * 1. / counts, 0.)
+
+    return segments_means, counts
+
+
+def masked_block_means(arrays, masked_array, assignment):
+    """Compute the means of the unmasked coefficients in the blocks of symmetric arrays.
+
+    Parameters
+    ----------
+    arrays : numpy.array, shape (..., number of regions, number of regions)
+        The symmetric arrays, like the connectivity matrices of the subjects.
+    masked_array : numpy.array, shape (..., number of regions, number of regions)
+        The boolean masks, True for the discarded coefficients, False elsewhere.
+        A list of compact masks, see DiscardedRoisMask, is also accepted.
+    assignment : numpy.array, shape (number of regions, number of blocks)
+        The number of times each region belongs to each block, usually
+        one or zero, like the network assignment of the regions.
+
+    Returns
+    -------
+    output 1: numpy.array, shape (..., number of blocks, number of blocks)
+        The block means, A^T (M * C) A / A^T M A, with A the assignment, C
+        the arrays and M the unmasked coefficients. The means of the blocks
+        without unmasked coefficient are NaN.
+    output 2: numpy.array, shape (..., number of blocks, number of blocks)
+        The number of unmasked coefficients in each block.
+
+    Notes
+    -----
+    The sums of all the blocks of all the arrays are two batched matrix
+    products, the masked coefficients being replaced by zeros, like
+    numpy.ma does. Like numpy.ma, the blocks with an unmasked NaN
+    coefficient have a NaN mean.
+    """
+    masked_array = stack_masks(masked_array)
+    if masked_array.shape != np.shape(arrays):
+        raise ValueError('Array dimension is {}, but the '
+                         'corresponding mask is shape {}'.format(np.shape(arrays), masked_array.shape))
+    assignment = np.asarray(assignment, dtype=np.float64)
+
+    def block_sums(values):
+        return np.matmul(np.matmul(assignment.T, values), assignment)
+
+    # A non finite coefficient, like a NaN diagonal, would spread to all the
+    # blocks in the products, so that it is counted apart, in its blocks only
+    non_finite = ~np.isfinite(arrays) & ~masked_array
+    sums = block_sums(np.where(masked_array | non_finite, 0., arrays))
+    counts = block_sums((~masked_array).astype(np.float64))
+    block_means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+    if non_finite.any():
+        nan_blocks = block_sums(np.isnan(arrays) & non_finite) > 0
+        positive_infinite_blocks = block_sums(np.isposinf(arrays) & non_finite) > 0
+        negative_infinite_blocks = block_sums(np.isneginf(arrays) & non_finite) > 0
+        block_means[positive_infinite_blocks] = np.inf
+        block_means[negative_infinite_blocks] = -np.inf
+        block_means[nan_blocks | (positive_infinite_blocks & negative_infinite_blocks)] = np.nan
+
+    return block_means, counts
+
+
 def masked_arrays_mean(arrays, masked_array, axis):
     """Compute the arithmetic mean of a ndimensional numpy masked array.
     
@@ -251,7 +1072,8 @@ def masked_arrays_mean(arrays, masked_array, axis):
         
     masked_array : ndimensional numpy.array, shape (..., numbers_of_regions, numbers_of_regions)
         The ndimensional boolean masked accounting for the values you want to discard.
-        True for masked values, False elsewhere.
+        True for masked values, False elsewhere. A list of compact masks,
+        see DiscardedRoisMask, is also accepted.
     
     axis : int
         The direction for computing the mean.
@@ -260,24 +1082,23 @@ def masked_arrays_mean(arrays, masked_array, axis):
     -------
     output : numpy.array shape (number of regions, number of regions)
         The mean array excluding some value in the direction along axis.
+        The mean is zero where all the values are masked.
     
     See Also
     --------
     masked_void_rois_connectivity_matrix :
         This function compute the boolean mask for accounting
         the discarded rois.
+    masked_statistics :
+        The mean, standard deviation and count of unmasked values
+        in one call.
     
     """
-    # Initialization of masked array: a couple of a classical numpy array along with
-    # a boolean array of the same shape
-    mean_array_masked = np.ma.array(data=arrays, mask=masked_array)
-    if masked_array.shape != arrays.shape:
-        raise ValueError('Array dimension is {}, but the '
-                         'corresponding mask is shape {}'.format(arrays.shape, masked_array.shape))
-    
-    mean_array = mean_array_masked.mean(axis=axis).data
-    
-    return mean_array
+    sums, counts, _ = masked_sums(arrays=arrays, masked_array=masked_array, axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_array = np.where(counts > 0, sums * 1. / counts, 0.)
+
+    return np.squeeze(mean_array, axis=axis)
 
 
 def mask_array_std(arrays, masked_array, axis):
@@ -290,15 +1111,17 @@ def mask_array_std(arrays, masked_array, axis):
         
     masked_array : ndimensional numpy.array, shape (..., numbers_of_regions, numbers_of_regions)
         The ndimensional boolean masked accounting for the values you want to discard.
-        True for masked values, False elsewhere.
+        True for masked values, False elsewhere. A list of compact masks,
+        see DiscardedRoisMask, is also accepted.
     
     axis : int
         The direction for computing the standard deviation.
     
     Returns
     -------
-    output : numpy.array shape (number of regions, number of regions)
-        The standard deviation array excluding some value in the direction along axis.
+    output : numpy.ma.MaskedArray shape (number of regions, number of regions)
+        The standard deviation array excluding some value in the direction along axis,
+        masked where all the values are masked.
     
     
     See Also
@@ -306,19 +1129,14 @@ def mask_array_std(arrays, masked_array, axis):
     masked_void_rois_connectivity_matrix :
         This function compute the boolean mask for accounting
         the discarded rois.
+    masked_statistics :
+        The mean, standard deviation and count of unmasked values
+        in one call.
     
     """
-    
-    # Masked array initialization with numpy masked methods.
-    std_array_masked = np.ma.array(data=arrays, mask=masked_array)
-    if masked_array.shape != arrays.shape:
-        raise ValueError('The numerical array have shape {}, but '
-                         'the corresponding mask is shape {} !'.format(arrays.shape,
-                                                                       masked_array.shape))
-
-    std_array = std_array_masked.std(axis=axis)
-    
-    return std_array
+    _, std_array, counts = masked_statistics(arrays=arrays, masked_array=masked_array, axis=axis)
+
+    return np.ma.array(data=std_array, mask=counts == 0)
 
 
 def vectorize_boolean_mask(symmetric_boolean_mask, discard_diagonal=False):
@@ -349,6 +1167,10 @@ def vectorize_boolean_mask(symmetric_boolean_mask, discard_diagonal=False):
         This function reconstruct a flatten boolean ndimensional array.
         
     """
+    # A compact, or packed, mask is vectorized without being expanded
+    if isinstance(symmetric_boolean_mask, (DiscardedRoisMask, PackedSymmetricMatrix)):
+        return np.asarray(symmetric_boolean_mask.vectorize(discard_diagonal=discard_diagonal), dtype=bool)
+
     # Convert the boolean mask to a numerical array
     numerical_mask = np.asanyarray(symmetric_boolean_mask, dtype=int)
 
@@ -422,6 +1244,10 @@ def vectorizer(numpy_array, discard_diagonal=False, array_type='numeric'):
 
     """
 
+    # A compact boolean mask is vectorized without being expanded
+    if isinstance(numpy_array, DiscardedRoisMask):
+        return numpy_array.diagonal(), numpy_array.vectorize(discard_diagonal=discard_diagonal)
+
     # Retrieve the array diagonal
     array_diagonal = np.diag(numpy_array)
 
@@ -489,6 +1315,10 @@ def array_rebuilder(vectorized_array, array_type, diagonal=None):
             rebuild_array = vec_to_sym_matrix(vec=vectorized_array,
                                               diagonal=None)
 
+    elif array_type == 'bool' and isinstance(vectorized_array, DiscardedRoisMask):
+        # A compact mask is rebuilt from the discarded rois
+        rebuild_array = vectorized_array.matrix()
+
     elif array_type == 'bool':
         if diagonal is not None:
             # If the user give the boolean diagonal
@@ -11,6 +11,9 @@ Useful pre-processing step before doing statistical test.
 
 from nilearn.connectome import sym_matrix_to_vec, vec_to_sym_matrix
 import numpy as np
+from conpagnon.utils.array_operation import stack_masks
+from conpagnon.utils import array_operation
+from conpagnon.data_handling import connectivity_store
 
 
 def fisher_transform(symmetric_array):
@@ -20,12 +23,14 @@ def fisher_transform(symmetric_array):
     ----------
     symmetric_array : numpy.ndarray, shape(..., number of regions, numbers of regions)
         A symmetric numpy array, typically correlation, or partial correlation
-        subject connectivity matrices.
+        subject connectivity matrices. Packed matrices, see PackedSymmetricMatrix,
+        are transformed without being expanded.
     
     Returns
     -------
     output : numpy.ndarray, shape(..., number of regions, numbers of regions)
-        The fisher transform of the ndimensional array.
+        The fisher transform of the ndimensional array, packed if the
+        array is packed.
         
     Notes
     -----
@@ -40,6 +45,10 @@ def fisher_transform(symmetric_array):
     
     
     """
+    if isinstance(symmetric_array, array_operation.PackedSymmetricMatrix):
+        fisher_lower_triangle = np.arctanh(symmetric_array.lower_triangle)
+        fisher_lower_triangle[..., array_operation.packed_triangle_positions(symmetric_array.number_of_regions)] = np.nan
+        return array_operation.PackedSymmetricMatrix(lower_triangle=fisher_lower_triangle)
 
     # Discarding diagonal which is one for correlation, and partial correlation, not defined in Z-Fisher transformation
     vectorize_array = sym_matrix_to_vec(symmetric = symmetric_array, discard_diagonal=False)
@@ -83,6 +92,8 @@ def stacked_connectivity_matrices(subjects_connectivity_matrices, kinds):
             discarded rois array index, a 'masked_array' key containing
             the array of Boolean of True for the discarded_rois index, and False
             elsewhere.
+        A ConnectivityStore is also accepted, its groups matrices are returned
+        as packed views of the store arrays, without copy.
             
     kinds : list
         List of kinds you are interrested in.
@@ -94,9 +105,18 @@ def stacked_connectivity_matrices(subjects_connectivity_matrices, kinds):
         is respectively the stacked matrices for one kind in a ndimensional
         array of shape (..., numbers of regions, numbers of regions), and the
         ndimensional boolean mask array of the same shape (..., numbers of regions,
-        numbers of regions).
+        numbers of regions). Packed subjects matrices, see PackedSymmetricMatrix,
+        are stacked as packed matrices, with packed masks.
     
     """
+    if isinstance(subjects_connectivity_matrices, connectivity_store.ConnectivityStore):
+        store = subjects_connectivity_matrices
+        stacked_connectivity_dictionnary = {}
+        for groupe in store.groups:
+            stacked_connectivity_dictionnary[groupe] = {kind: store.stacked(kind, groupe) for kind in kinds}
+            stacked_connectivity_dictionnary[groupe]['masked_array'] = store.stacked_masks(groupe)
+        return stacked_connectivity_dictionnary
+
     #Dictionnary which will contain the stack of connectivity matrices for each groups and kinds.
     stacked_connectivity_dictionnary = dict.fromkeys(subjects_connectivity_matrices)
     for groupe in subjects_connectivity_matrices.keys():
@@ -111,8 +131,12 @@ def stacked_connectivity_matrices(subjects_connectivity_matrices, kinds):
             kind_masked_array = [ subjects_connectivity_matrices[groupe][subject]['masked_array'] for subject in subjects_list if 'masked_array' in subjects_connectivity_matrices[groupe][subject].keys() ]
             
             #We fill a dictionnary with kind connectivity as keys, and stacked connectivity matrices, with masked array if they exist as values
-            stacked_connectivity_dictionnary[groupe][kind] = np.array(kind_groupe_stacked_matrices)
-        
-            stacked_connectivity_dictionnary[groupe]['masked_array'] = np.array(kind_masked_array)
+            if kind_groupe_stacked_matrices and isinstance(kind_groupe_stacked_matrices[0], array_operation.PackedSymmetricMatrix):
+                stacked_connectivity_dictionnary[groupe][kind] = array_operation.stack_packed_matrices(kind_groupe_stacked_matrices)
+                stacked_connectivity_dictionnary[groupe]['masked_array'] = array_operation.stack_packed_masks(kind_masked_array)
+            else:
+                stacked_connectivity_dictionnary[groupe][kind] = np.array(kind_groupe_stacked_matrices)
+
+                stacked_connectivity_dictionnary[groupe]['masked_array'] = stack_masks(kind_masked_array)
             
     return stacked_connectivity_dictionnary
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On disk cache of extracted time series.
+
+Each subject time series is stored in a compact .npy file named
+after a hash of the functional file content, the confounds file
+content, and the extraction parameters (atlas hash included). An
+extraction can then be re-run on a growing cohort, extracting
+only new or modified subjects. The time series of several variants
+of an extraction, like denoising strategies, are stored together in
+a .npz file.
+
+Author: Dhaif BEKHA (dhaif@dhaifbekha.com)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+
+
+def write_atomically(file_path, write_content, mode='w'):
+    """Write a file atomically.
+
+    Parameters
+    ----------
+    file_path: str
+        The full path to the file.
+    write_content: callable
+        A function writing the content in the open file it takes.
+    mode: str, optional
+        The opening mode of the file, 'w' for a text file, 'wb' for
+        a binary file. Default is 'w'.
+
+    Notes
+    -----
+    The content is written in a temporary file of the same directory,
+    which then replaces the file, so that a reader, or a concurrent
+    writer, never sees a partially written file.
+    """
+    file_descriptor, temporary_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)),
+                                                       suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, mode) as f:
+            write_content(f)
+        os.replace(temporary_file, file_path)
+    except BaseException:
+        os.remove(temporary_file)
+        raise
+
+
+def write_json(file_path, content):
+    """Write a JSON file atomically, see write_atomically.
+
+    Parameters
+    ----------
+    file_path: str
+        The full path to the file.
+    content: dict
+        The JSON content. Values which are not JSON serializable are
+        written as their string representation.
+    """
+    write_atomically(file_path=file_path, write_content=lambda f: json.dump(content, f, default=str))
+
+
+def load_file_hashes(cache_directory):
+    """Load the files hashes memorized in a time series cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory.
+
+    Returns
+    -------
+    output: dict
+        The absolute files paths as keys, and the size, modification time
+        and hash of each file as values, empty if no hash is memorized.
+    """
+    hashes_file = os.path.join(cache_directory, 'file_hashes.json')
+    if not os.path.exists(hashes_file):
+        return dict()
+    with open(hashes_file, 'r') as f:
+        return json.load(f)
+
+
+def save_file_hashes(cache_directory, known_hashes):
+    """Memorize files hashes in a time series cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory. It is created
+        if it doesn't exist.
+    known_hashes: dict
+        The files hashes, see file_hash.
+
+    Notes
+    -----
+    The hashes are merged with the hashes memorized since they were
+    loaded, by another extraction for example, and written once,
+    atomically.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    all_hashes = load_file_hashes(cache_directory=cache_directory)
+    all_hashes.update(known_hashes)
+    write_json(file_path=os.path.join(cache_directory, 'file_hashes.json'), content=all_hashes)
+
+
+def file_hash(file_path, known_hashes=None, block_size=2**20):
+    """Compute the SHA-256 hash of a file content.
+
+    Parameters
+    ----------
+    file_path: str
+        The full path to the file.
+    known_hashes: dict, optional
+        The already computed hashes, see load_file_hashes. If given, the
+        file is not read again as long as its size and modification time
+        are unchanged, and the new hash is added in place. Default is None.
+    block_size: int, optional
+        The number of bytes read at once. Default is 1 Mb.
+
+    Returns
+    -------
+    output: str
+        The hexadecimal hash of the file content.
+
+    See Also
+    --------
+    save_file_hashes : Memorize the hashes in the cache, once
+        all the files are hashed.
+    """
+    file_path = os.path.abspath(file_path)
+    file_stat = os.stat(file_path)
+
+    if known_hashes is not None:
+        known_hash = known_hashes.get(file_path)
+        if known_hash is not None and known_hash['size'] == file_stat.st_size \
+                and known_hash['mtime'] == file_stat.st_mtime_ns:
+            return known_hash['hash']
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    content_hash = sha.hexdigest()
+
+    if known_hashes is not None:
+        known_hashes[file_path] = {'size': file_stat.st_size, 'mtime': file_stat.st_mtime_ns,
+                                   'hash': content_hash}
+
+    return content_hash
+
+
+def time_series_cache_key(functional_file_hash, confounds_file_hash, extraction_parameters):
+    """Build the cache key of a subject time series.
+
+    Parameters
+    ----------
+    functional_file_hash: str
+        The hash of the subject functional file content.
+    confounds_file_hash: str or None
+        The hash of the subject confounds file content, None
+        if no confounds are regressed.
+    extraction_parameters: dict
+        The parameters of the extraction, including the atlas hash. The
+        values should be JSON serializable, other values are converted
+        to their string representation.
+
+    Returns
+    -------
+    output: str
+        The hexadecimal key of the subject time series.
+    """
+    key_content = json.dumps({'functional_file': functional_file_hash,
+                              'confounds_file': confounds_file_hash,
+                              'parameters': extraction_parameters},
+                             sort_keys=True, default=str)
+
+    return hashlib.sha256(key_content.encode('utf-8')).hexdigest()
+
+
+def load_cached_time_series(cache_directory, key):
+    """Load a subject time series from the cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory.
+    key: str
+        The cache key of the time series.
+
+    Returns
+    -------
+    output: numpy.array, dict or None
+        The cached time series, or the dictionary of the time series of
+        each variant, None if the key is not in the cache.
+
+    Notes
+    -----
+    The last use date of the entry is updated, see
+    evict_time_series_cache. An entry which can't be read is a cache
+    miss, the time series being extracted and saved again.
+    """
+    time_series_file = os.path.join(cache_directory, key + '.npy')
+    variants_file = os.path.join(cache_directory, key + '.npz')
+    metadata_file = os.path.join(cache_directory, key + '.json')
+    try:
+        if os.path.exists(time_series_file):
+            time_series = np.load(time_series_file)
+        elif os.path.exists(variants_file):
+            with np.load(variants_file) as variants_time_series:
+                time_series = {variant: variants_time_series[variant] for variant in variants_time_series.files}
+        else:
+            return None
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        # An unreadable entry, like a file truncated by an older version, is extracted again
+        return None
+    try:
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        metadata = None
+    if metadata is not None:
+        metadata['last_used'] = time.time()
+        write_json(file_path=metadata_file, content=metadata)
+
+    return time_series
+
+
+def save_cached_time_series(cache_directory, key, time_series, metadata=None):
+    """Save a subject time series in the cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory. It is created
+        if it doesn't exist.
+    key: str
+        The cache key of the time series.
+    time_series: numpy.array, shape (number of time points, number of regions), or dict
+        The subject time series, or a dictionary with the time series
+        of each variant of the extraction as values.
+    metadata: dict, optional
+        Information stored along the time series, like the subject
+        identifier or the functional file path, for listing purpose.
+
+    Notes
+    -----
+    The time series and the metadata are written atomically, see
+    write_atomically, so that the concurrent workers of an extraction
+    can save their subjects in the same cache.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+
+    entry_metadata = dict(metadata) if metadata is not None else dict()
+    if isinstance(time_series, dict):
+        write_atomically(file_path=os.path.join(cache_directory, key + '.npz'),
+                         write_content=lambda f: np.savez(f, **time_series), mode='wb')
+        entry_metadata['shape'] = {variant: list(variant_time_series.shape)
+                                   for variant, variant_time_series in time_series.items()}
+    else:
+        write_atomically(file_path=os.path.join(cache_directory, key + '.npy'),
+                         write_content=lambda f: np.save(f, time_series), mode='wb')
+        entry_metadata['shape'] = list(time_series.shape)
+    entry_metadata['created'] = entry_metadata['last_used'] = time.time()
+    write_json(file_path=os.path.join(cache_directory, key + '.json'), content=entry_metadata)
+
+
+def list_time_series_cache(cache_directory):
+    """List the entries of a time series cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory.
+
+    Returns
+    -------
+    output: pandas.DataFrame
+        A dataframe indexed by the cache keys, with the stored metadata
+        as columns, the size on disk in bytes, and a boolean column
+        'functional_file_exists' flagging entries whose functional file
+        is no longer found.
+    """
+    entries = []
+    if os.path.exists(cache_directory):
+        for filename in sorted(os.listdir(cache_directory)):
+            key, extension = os.path.splitext(filename)
+            if extension not in ['.npy', '.npz']:
+                continue
+            metadata_file = os.path.join(cache_directory, key + '.json')
+            entry = {}
+            if os.path.exists(metadata_file):
+                with open(metadata_file, 'r') as f:
+                    entry = json.load(f)
+            entry['key'] = key
+            entry['size'] = os.path.getsize(os.path.join(cache_directory, filename))
+            entry['functional_file_exists'] = os.path.exists(entry.get('functional_file', ''))
+            entries.append(entry)
+
+    if not entries:
+        return pd.DataFrame(columns=['key']).set_index('key')
+
+    return pd.DataFrame(entries).set_index('key')
+
+
+def evict_time_series_cache(cache_directory, keys=None, not_used_since=None, missing_functional_file=False):
+    """Remove stale entries from a time series cache.
+
+    Parameters
+    ----------
+    cache_directory: str
+        The full path to the cache directory.
+    keys: list, optional
+        The list of keys to remove.
+    not_used_since: float, optional
+        A time stamp, in seconds since the epoch. Entries not
+        used since this date are removed.
+    missing_functional_file: bool, optional
+        If True, entries whose functional file is no longer found
+        are removed. Default is False.
+
+    Returns
+    -------
+    output: list
+        The list of removed keys.
+    """
+    cache_entries = list_time_series_cache(cache_directory=cache_directory)
+
+    keys_to_evict = set(keys) if keys is not None else set()
+    if not_used_since is not None and 'last_used' in cache_entries.columns:
+        keys_to_evict.update(cache_entries.index[cache_entries['last_used'] < not_used_since])
+    if missing_functional_file and 'functional_file_exists' in cache_entries.columns:
+        keys_to_evict.update(cache_entries.index[~cache_entries['functional_file_exists']])
+
+    evicted_keys = []
+    for key in sorted(keys_to_evict.intersection(cache_entries.index)):
+        for extension in ['.npy', '.npz', '.json']:
+            entry_file = os.path.join(cache_directory, key + extension)
+            if os.path.exists(entry_file):
+                os.remove(entry_file)
+        evicted_keys.append(key)
+
+    return evicted_keys